@@ -33,8 +33,9 @@ log = logging.getLogger(__name__)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 import custom_indicators as cta
+import SignalModel
+import TradeState
 
-import pywt
 import scipy
 
 
@@ -87,7 +88,9 @@ class DWT_LongShort(IStrategy):
     margin_mode = "isolated"
     can_short = True
 
-    custom_trade_info = {}
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'rmi-up-trend', 'rmi-dn-trend', 'ssl-dir', 'candle-up-trend', 'candle-dn-trend']
+    trade_state = None
 
     ###################################
 
@@ -96,6 +99,7 @@ class DWT_LongShort(IStrategy):
     ## Hyperopt Variables
 
     dwt_window = startup_candle_count
+    signal_engine = SignalModel.create_model('dwt', wavelet='haar', mode='smooth')  # vectorized rolling model
 
     # DWT  hyperparams
     entry_long_dwt_diff = DecimalParameter(0.0, 5.0, decimals=1, default=2.0, space='buy', load=True, optimize=True)
@@ -165,13 +169,16 @@ class DWT_LongShort(IStrategy):
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
 
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
+
         # Base pair informative timeframe indicators
         curr_pair = metadata['pair']
         informative = self.dp.get_pair_dataframe(pair=curr_pair, timeframe=self.inf_timeframe)
 
         # DWT
 
-        informative['dwt_model'] = informative['close'].rolling(window=self.dwt_window).apply(self.model)
+        informative['dwt_model'] = self.signal_engine.rolling(informative['close'].to_numpy(), self.dwt_window)
 
         # merge into normal timeframe
         dataframe = merge_informative_pair(dataframe, informative, self.timeframe, self.inf_timeframe, ffill=True)
@@ -189,11 +196,6 @@ class DWT_LongShort(IStrategy):
 
         # Custom Stoploss
 
-        if not metadata['pair'] in self.custom_trade_info:
-            self.custom_trade_info[metadata['pair']] = {}
-            if not 'had-trend' in self.custom_trade_info[metadata["pair"]]:
-                self.custom_trade_info[metadata['pair']]['had-trend'] = False
-
         # MA Streak: https://www.tradingview.com/script/Yq1z7cIv-MA-Streak-Can-Show-When-a-Run-Is-Getting-Long-in-the-Tooth/
         # dataframe['mastreak'] = cta.mastreak(dataframe, period=4)
 
@@ -235,99 +237,9 @@ class DWT_LongShort(IStrategy):
         dataframe['sroc'] = cta.SROC(dataframe, roclen=21, emalen=13, smooth=21)
         dataframe['ssl-dir'] = np.where(sslup > ssldown, 'up', 'down')
 
-        return dataframe
-
-    ###################################
-
-
-    def madev(self, d, axis=None):
-        """ Mean absolute deviation of a signal """
-        return np.mean(np.absolute(d - np.mean(d, axis)), axis)
-
-    def dwtModel(self, data):
-
-        # the choice of wavelet makes a big difference
-        # for an overview, check out: https://www.kaggle.com/theoviel/denoising-with-direct-wavelet-transform
-        # wavelet = 'db1'
-        # wavelet = 'bior1.1'
-        wavelet = 'haar' # deals well with harsh transitions
-        level = 1
-        wmode = "smooth"
-        length = len(data)
-
-        coeff = pywt.wavedec(data, wavelet, mode=wmode)
-
-        # remove higher harmonics
-        sigma = (1 / 0.6745) * self.madev(coeff[-level])
-        uthresh = sigma * np.sqrt(2 * np.log(length))
-        coeff[1:] = (pywt.threshold(i, value=uthresh, mode='hard') for i in coeff[1:])
-
-        # inverse transform
-        model = pywt.waverec(coeff, wavelet, mode=wmode)
-
-        return model
-
-    def model(self, a: np.ndarray) -> np.float:
-        #must return scalar, so just calculate prediction and take last value
-        # model = self.dwtModel(np.array(a))
-
-        # de-trend the data
-        w_mean = a.mean()
-        w_std = a.std()
-        x_notrend = (a - w_mean) / w_std
-
-        # get DWT model of data
-        restored_sig = self.dwtModel(x_notrend)
-
-        # re-trend
-        model = (restored_sig * w_std) + w_mean
+        self.trade_state.update(metadata['pair'], dataframe)
 
-        length = len(model)
-        return model[length-1]
-
-    def scaledModel(self, a: np.ndarray) -> np.float:
-        #must return scalar, so just calculate prediction and take last value
-        # model = self.dwtModel(np.array(a))
-
-        # de-trend the data
-        w_mean = a.mean()
-        w_std = a.std()
-        x_notrend = (a - w_mean) / w_std
-
-        # get DWT model of data
-        model = self.dwtModel(x_notrend)
-
-        length = len(model)
-        return model[length-1]
-
-    def scaledData(self, a: np.ndarray) -> np.float:
-
-        # scale the data
-        standardized = a.copy()
-        w_mean = np.mean(standardized)
-        w_std = np.std(standardized)
-        scaled = (standardized - w_mean) / w_std
-        # scaled.fillna(0, inplace=True)
-
-        length = len(scaled)
-        return scaled.ravel()[length-1]
-
-    def predict(self, a: np.ndarray) -> np.float:
-
-        # predicts the next value using polynomial extrapolation
-
-        # a.fillna(0)
-
-        # fit the supplied data
-        # Note: extrapolation is notoriously fickle. Be careful
-        length = len(a)
-        x = np.arange(length)
-        f = scipy.interpolate.UnivariateSpline(x, a, k=5)
-
-        # predict 1 step ahead
-        predict = f(length)
-
-        return predict
+        return dataframe
 
     ###################################
 
@@ -482,10 +394,11 @@ class DWT_LongShort(IStrategy):
     def custom_stoploss(self, pair: str, trade: 'Trade', current_time: datetime, current_rate: float,
                         current_profit: float, **kwargs) -> float:
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had-trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit <  self.cstop_max_stoploss.value:
@@ -515,8 +428,9 @@ class DWT_LongShort(IStrategy):
     def custom_exit_long(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                              current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0.0, trade.calc_profit_ratio(trade.max_rate))
@@ -549,7 +463,7 @@ class DWT_LongShort(IStrategy):
         # Don't exit if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful exit message later
-            self.custom_trade_info[trade.pair]['had-trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a exit, maybe
             if self.cexit_long_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_long_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -563,12 +477,12 @@ class DWT_LongShort(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had-trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_roi'
                 elif self.cexit_long_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_noroi'
             elif current_profit > min_roi:
                 return 'notrend_roi'
@@ -578,8 +492,9 @@ class DWT_LongShort(IStrategy):
     def custom_exit_short(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0.0, trade.calc_profit_ratio(trade.max_rate))
@@ -612,7 +527,7 @@ class DWT_LongShort(IStrategy):
         # Don't exit if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful exit message later
-            self.custom_trade_info[trade.pair]['had-trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a exit, maybe
             if self.cexit_short_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_short_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -626,12 +541,12 @@ class DWT_LongShort(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had-trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'short_trend_roi'
                 elif self.cexit_short_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'short_trend_noroi'
             elif current_profit > min_roi:
                 return 'short_notrend_roi'
@@ -648,4 +563,3 @@ class DWT_LongShort(IStrategy):
             return self.custom_exit_long(pair, trade, current_time, current_rate, current_profit)
 
 
-
@@ -0,0 +1,145 @@
+import numpy as np
+import talib.abstract as ta
+import freqtrade.vendor.qtpylib.indicators as qtpylib
+
+from freqtrade.strategy import DecimalParameter
+
+from pandas import DataFrame, Series
+
+# Get rid of pandas warnings during backtesting
+import pandas as pd
+
+pd.options.mode.chained_assignment = None  # default='warn'
+
+# Strategy specific imports, files must reside in same folder as strategy
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import logging
+import warnings
+
+log = logging.getLogger(__name__)
+# log.setLevel(logging.DEBUG)
+warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
+
+from SignalStrategy import SignalStrategy
+
+
+"""
+####################################################################################
+FBBStrategy - base class for the FBB_* strategies: a signal model (see SignalStrategy),
+              combined with Fisher/Williams/Bollinger buy/sell signals
+              The model is good at detecting swings, while the FBB checks are to try and keep
+              trades within oversold/overbought regions
+
+    Subclasses define the model settings and the model entry/exit parameters, which are named buy_<signal_name>_diff
+    and sell_<signal_name>_diff (set entry_param/exit_param). The difference is the fraction (not %)
+####################################################################################
+"""
+
+
+class FBBStrategy(SignalStrategy):
+
+    signal_diff_scale = 1.0
+    fbb_entry_tag = 'fbb_buy'
+
+    ## Hyperopt Variables
+
+    # FBB_ hyperparams
+    buy_bb_gain = DecimalParameter(0.01, 0.50, decimals=2, default=0.09, space='buy', load=True, optimize=True)
+    buy_fisher_wr = DecimalParameter(-0.99, -0.75, decimals=2, default=-0.75, space='buy', load=True, optimize=True)
+    buy_force_fisher_wr = DecimalParameter(-0.99, -0.85, decimals=2, default=-0.99, space='buy', load=True, optimize=True)
+
+    sell_bb_gain = DecimalParameter(0.7, 1.5, decimals=2, default=0.8, space='sell', load=True, optimize=True)
+    sell_fisher_wr = DecimalParameter(0.75, 0.99, decimals=2, default=0.9, space='sell', load=True, optimize=True)
+    sell_force_fisher_wr = DecimalParameter(0.85, 0.99, decimals=2, default=0.99, space='sell', load=True, optimize=True)
+
+    ###################################
+
+    """
+    Indicator Definitions
+    """
+
+    def add_strategy_indicators(self, dataframe: DataFrame) -> DataFrame:
+
+        # FisherBB
+
+        dataframe['rsi'] = ta.RSI(dataframe, timeperiod=14)
+        rsi = 0.1 * (dataframe['rsi'] - 50)
+        dataframe['fisher_rsi'] = (np.exp(2 * rsi) - 1) / (np.exp(2 * rsi) + 1)
+
+        bollinger = qtpylib.bollinger_bands(dataframe['close'], window=20, stds=2)
+        dataframe['bb_lowerband'] = bollinger['lower']
+        dataframe['bb_middleband'] = bollinger['mid']
+        dataframe['bb_upperband'] = bollinger['upper']
+        dataframe["bb_gain"] = ((dataframe["bb_upperband"] - dataframe["close"]) / dataframe["close"])
+
+        # Williams %R
+        dataframe['wr'] = 0.02 * (self.williams_r(dataframe, period=14) + 50.0)
+
+        # Combined Fisher RSI and Williams %R
+        dataframe['fisher_wr'] = (dataframe['wr'] + dataframe['fisher_rsi']) / 2.0
+
+        return dataframe
+
+    # Williams %R: where the close is within the high/low range of the last period candles, from −100 (lowest)
+    # to 0 (highest)
+    def williams_r(self, dataframe: DataFrame, period: int = 14) -> Series:
+        highest_high = dataframe["high"].rolling(center=False, window=period).max()
+        lowest_low = dataframe["low"].rolling(center=False, window=period).min()
+
+        WR = Series(
+            (highest_high - dataframe["close"]) / (highest_high - lowest_low),
+            name=f"{period} Williams %R",
+        )
+
+        return WR * -100
+
+    ###################################
+
+    """
+    Entry/Exit Conditions
+    """
+
+    def add_entry_conditions(self, dataframe: DataFrame, conditions: list):
+
+        # FBB_ triggers
+        fbb_cond = (
+                (dataframe['fisher_wr'] <= self.buy_fisher_wr.value) &
+                (dataframe['bb_gain'] >= self.buy_bb_gain.value)
+        )
+
+        strong_buy_cond = (
+                (
+                        (dataframe['bb_gain'] >= 1.5 * self.buy_bb_gain.value) |
+                        (dataframe['fisher_wr'] < self.buy_force_fisher_wr.value)
+                ) &
+                (
+                    (dataframe['bb_gain'] > 0.02)  # make sure there is some potential gain
+                )
+        )
+        conditions.append(fbb_cond | strong_buy_cond)
+
+        # set entry tags
+        dataframe.loc[fbb_cond, 'enter_tag'] += f"{self.fbb_entry_tag} "
+        dataframe.loc[strong_buy_cond, 'enter_tag'] += 'strong '
+
+    def add_exit_conditions(self, dataframe: DataFrame, conditions: list):
+
+        # FBB_ triggers
+        fbb_cond = (
+                (dataframe['fisher_wr'] > self.sell_fisher_wr.value) &
+                (dataframe['close'] >= (dataframe['bb_upperband'] * self.sell_bb_gain.value))
+        )
+
+        strong_sell_cond = (
+            qtpylib.crossed_above(dataframe['fisher_wr'], self.sell_force_fisher_wr.value)
+        )
+
+        conditions.append(fbb_cond | strong_sell_cond)
+
+        # set exit tags
+        dataframe.loc[fbb_cond, 'exit_tag'] += 'fbb_sell '
+        dataframe.loc[strong_sell_cond, 'exit_tag'] += 'strong_sell '
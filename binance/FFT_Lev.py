@@ -33,7 +33,8 @@ log = logging.getLogger(__name__)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 import custom_indicators as cta
-
+import SignalModel
+import TradeState
 
 
 """
@@ -75,7 +76,9 @@ class FFT_Lev(IStrategy):
     startup_candle_count: int = 128
     process_only_new_candles = True
 
-    custom_trade_info = {}
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'rmi-up-trend', 'ssl-dir', 'candle-up-trend']
+    trade_state = None
 
     ###################################
 
@@ -83,6 +86,7 @@ class FFT_Lev(IStrategy):
 
 
     fft_window = startup_candle_count
+    signal_engine = SignalModel.create_model('fft', threshold=20)  # vectorized rolling model
     fft_lookahead = 0
 
     ## Hyperopt Variables
@@ -156,13 +160,16 @@ class FFT_Lev(IStrategy):
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
 
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
+
         # Base pair informative timeframe indicators
         curr_pair = metadata['pair']
         informative = self.dp.get_pair_dataframe(pair=curr_pair, timeframe=self.inf_timeframe)
 
         # FFT
 
-        informative['fft_predict'] = informative['close'].rolling(window=self.fft_window).apply(self.model)
+        informative['fft_predict'] = self.signal_engine.rolling(informative['close'].to_numpy(), self.fft_window)
 
         # merge into normal timeframe
         dataframe = merge_informative_pair(dataframe, informative, self.timeframe, self.inf_timeframe, ffill=True)
@@ -175,11 +182,6 @@ class FFT_Lev(IStrategy):
 
         # Custom Stoploss
 
-        if not metadata['pair'] in self.custom_trade_info:
-            self.custom_trade_info[metadata['pair']] = {}
-            if not 'had-trend' in self.custom_trade_info[metadata["pair"]]:
-                self.custom_trade_info[metadata['pair']]['had-trend'] = False
-
         # RMI: https://www.tradingview.com/script/kwIt9OgQ-Relative-Momentum-Index/
         dataframe['rmi'] = cta.RMI(dataframe, length=24, mom=5)
 
@@ -201,111 +203,13 @@ class FFT_Lev(IStrategy):
         dataframe['sroc'] = cta.SROC(dataframe, roclen=21, emalen=13, smooth=21)
         dataframe['ssl-dir'] = np.where(sslup > ssldown, 'up', 'down')
 
+        self.trade_state.update(metadata['pair'], dataframe)
+
         return dataframe
 
     ###################################
 
 
-    def model(self, a: np.ndarray) -> np.float:
-        #must return scalar, so just calculate prediction and take last value
-
-        # scale the data
-        standardized = a.copy()
-        w_mean = np.mean(standardized)
-        w_std = np.std(standardized)
-        scaled = (standardized - w_mean) / w_std
-
-        ys = self.fourierModel(scaled)
-
-        # restore the data
-        model = (ys * w_std) + w_mean
-
-        length = len(model)
-        return model[length-1]
-
-    def fourierModel(self, x):
-
-        n = len(x)
-        xa = np.array(x)
-
-
-        # compute the fft
-        fft = scipy.fft.fft(xa, n)
-
-        # compute power spectrum density
-        # squared magnitude of each fft coefficient
-        psd = fft * np.conj(fft) / n
-        threshold = 20
-        fft = np.where(psd<threshold, 0, fft)
-
-        # inverse fourier transform
-        ifft = scipy.fft.ifft(fft)
-
-        ifft = ifft.real
-
-        ldiff = len(ifft) - len(xa)
-        model = ifft[ldiff:]
-
-        return model
-
-    def scaledModel(self, a: np.ndarray) -> np.float:
-
-        # scale the data
-        standardized = a.copy()
-        w_mean = np.mean(standardized)
-        w_std = np.std(standardized)
-        scaled = (standardized - w_mean) / w_std
-        scaled.fillna(0, inplace=True)
-
-        # get the Fourier model
-        model = self.fourierModel(scaled)
-
-        length = len(model)
-        return model[length-1]
-
-    def scaledData(self, a: np.ndarray) -> np.float:
-
-        # scale the data
-        standardized = a.copy()
-        w_mean = np.mean(standardized)
-        w_std = np.std(standardized)
-        scaled = (standardized - w_mean) / w_std
-        scaled.fillna(0, inplace=True)
-
-        length = len(scaled)
-        return scaled.ravel()[length-1]
-
-    def predict(self, a: np.ndarray) -> np.float:
-        #must return scalar, so just calculate prediction and take last value
-        npredict = self.fft_lookahead
-        # y = self.fourierExtrapolation(np.array(a), 0)
-
-        # scale the data
-        standardized = a.copy()
-        w_mean = np.mean(standardized)
-        w_std = np.std(standardized)
-        scaled = (standardized - w_mean) / w_std
-        scaled.fillna(0, inplace=True)
-
-        # get the Fourier model
-        ys = self.fourierModel(scaled)
-
-        # restore the data
-        y = (ys * w_std) + w_mean
-
-        length = len(y)
-        if npredict == 0:
-            predict = y[length-1]
-        else:
-            # Note: extrapolation is notoriously fickle. Be careful
-            x = np.arange(length)
-            f = scipy.interpolate.UnivariateSpline(x, y, k=3)
-
-            predict = f(length-1+npredict)
-
-        return predict
-
-
     # # Williams %R
     # def williams_r(self, dataframe: DataFrame, period: int = 14) -> Series:
     #     """Williams %R, or just %R, is a technical analysis oscillator showing the current closing price in relation to the high and low
@@ -403,10 +307,11 @@ class FFT_Lev(IStrategy):
     def custom_stoploss(self, pair: str, trade: 'Trade', current_time: datetime, current_rate: float,
                         current_profit: float, **kwargs) -> float:
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had-trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit <  self.cstop_max_stoploss.value:
@@ -436,8 +341,9 @@ class FFT_Lev(IStrategy):
     def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0, trade.calc_profit_ratio(trade.max_rate))
@@ -470,7 +376,7 @@ class FFT_Lev(IStrategy):
         # Don't sell if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful sell message later
-            self.custom_trade_info[trade.pair]['had-trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a sell, maybe
             if self.cexit_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -484,12 +390,12 @@ class FFT_Lev(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had-trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_roi'
                 elif self.cexit_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_noroi'
             elif current_profit > min_roi:
                 return 'notrend_roi'
@@ -0,0 +1,122 @@
+# Per-pair store of the state used by the custom_stoploss()/custom_exit() callbacks
+#
+# The callbacks used to fetch the analysed dataframe and extract the last row (dataframe.iloc[-1].squeeze()) on every
+# call, which builds a pandas Series from every column of the dataframe, just to read a handful of values.
+# Since the callbacks are run for every open trade on every candle (and on every detail candle), that was a large part
+# of the time spent in backtests with many concurrent trades.
+#
+# Instead, the (few) columns used by the callbacks are copied into a numpy structured array once, when the dataframe
+# is analysed, and the callbacks read the record for the current candle. The record is the last row with a date at or
+# before current_time, which is the same row that get_analyzed_dataframe() returns last in backtests (the dataframe
+# is sliced up to the current candle), and the last row in live/dry runs.
+# Lookups are O(1) in practice, since the time only moves forward (for each pair) in both cases.
+#
+# The store also holds the per-pair trade state that was kept in the custom_trade_info dicts (had_trend).
+#
+# Usage:
+#    self.trade_state = TradeState.TradeStateStore(['sroc', 'mfi', 'rmi_up_trend', 'ssl_dir', 'candle_up_trend'])
+#
+#    # at the end of populate_indicators():
+#    self.trade_state.update(pair, dataframe)
+#
+#    # in the callbacks:
+#    state = self.trade_state.get_state(pair)
+#    candle = self.trade_state.get_candle(pair, current_time)
+#    if candle['sroc'] <= ...
+#    state.had_trend = True
+
+import numpy as np
+from pandas import DataFrame
+
+
+# state for a single pair
+class PairState:
+    __slots__ = ('dates', 'candles', 'had_trend', 'index', 'time')
+
+    def __init__(self):
+        self.dates = None  # candle dates (epoch secs)
+        self.candles = None  # structured array with the stored columns
+        self.had_trend = False  # trade was in a trend (see custom_exit)
+        self.index = -1  # index of the last lookup
+        self.time = -1  # time of the last lookup (epoch secs)
+
+
+class TradeStateStore:
+    columns = []
+    pairs = {}
+    dtype = None
+
+    # ---------------------------
+
+    def __init__(self, columns):
+        super().__init__()
+        self.columns = list(columns)
+        self.pairs = {}
+        self.dtype = None
+
+    # returns the state for the pair, creating it if necessary
+    def get_state(self, pair) -> PairState:
+        state = self.pairs.get(pair, None)
+        if state is None:
+            state = PairState()
+            self.pairs[pair] = state
+        return state
+
+    # numeric columns are stored as float, anything else (e.g. strings) as objects
+    def get_dtype(self, dataframe: DataFrame):
+        fields = []
+        for col in self.columns:
+            if (col in dataframe.columns) and (dataframe[col].dtype.kind not in 'biuf'):
+                fields.append((col, object))
+            else:
+                fields.append((col, np.float64))
+        return np.dtype(fields)
+
+    # copy the stored columns from the (analysed) dataframe. Missing columns are set to NaN
+    def update(self, pair, dataframe: DataFrame):
+        dtype = self.dtype
+        if dtype is None:
+            dtype = self.get_dtype(dataframe)
+            # missing columns are stored as float, so only keep the dtype once all columns are present (some
+            # strategies only calculate the indicators for some pairs)
+            if all(col in dataframe.columns for col in self.columns):
+                self.dtype = dtype
+
+        state = self.get_state(pair)
+
+        candles = np.empty(len(dataframe), dtype=dtype)
+        for col in self.columns:
+            if col in dataframe.columns:
+                candles[col] = dataframe[col].to_numpy()
+            else:
+                candles[col] = np.nan
+
+        state.dates = dataframe['date'].values.astype('datetime64[s]').astype(np.int64)  # .values is UTC (no timezone)
+        state.candles = candles
+        state.index = -1
+        state.time = -1
+
+    # returns the record for the candle at current_time (None if there is no data for the pair)
+    def get_candle(self, pair, current_time):
+        state = self.pairs.get(pair, None)
+        if (state is None) or (state.candles is None) or (len(state.candles) == 0):
+            return None
+
+        dates = state.dates
+        time = int(current_time.timestamp())
+
+        index = state.index
+        last = len(dates) - 1
+        if (index >= 0) and (time >= state.time):
+            # time moves forward, so (usually) this is the same or the next candle as the last lookup
+            if (index < last) and (dates[index + 1] <= time):
+                index += 1
+                if (index < last) and (dates[index + 1] <= time):
+                    index = int(np.searchsorted(dates, time, side='right')) - 1
+        else:
+            index = int(np.searchsorted(dates, time, side='right')) - 1
+
+        index = max(index, 0)
+        state.index = index
+        state.time = time
+        return state.candles[index]
@@ -41,6 +41,8 @@ log = logging.getLogger(__name__)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 import custom_indicators as cta
+import StageProfiler
+import TradeState
 from finta import TA as fta
 
 from sklearn.model_selection import RandomizedSearchCV, train_test_split
@@ -96,6 +98,9 @@ from AnomalyDetector_Ensemble import AnomalyDetector_Ensemble
 
 from DataframeUtils import DataframeUtils, ScalerType
 from DataframePopulator import DataframePopulator
+from FeatureStore import FeatureStore
+from WalkForward import WalkForward
+from PairPrecompute import PairPrecompute
 
 """
 ####################################################################################
@@ -189,7 +194,9 @@ class Anomaly(IStrategy):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'mfi', 'rmi_up_trend', 'ssl_dir', 'candle_up_trend']
+    trade_state = None
 
     compressor = None
     compress_data = True
@@ -197,6 +204,14 @@ class Anomaly(IStrategy):
 
     dataframeUtils = None
     dataframePopulator = None
+    featureStore = None
+    use_feature_store = True  # load/save populated indicators in a persistent store (see FeatureStore)
+    walkForward = None
+    last_predict_date = {}  # date of the last row predicted, by pair & classifier (for streaming predictions)
+    retrain_interval = 32  # number of candles between re-training of the models (see WalkForward)
+    pairPrecompute = None
+    parallel_precompute = True  # pre-compute all pairs in parallel (backtest only, see PairPrecompute)
+    precompute_workers = 0  # number of processes used for pre-computation. 0 means use all CPUs
 
     num_pairs = 0
     buy_classifier = None
@@ -372,10 +387,35 @@ class Anomaly(IStrategy):
 
     ###################################
 
+    # called by freqtrade after the strategy has been loaded (and dp is available)
+    def bot_start(self, **kwargs) -> None:
+        if self.parallel_precompute:
+            if self.can_precompute():
+                self.run_precompute()
+            else:
+                print("    WARN: parallel_precompute is not used, since models are shared across pairs")
+
+    # runs populate_indicators() for all pairs in parallel worker processes (backtest only, first call only)
+    def run_precompute(self):
+        if self.pairPrecompute is None:
+            self.pairPrecompute = PairPrecompute(max_workers=self.precompute_workers)
+        if self.pairPrecompute.is_enabled(self):
+            self.pairPrecompute.run(self)
+
+    # returns True if the pairs can be processed independently (in parallel). The keras-based detectors use a single
+    # model for all pairs, which is trained on each pair in turn (and the workers would all write the same model file)
+    def can_precompute(self) -> bool:
+        return self.classifier_type not in (self.ClassifierType.CompressionAutoEncoder,
+                                            self.ClassifierType.LSTMAutoEncoder,
+                                            self.ClassifierType.MLPAutoEncoder)
+
+    ###################################
+
     """
     Indicator Definitions
     """
 
+    @StageProfiler.profile('indicators')
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
         # Base pair inf timeframe indicators
@@ -389,6 +429,12 @@ class Anomaly(IStrategy):
         if self.dataframeUtils is None:
             self.dataframeUtils = DataframeUtils()
 
+        if self.walkForward is None:
+            # datasets can only be re-used if the same data is processed again, so only cache them in backtests
+            self.walkForward = WalkForward(self.__class__.__name__, retrain_interval=self.retrain_interval,
+                                           timeframe_mins=self.data_mins,
+                                           use_cache=(self.dp.runmode.value in ('backtest', 'hyperopt')))
+
         if self.dataframePopulator is None:
             self.dataframePopulator = DataframePopulator()
 
@@ -398,9 +444,12 @@ class Anomaly(IStrategy):
             self.dataframePopulator.n_loss_stddevs = self.n_loss_stddevs
             self.dataframePopulator.n_profit_stddevs = self.n_profit_stddevs
 
-        # populate the normal dataframe
-        dataframe = self.dataframePopulator.add_indicators(dataframe)
-        # dataframe = self.add_indicators(dataframe)
+        # re-use indicators calculated by previous runs (rolling calculation modes only)
+        if self.featureStore is None:
+            self.featureStore = FeatureStore(self.config['exchange']['name'], self.timeframe,
+                                             version=self.dataframePopulator.get_feature_version())
+            self.featureStore.enabled = self.use_feature_store and \
+                                        (self.dp.runmode.value in ('hyperopt', 'backtest', 'plot'))
 
         if Anomaly.first_time:
             Anomaly.first_time = False
@@ -414,6 +463,19 @@ class Anomaly(IStrategy):
         print("")
         print(curr_pair)
 
+        # in backtest mode, run populate_indicators() for all pairs in parallel (on the first call), then just use
+        # the results
+        if self.parallel_precompute and self.can_precompute():
+            self.run_precompute()
+            cached = self.pairPrecompute.get(curr_pair, dataframe)
+            if cached is not None:
+                return self.add_stoploss_indicators(cached, curr_pair)
+
+        # populate the normal dataframe (after the pre-computation check, which already includes the indicators)
+        dataframe = self.featureStore.populate(self.curr_pair, dataframe, 'indicators',
+                                               self.dataframePopulator.add_indicators)
+        # dataframe = self.add_indicators(dataframe)
+
         # (re-)set the scaler
         self.dataframeUtils.set_scaler_type(self.scaler_type)
 
@@ -455,12 +517,11 @@ class Anomaly(IStrategy):
 
     # add indicators used by stoploss/custom sell logic
     def add_stoploss_indicators(self, dataframe, pair) -> DataFrame:
-        if not pair in self.custom_trade_info:
-            self.custom_trade_info[pair] = {}
-            if not 'had_trend' in self.custom_trade_info[pair]:
-                self.custom_trade_info[pair]['had_trend'] = False
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
 
         dataframe = self.dataframePopulator.add_stoploss_indicators(dataframe)
+        self.trade_state.update(pair, dataframe)
 
         return dataframe
 
@@ -472,7 +533,8 @@ class Anomaly(IStrategy):
     def create_training_data(self, dataframe: DataFrame):
 
         # future_df = self.add_future_data(dataframe.copy())
-        future_df = self.dataframePopulator.add_hidden_indicators(dataframe.copy())
+        future_df = self.featureStore.populate(self.curr_pair, dataframe.copy(), 'hidden',
+                                               self.dataframePopulator.add_hidden_indicators)
         future_df = self.dataframePopulator.add_future_data(future_df, self.curr_lookahead)
 
         future_df['train_buy'] = 0.0
@@ -578,12 +640,17 @@ class Anomaly(IStrategy):
         else:
             print("    ERR: unknown classifier type ({})".format(self.classifier_type))
 
+        # in live modes, keras-based detectors only need to score the new candles each time
+        if (clf is not None) and hasattr(clf, 'set_streaming'):
+            clf.set_streaming(self.dp.runmode.value in ('live', 'dry_run'))
+
         return clf
 
     ############################
 
     # train the PCA reduction and classification models
 
+    @StageProfiler.profile('training')
     def train_models(self, curr_pair, dataframe: DataFrame, buys, sells) -> DataFrame:
 
         # check input - need at least 2 samples or classifiers will not train
@@ -596,53 +663,47 @@ class Anomaly(IStrategy):
             print("*** ERR: insufficient sells in expected results. Check training data")
             return
 
-        rand_st = 27  # use fixed number for reproducibility
-
-        full_df_norm = self.dataframeUtils.norm_dataframe(dataframe)
-
-
-        if self.compress_data:
-            old_size = full_df_norm.shape[1]
-            full_df_norm = self.compress_dataframe(full_df_norm)
-            print("    Compressed data {} -> {} (features)".format(old_size, full_df_norm.shape[1]))
+        # only run when the data moves into a new retraining fold (no point retraining every candle). See WalkForward
+        retrain = self.walkForward.should_retrain(curr_pair, dataframe)
+        if (not retrain) and (curr_pair in self.buy_classifier_list) and (curr_pair in self.sell_classifier_list):
+            self.buy_classifier = self.buy_classifier_list[curr_pair]
+            self.sell_classifier = self.sell_classifier_list[curr_pair]
+            return self.add_reconstruction(dataframe)
+
+        # re-use the train/test datasets for this fold if they have already been built
+        fold_id = self.walkForward.get_fold_id(dataframe)
+        config = f"{self.scaler_type}:{self.compress_data}"
+        cache_key = self.walkForward.get_cache_key(curr_pair, fold_id, dataframe, buys, sells, config=config)
+        dataset = self.walkForward.load_dataset(curr_pair, cache_key)
+        if dataset is None:
+            df_train, df_test, train_buys, test_buys, train_sells, test_sells = self.build_train_test_data(dataframe,
+                                                                                                          buys, sells)
+            self.walkForward.save_dataset(curr_pair, cache_key, {
+                'df_train': df_train, 'df_test': df_test,
+                'train_buys': train_buys, 'test_buys': test_buys,
+                'train_sells': train_sells, 'test_sells': test_sells
+            })
         else:
-            if self.dbg_verbose:
-                print("    Not compressing data")
+            df_train, df_test = dataset['df_train'], dataset['df_test']
+            train_buys, test_buys = dataset['train_buys'], dataset['test_buys']
+            train_sells, test_sells = dataset['train_sells'], dataset['test_sells']
 
         # create classifiers, if necessary
 
         if self.curr_pair not in self.buy_classifier_list:
-            self.buy_classifier = self.get_classifier(full_df_norm.shape[1], "Buy")
+            self.buy_classifier = self.get_classifier(df_train.shape[1], "Buy")
             self.buy_classifier_list[self.curr_pair] = self.buy_classifier
         else:
             self.buy_classifier = self.buy_classifier_list[self.curr_pair]
 
         if self.curr_pair not in self.sell_classifier_list:
-            self.sell_classifier = self.get_classifier(full_df_norm.shape[1], "Sell")
+            self.sell_classifier = self.get_classifier(df_train.shape[1], "Sell")
             self.sell_classifier_list[self.curr_pair] = self.sell_classifier
         else:
             self.sell_classifier = self.sell_classifier_list[self.curr_pair]
 
-        # constrain sample size to what will be available in run modes
-        data_size = int(min(975, full_df_norm.shape[0]))
-
-        train_ratio = 0.8
-        train_size = int(train_ratio * data_size)
-        test_size = data_size - train_size
-
-        # df_train, df_test, train_buys, test_buys, train_sells, test_sells, = train_test_split(full_df_norm,
-        #                                                                                       buys,
-        #                                                                                       sells,
-        #                                                                                       train_size=train_size,
-        #                                                                                       random_state=rand_st,
-        #                                                                                       shuffle=False)
-        # use the back portion of data for training, front for testing
-        df_test, df_train = self.dataframeUtils.split_dataframe(full_df_norm, (1.0 - train_ratio))
-        test_buys, train_buys = self.dataframeUtils.split_array(buys, (1.0 - train_ratio))
-        test_sells, train_sells = self.dataframeUtils.split_array(sells, (1.0 - train_ratio))
-
         if self.dbg_verbose:
-            print("     dataframe:", full_df_norm.shape, ' -> train:', df_train.shape, " + test:", df_test.shape)
+            print("     train:", df_train.shape, " + test:", df_test.shape)
             print("     buys:", buys.shape, ' -> train:', train_buys.shape, " + test:", test_buys.shape)
             print("     sells:", sells.shape, ' -> train:', train_sells.shape, " + test:", test_sells.shape)
 
@@ -681,7 +742,32 @@ class Anomaly(IStrategy):
                 print(classification_report(test_sell_labels, pred_sells))
                 print("")
 
-        # if running 'plot', reconstruct the original dataframe for display
+        return self.add_reconstruction(dataframe)
+
+    # build the (normalised) train/test datasets used for training the classifiers
+    def build_train_test_data(self, dataframe: DataFrame, buys, sells):
+
+        full_df_norm = self.dataframeUtils.norm_dataframe(dataframe)
+
+        if self.compress_data:
+            old_size = full_df_norm.shape[1]
+            full_df_norm = self.compress_dataframe(full_df_norm)
+            print("    Compressed data {} -> {} (features)".format(old_size, full_df_norm.shape[1]))
+        else:
+            if self.dbg_verbose:
+                print("    Not compressing data")
+
+        train_ratio = 0.8
+
+        # use the back portion of data for training, front for testing
+        test_idx, train_idx = self.dataframeUtils.get_split_indices(full_df_norm.shape[0], (1.0 - train_ratio))
+        df_test, test_buys, test_sells = self.dataframeUtils.gather_rows(test_idx, full_df_norm, buys, sells)
+        df_train, train_buys, train_sells = self.dataframeUtils.gather_rows(train_idx, full_df_norm, buys, sells)
+
+        return df_train, df_test, train_buys, test_buys, train_sells, test_sells
+
+    # if running 'plot', reconstruct the original dataframe for display
+    def add_reconstruction(self, dataframe: DataFrame) -> DataFrame:
         if self.dp.runmode.value in ('plot'):
             if self.compress_data:
                 df_norm = self.dataframeUtils.norm_dataframe(dataframe)  # this also resets the scaler
@@ -756,6 +842,7 @@ class Anomaly(IStrategy):
         return compressor
 
     # make predictions for supplied dataframe (returns column)
+    @StageProfiler.profile('prediction')
     def predict(self, dataframe: DataFrame, pair, clf):
 
         # predict = 0
@@ -766,7 +853,10 @@ class Anomaly(IStrategy):
             df_norm = self.dataframeUtils.norm_dataframe(dataframe)
             if self.compress_data:
                 df_norm = self.compress_dataframe(df_norm)
-            predict = clf.predict(df_norm)
+            if getattr(clf, 'streaming', False):
+                predict = clf.predict(df_norm, num_new=self.get_num_new_rows(dataframe, pair, clf))
+            else:
+                predict = clf.predict(df_norm)
 
         else:
             print("Null CLF for pair: ", pair)
@@ -774,6 +864,16 @@ class Anomaly(IStrategy):
         # print (predict)
         return predict
 
+    # returns the number of rows added to the dataframe since the last prediction (by this classifier), or None if
+    # this is the first call
+    def get_num_new_rows(self, dataframe: DataFrame, pair, clf):
+        key = pair + ":" + clf.name
+        last_date = self.last_predict_date.get(key, None)
+        self.last_predict_date[key] = dataframe['date'].iloc[-1]
+        if last_date is None:
+            return None
+        return int((dataframe['date'] > last_date).sum())
+
     def predict_buy(self, df: DataFrame, pair):
         clf = self.buy_classifier
 
@@ -830,6 +930,7 @@ class Anomaly(IStrategy):
     Buy Signal
     """
 
+    @StageProfiler.profile('entry')
     def populate_entry_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'enter_tag'] = ''
@@ -890,6 +991,7 @@ class Anomaly(IStrategy):
     Sell Signal
     """
 
+    @StageProfiler.profile('exit')
     def populate_exit_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'exit_tag'] = ''
@@ -957,10 +1059,11 @@ class Anomaly(IStrategy):
 
         # self.set_state(pair, self.State.STOPLOSS)
 
-        dataframe, last_updated = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had_trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit < self.cstop_max_stoploss.value:
@@ -1024,6 +1127,7 @@ class Anomaly(IStrategy):
     Custom Sell
     """
 
+    @StageProfiler.profile('custom_exit')
     def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
         if self.use_simpler_custom_stoploss:
@@ -1034,8 +1138,9 @@ class Anomaly(IStrategy):
     def complex_custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                             current_profit: float):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0, trade.calc_profit_ratio(trade.max_rate))
@@ -1078,7 +1183,7 @@ class Anomaly(IStrategy):
         # Don't sell if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful sell message later
-            self.custom_trade_info[trade.pair]['had_trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a sell, maybe
             if self.cexit_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -1092,12 +1197,12 @@ class Anomaly(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had_trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had_trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_roi'
                 elif self.cexit_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had_trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_noroi'
             elif current_profit > min_roi:
                 return 'notrend_roi'
@@ -1106,8 +1211,9 @@ class Anomaly(IStrategy):
 
     def simpler_custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                             current_profit: float):
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         # Above 5% profit, sell
         if current_profit > 0.05:
@@ -43,6 +43,7 @@ from keras import layers
 from sklearn.svm import OneClassSVM
 
 from ClassifierSklearn import ClassifierSklearn
+import NeighbourIndex
 
 
 import h5py
@@ -51,6 +52,8 @@ class AnomalyDetector_DBSCAN(ClassifierSklearn):
 
     classifier = None
     clean_data_required = False # training data can contain anomalies
+    eps = 0.00001
+    index = None  # NeighbourIndex of the prediction data. Extended if the data only has new rows appended
 
     def create_classifier(self):
         classifier = DBSCAN(eps=1.0)
@@ -70,7 +73,9 @@ class AnomalyDetector_DBSCAN(ClassifierSklearn):
         else:
             min_samples = int(num_samples * 0.05)
         print(f'num_samples: {num_samples} self.contamination:{self.contamination} min_samples: {min_samples}')
-        db = DBSCAN(eps=0.00001, min_samples=min_samples).fit(df_norm)
+        # use the (precomputed) neighbour graph from the index, rather than DBSCAN building a new one each time
+        self.index = NeighbourIndex.get_index(df_norm, self.index)
+        db = DBSCAN(eps=self.eps, min_samples=min_samples, metric='precomputed').fit(self.index.radius_graph(self.eps))
         labels = db.labels_
 
         no_clusters = len(np.unique(labels))
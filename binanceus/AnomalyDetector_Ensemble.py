@@ -1,4 +1,12 @@
-# class that implements an Anomaly detector using a stacked ensemble of various anomaly detection techniques
+# class that implements an Anomaly detector using an ensemble of various anomaly detection techniques
+#
+# The members (IsolationForest, GaussianMixture, LOF, OneClassSVM) are fitted concurrently (joblib, n_jobs), and each
+# member's out-of-fold scores are kept (and cached by training data, so re-training on the same data is free).
+# The member scores are combined by:
+#    'mean'   average of the member scores, standardised using the out-of-fold scores
+#    'rank'   average of the percentile ranks of the member scores (relative to the out-of-fold scores)
+#    'stack'  LogisticRegression trained on the out-of-fold scores (needs both classes in the training labels, i.e.
+#             clean_data_required = False). Falls back to 'mean' if there is only one class
 
 import sys
 from pathlib import Path
@@ -9,12 +17,15 @@ import logging
 import warnings
 import random
 import os
+import time
+import hashlib
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
 os.environ['TF_DETERMINISTIC_OPS'] = '1'
 
 import numpy as np
 import pandas as pd
+from pandas import DataFrame
 
 from sklearn.linear_model import LogisticRegression
 from sklearn.mixture import GaussianMixture
@@ -39,23 +50,156 @@ log = logging.getLogger(__name__)
 # log.setLevel(logging.DEBUG)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
-from sklearn.ensemble import IsolationForest, StackingClassifier
+from sklearn.ensemble import IsolationForest
+from sklearn.base import clone
+from sklearn.model_selection import KFold
+from joblib import Parallel, delayed
 from ClassifierSklearn import ClassifierSklearn
 
 
 
+# (fingerprint of member and training data) -> (fitted member, out-of-fold scores)
+member_cache = {}
+member_cache_size = 8
+
+
+# returns a key that identifies a member (type and parameters) and the data it is fitted on
+def get_member_key(member, data, cv) -> str:
+    h = hashlib.sha1()
+    h.update(f"{member.__class__.__name__}:{member.get_params()}:{data.shape}:{cv}".encode())
+    h.update(data.tobytes())
+    return h.hexdigest()
+
+
+# fit a copy of a member on the training rows, and score the test rows (if supplied)
+def fit_member(member, x_train, x_test):
+    start = time.perf_counter()
+    model = clone(member).fit(x_train)
+    scores = model.score_samples(x_test) if x_test is not None else None
+    return model, scores, time.perf_counter() - start
+
+
+# sklearn-style model that combines the scores of its members. Lower scores are more anomalous
+class EnsembleModel():
+    members = []  # list of (name, estimator)
+    combine = 'mean'
+    cv = 5
+    n_jobs = -1
+
+    models = []  # fitted members
+    oof_scores = None  # out-of-fold scores of the training data, shape (samples, members)
+    ref_scores = None  # sorted out-of-fold scores, used for ranking
+    ref_mean = None
+    ref_std = None
+    meta = None  # meta classifier ('stack')
+    fit_times = {}  # member -> fit time (secs), including cross-validation. 0 if cached
+
+    def __init__(self, members, combine='mean', cv=5, n_jobs=-1):
+        super().__init__()
+        self.members = members
+        self.combine = combine
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.models = []
+        self.fit_times = {}
+
+    def fit(self, X, y=None):
+        data = np.ascontiguousarray(X, dtype=np.float64)
+        nsamples = np.shape(data)[0]
+        folds = list(KFold(n_splits=self.cv).split(data))
+
+        # build the list of fits needed for members that are not in the cache
+        keys = [get_member_key(member, data, self.cv) for _, member in self.members]
+        tasks = []
+        for m, (name, member) in enumerate(self.members):
+            if keys[m] in member_cache:
+                continue
+            for train_idx, test_idx in folds:
+                tasks.append((m, test_idx, member, data[train_idx], data[test_idx]))
+            tasks.append((m, None, member, data, None))
+
+        results = Parallel(n_jobs=self.n_jobs)(delayed(fit_member)(member, x_train, x_test)
+                                               for _, _, member, x_train, x_test in tasks)
+
+        # collect fitted members and out-of-fold scores
+        fitted = {}
+        oof = {}
+        self.fit_times = {name: 0.0 for name, _ in self.members}
+        for (m, test_idx, _, _, _), (model, scores, fit_time) in zip(tasks, results):
+            self.fit_times[self.members[m][0]] += fit_time
+            if test_idx is None:
+                fitted[m] = model
+            else:
+                oof.setdefault(m, np.zeros(nsamples, dtype=np.float64))[test_idx] = scores
+
+        for m in fitted.keys():
+            if len(member_cache) >= member_cache_size:
+                member_cache.pop(next(iter(member_cache)))
+            member_cache[keys[m]] = (fitted[m], oof[m])
+
+        self.models = [member_cache[key][0] for key in keys]
+        self.oof_scores = np.column_stack([member_cache[key][1] for key in keys])
+        self.ref_scores = np.sort(self.oof_scores, axis=0)
+        self.ref_mean = self.oof_scores.mean(axis=0)
+        self.ref_std = np.where(self.oof_scores.std(axis=0) > 0.0, self.oof_scores.std(axis=0), 1.0)
+
+        self.meta = None
+        if self.combine == 'stack':
+            if (y is None) or (len(np.unique(y)) < 2):
+                print("    WARN: stacking needs both classes in the training labels, using 'mean'")
+            else:
+                self.meta = LogisticRegression().fit(self.oof_scores, y)
+
+        return self
+
+    # returns the raw scores of each member, shape (samples, members)
+    def member_scores(self, X):
+        data = np.ascontiguousarray(X, dtype=np.float64)
+        return np.column_stack([model.score_samples(data) for model in self.models])
+
+    def score_samples(self, X):
+        scores = self.member_scores(X)
+
+        if self.meta is not None:
+            # probability of the anomaly class, negated so that lower is more anomalous
+            return -self.meta.predict_proba(scores)[:, 1]
+
+        if self.combine == 'rank':
+            nref = np.shape(self.ref_scores)[0]
+            ranks = [np.searchsorted(self.ref_scores[:, m], scores[:, m]) / nref for m in range(np.shape(scores)[1])]
+            return np.mean(ranks, axis=0)
+
+        return ((scores - self.ref_mean) / self.ref_std).mean(axis=1)
+
+
 class AnomalyDetector_Ensemble(ClassifierSklearn):
     classifier = None
     clean_data_required = True  # training data should not contain anomalies
 
+    combine = 'mean'  # how member scores are combined: 'mean', 'rank' or 'stack' (see above)
+    cv = 5  # number of folds used to get the out-of-fold scores
+    n_jobs = -1  # number of parallel fits (-1: all cores)
+
     def create_classifier(self):
-        # Stacked 'ensemble' of classifiers
         c1 = IsolationForest(contamination=self.contamination)
         c2 = GaussianMixture()
         c3 = LocalOutlierFactor(n_neighbors=30, novelty=True, contamination=self.contamination)
         c4 = OneClassSVM(gamma='scale', nu=self.contamination)
         estimators = [('c1', c1), ('c2', c2), ('c3', c3), ('c4', c4)]
-        # estimators = [('c2', c2), ('c3', c3), ('c4', c4)]
-        classifier = StackingClassifier(estimators=estimators,
-                                        final_estimator=LogisticRegression())
+        classifier = EnsembleModel(estimators, combine=self.combine, cv=self.cv, n_jobs=self.n_jobs)
         return classifier
+
+    def train(self, df_train_norm: DataFrame, df_test_norm: DataFrame, train_labels, test_labels, force_train=False):
+        start = time.perf_counter()
+        super().train(df_train_norm, df_test_norm, train_labels, test_labels, force_train)
+        fit_time = time.perf_counter() - start
+
+        member_times = " ".join([f"{name}:{t:.2f}s" for name, t in getattr(self.model, 'fit_times', {}).items()])
+        print(f"    {self.name} fit time: {fit_time:.2f}s ({member_times})")
+        return
+
+    # the stacked model returns (negated) probabilities, so use a fixed threshold
+    def get_threshold(self, scores) -> float:
+        if getattr(self.model, 'meta', None) is not None:
+            return -0.5
+        return super().get_threshold(scores)
@@ -1,4 +1,9 @@
 # class that implements an Anomaly detector using the Local Outlier Factor (LOF) algorithm
+#
+# LOF is calculated using a (shared) NeighbourIndex built once per training window, rather than sklearn's
+# LocalOutlierFactor, which rebuilds its neighbour structures on every fit. The scores are the same as
+# LocalOutlierFactor(novelty=True).score_samples(), and new candles can be added with partial_fit().
+# The index is saved next to the model file.
 
 
 import numpy as np
@@ -41,10 +46,62 @@ import keras
 from keras import layers
 from sklearn.neighbors import LocalOutlierFactor
 from ClassifierSklearn import ClassifierSklearn
+import NeighbourIndex
 
 
 import h5py
 
+# sklearn-style LOF model (novelty detection), using a NeighbourIndex. Lower scores are more anomalous
+class NeighbourLOF():
+    n_neighbors = 30
+    contamination = 0.01
+    index = None
+    k = 0  # actual number of neighbours used (limited by the number of rows)
+    k_distance = None  # distance to the k-th neighbour of each indexed row
+    lrd = None  # local reachability density of each indexed row
+
+    def __init__(self, n_neighbors=30, contamination=0.01):
+        super().__init__()
+        self.n_neighbors = n_neighbors
+        self.contamination = contamination
+
+    def fit(self, X, y=None):
+        self.index = NeighbourIndex.get_index(X)
+        self.k = max(1, min(self.n_neighbors, self.index.num_rows - 1))
+
+        dist, idx = self.index.query_self(self.k)
+        self.k_distance = dist[:, -1]
+        self.lrd = self.get_lrd(dist, idx)
+        return self
+
+    # add rows (e.g. new candles) to the model. The densities of existing rows are not updated
+    def partial_fit(self, X):
+        start = self.index.num_rows
+        self.index = NeighbourIndex.extend(self.index, np.asarray(X, dtype=np.float64))
+
+        dist, idx = self.index.query_self(self.k, start=start)
+        self.k_distance = np.concatenate([self.k_distance, dist[:, -1]])
+        self.lrd = np.concatenate([self.lrd, np.zeros(np.shape(dist)[0])])
+        self.lrd[start:] = self.get_lrd(dist, idx)
+        return self
+
+    # local reachability density, given the neighbours of each row
+    def get_lrd(self, dist, idx):
+        reach_dist = np.maximum(dist, self.k_distance[idx])
+        return 1.0 / (reach_dist.mean(axis=1) + 1e-10)
+
+    def score_samples(self, X):
+        dist, idx = self.index.query(np.asarray(X, dtype=np.float64), self.k)
+        lrd = self.get_lrd(dist, idx)
+        return -(self.lrd[idx].mean(axis=1) / lrd)
+
+    # the index is saved separately (see AnomalyDetector_LOF.save())
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['index'] = None
+        return state
+
+
 class AnomalyDetector_LOF(ClassifierSklearn):
 
     classifier = None
@@ -52,5 +109,28 @@ class AnomalyDetector_LOF(ClassifierSklearn):
 
 
     def create_classifier(self):
-        classifier = LocalOutlierFactor(n_neighbors=30, novelty=True, contamination=self.contamination)
+        classifier = NeighbourLOF(n_neighbors=30, contamination=self.contamination)
         return classifier
+
+    def get_index_path(self):
+        return self.model_path.replace(".sav", "_index.sav")
+
+    def save(self, path=""):
+        super().save(path)
+        if self.new_model and (self.model is not None) and (self.model.index is not None):
+            self.model.index.save(self.get_index_path())
+        return
+
+    def load(self, path=""):
+        super().load(path)
+        if self.loaded_from_file:
+            index = NeighbourIndex.NeighbourIndex.load(self.get_index_path())
+            if (index is None) or not isinstance(self.model, NeighbourLOF):
+                # no index (or an old model), so re-train
+                print("    WARN: no neighbour index for model, re-training")
+                self.model = None
+                self.loaded_from_file = False
+                self.new_model = True
+            else:
+                self.model.index = index
+        return self.model
@@ -0,0 +1,167 @@
+# Streaming threshold for anomaly (reconstruction error) scores
+#
+# The keras autoencoders used to derive their anomaly threshold from the entire batch of reconstruction errors every
+# time predict() was called (mean + 2*stddev). In live/dry-run mode that means re-running the model over the whole
+# history every candle, just to classify the last row.
+# This class instead maintains running statistics of the scores, so that only newly arrived windows need to be scored.
+# Two methods are supported:
+#   'meanstd' - running mean/variance (Welford/Chan batch update). threshold = mean + num_std * stddev
+#   'mad'     - Median Absolute Deviation over a bounded history of recent scores. Anomalous if z-score > mad_threshold
+#
+# The state can be retrieved/restored (get_state()/set_state()) or saved to a JSON file, so that thresholds survive
+# a restart.
+#
+# Usage:
+#    scorer = AnomalyScorer()
+#    scorer.update(scores)
+#    labels = scorer.classify(scores)
+
+import json
+import os
+from collections import deque
+
+import numpy as np
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class AnomalyScorer():
+
+    method = 'meanstd'  # 'meanstd' or 'mad'
+    num_std = 2.0  # number of standard deviations above the mean that counts as an anomaly ('meanstd')
+    mad_threshold = 3.0  # z-score above which a score counts as an anomaly ('mad')
+    max_count = 0  # caps the weight of older scores in the running stats ('meanstd'). 0 means no cap
+    max_history = 2048  # number of recent scores kept for the median calculations ('mad')
+
+    count = 0
+    mean = 0.0
+    m2 = 0.0  # sum of squared differences from the mean (variance = m2 / count)
+
+    # ---------------------------
+
+    def __init__(self, method='meanstd', num_std=2.0, mad_threshold=3.0, max_count=0, max_history=2048):
+        super().__init__()
+
+        if method not in ('meanstd', 'mad'):
+            print(f"    ERR: unknown anomaly scoring method: {method}. Using meanstd")
+            method = 'meanstd'
+
+        self.method = method
+        self.num_std = num_std
+        self.mad_threshold = mad_threshold
+        self.max_count = max_count
+        self.max_history = max_history
+
+        self.reset()
+
+    # ---------------------------
+
+    # clear all running statistics
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.history = deque(maxlen=self.max_history)
+
+    # returns True if at least one score has been processed
+    def is_initialised(self) -> bool:
+        return self.count > 0
+
+    # ---------------------------
+
+    # add a batch of scores to the running statistics
+    def update(self, scores):
+        scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+        n = len(scores)
+        if n == 0:
+            return
+
+        # combine batch mean/variance with the running values (Chan et al.)
+        b_mean = scores.mean()
+        b_m2 = np.square(scores - b_mean).sum()
+
+        total = self.count + n
+        delta = b_mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + b_m2 + delta * delta * self.count * n / total
+        self.count = total
+
+        # cap the effective count so that the stats keep adapting (older data is gradually down-weighted)
+        if (self.max_count > 0) and (self.count > self.max_count):
+            self.m2 = self.m2 * self.max_count / self.count
+            self.count = self.max_count
+
+        self.history.extend(scores.tolist())
+
+    # ---------------------------
+
+    def get_std(self) -> float:
+        if self.count == 0:
+            return 0.0
+        return float(np.sqrt(self.m2 / self.count))
+
+    # returns the score above which a value is considered anomalous ('meanstd' only)
+    def get_threshold(self) -> float:
+        return float(self.mean + self.num_std * self.get_std())
+
+    # returns the Median Absolute Deviation z-scores of the supplied scores, relative to the recent history
+    def mad_score(self, scores) -> np.array:
+        points = np.asarray(self.history, dtype=np.float64)
+        m = np.median(points)
+        mad = np.median(np.abs(points - m))
+        if mad == 0.0:
+            return np.zeros(np.shape(scores), dtype=float)
+        return 0.6745 * np.abs(np.asarray(scores) - m) / mad
+
+    # returns 1.0 for anomalous scores, 0.0 otherwise
+    def classify(self, scores) -> np.array:
+        if not self.is_initialised():
+            return np.zeros(np.shape(scores), dtype=float)
+
+        if self.method == 'mad':
+            return np.where(self.mad_score(scores) > self.mad_threshold, 1.0, 0.0)
+        else:
+            return np.where(np.asarray(scores) > self.get_threshold(), 1.0, 0.0)
+
+    # ---------------------------
+
+    # returns the threshold state as a (JSON-serialisable) dict
+    def get_state(self) -> dict:
+        return {
+            'method': self.method,
+            'count': int(self.count),
+            'mean': float(self.mean),
+            'm2': float(self.m2),
+            'history': list(self.history)
+        }
+
+    # restore the threshold state from a dict previously returned by get_state()
+    def set_state(self, state: dict):
+        self.reset()
+        self.method = state.get('method', self.method)
+        self.count = int(state.get('count', 0))
+        self.mean = float(state.get('mean', 0.0))
+        self.m2 = float(state.get('m2', 0.0))
+        self.history.extend(state.get('history', []))
+
+    def save(self, path):
+        save_dir = os.path.dirname(path)
+        if save_dir and not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        with open(path, "w") as f:
+            json.dump(self.get_state(), f)
+
+    # load state from file. Returns False if the file does not exist or could not be read
+    def load(self, path) -> bool:
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, "r") as f:
+                self.set_state(json.load(f))
+        except Exception as e:
+            print(f"    Error loading anomaly scorer state from {path}: {e}")
+            self.reset()
+            return False
+        return True
@@ -83,7 +83,6 @@ class Anomaly_macd(Anomaly):
     n_loss_stddevs = 1.0
     min_f1_score = 0.60
 
-    custom_trade_info = {}
 
     dbg_scan_classifiers = False  # if True, scan all viable classifiers and choose the best. Very slow!
     dbg_test_classifier = True  # test clasifiers after fitting
@@ -0,0 +1,90 @@
+# Locations of the training checkpoints used by the Classifier* family
+#
+# Checkpoints used to be written to /tmp/<model name>/, so processes training the same model at the same time (e.g.
+# hyperopt workers, or the training backends) overwrote each other's checkpoints, and slow disks stalled training.
+# Checkpoints are now written below a directory that is private to the process (<pid>_<run id>), on a RAM-backed
+# filesystem (/dev/shm) if available. The best weights are kept in memory during training, and only written once at
+# the end (see ModelCache.MemoryCheckpoint and ClassifierDarts.MemoryCheckpoint), so each model has a single
+# checkpoint file per run.
+# The process directory is removed when the process exits, and directories left behind by processes that are no
+# longer running (e.g. killed workers) are removed when the first checkpoint directory is created.
+# The root directory can be set with the CHECKPOINT_DIR environment variable.
+#
+# Usage:
+#    checkpoint_dir = CheckpointManager.get_checkpoint_dir(model_name)
+#    checkpoint_path = CheckpointManager.get_checkpoint_path(model_name, "checkpoint.weights.h5")
+
+import atexit
+import os
+import shutil
+import tempfile
+import time
+
+root_name = "freqtrade_checkpoints"
+run_dir = ""  # directory used by this process (created on first use)
+
+
+# returns the root directory for checkpoints. RAM-backed, if possible
+def get_root_dir() -> str:
+    base_dir = os.environ.get('CHECKPOINT_DIR', "")
+    if len(base_dir) == 0:
+        base_dir = '/dev/shm' if os.access('/dev/shm', os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base_dir, root_name)
+
+
+def process_exists(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # process exists, but is owned by another user
+    return True
+
+
+# remove the directories of processes that are no longer running
+def remove_stale_dirs(root_dir):
+    if not os.path.exists(root_dir):
+        return
+
+    for entry in os.listdir(root_dir):
+        pid = entry.split('_')[0]
+        if pid.isdigit() and (int(pid) != os.getpid()) and (not process_exists(int(pid))):
+            shutil.rmtree(os.path.join(root_dir, entry), ignore_errors=True)
+
+
+def remove_run_dir():
+    if run_dir and os.path.exists(run_dir):
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+# returns the checkpoint directory for this process (which is created, and removed at exit)
+def get_run_dir() -> str:
+    global run_dir
+
+    # a forked process inherits run_dir, so check that it belongs to this process
+    if run_dir and os.path.basename(run_dir).startswith(f"{os.getpid()}_"):
+        return run_dir
+
+    root_dir = get_root_dir()
+    remove_stale_dirs(root_dir)
+
+    run_dir = os.path.join(root_dir, f"{os.getpid()}_{int(time.time() * 1000)}")
+    os.makedirs(run_dir, exist_ok=True)
+    atexit.register(remove_run_dir)
+    return run_dir
+
+
+# ---------------------------
+
+# returns the (existing) checkpoint directory for the model, with a trailing '/'
+def get_checkpoint_dir(model_name) -> str:
+    checkpoint_dir = os.path.join(get_run_dir(), model_name) + "/"
+    if not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    return checkpoint_dir
+
+
+# returns the path of a checkpoint file for the model
+def get_checkpoint_path(model_name, file_name) -> str:
+    return get_checkpoint_dir(model_name) + file_name
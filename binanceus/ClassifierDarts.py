@@ -30,7 +30,7 @@ from darts.models import NBEATSModel, TFTModel
 from pandas import DataFrame, Series
 import pandas as pd
 
-from pytorch_lightning.callbacks import EarlyStopping, ModelCheckpoint
+from pytorch_lightning.callbacks import Callback, EarlyStopping
 from sklearn.preprocessing import RobustScaler, MinMaxScaler
 from torchmetrics import MeanAbsolutePercentageError
 
@@ -75,6 +75,48 @@ random.seed(seed)
 np.random.seed(seed)
 
 from DataframeUtils import DataframeUtils
+import InferenceRunner
+import CheckpointManager
+
+
+# ---------------------------
+
+# Keeps a copy of the best weights seen during training in memory (rather than writing a checkpoint file every time
+# the monitored value improves), and writes them to filepath once, at the end of training
+class MemoryCheckpoint(Callback):
+
+    def __init__(self, filepath="", monitor='val_loss', mode='min'):
+        super().__init__()
+        self.filepath = filepath
+        self.monitor = monitor
+        self.mode = mode
+        self.best = None
+        self.best_state = None
+
+    def on_train_start(self, trainer, pl_module):
+        self.best = np.inf if self.mode == 'min' else -np.inf
+        self.best_state = None
+
+    def on_validation_end(self, trainer, pl_module):
+        if trainer.sanity_checking:
+            return
+
+        current = trainer.callback_metrics.get(self.monitor, None)
+        if current is None:
+            return
+
+        current = float(current)
+        improved = (current < self.best) if self.mode == 'min' else (current > self.best)
+        if improved:
+            self.best = current
+            self.best_state = {k: v.detach().to('cpu', copy=True) for k, v in pl_module.state_dict().items()}
+
+    def on_train_end(self, trainer, pl_module):
+        if (self.best_state is not None) and (len(self.filepath) > 0):
+            torch.save({'state_dict': self.best_state, self.monitor: self.best}, self.filepath)
+
+        # the callback is saved with the model (trainer args), so do not keep the weights
+        self.best_state = None
 
 
 # ---------------------------
@@ -105,10 +147,17 @@ class ClassifierDarts():
     requires_dataframes = True  # set to True if classifier takes dataframes rather than tensors
     prescale_dataframe = False  # set to True if algorithms need dataframes to be pre-scaled
     single_prediction = False  # True if algorithm only produces 1 prediction (not entire data array)
+    precision = np.float64  # dtype of data passed to the model. See set_precision()
 
     trainer = None
     trainer_args = {}
     # num_cpus = 1
+    export_format = 'torchscript'  # format of the exported model used for CPU inference ('torchscript' or 'onnx')
+    use_exported_model = False  # opt-in: predict() uses the exported model (if available), rather than the Darts path
+    export_tolerance = 1e-4  # max difference allowed between the outputs of the exported and the Darts network
+    inference_threads = 1  # intra-op threads used by the exported model
+    runner = None  # InferenceRunner for the exported model
+
     use_gpu = True  # Note: not all classifiers can use the GPU, and some are slower when they do
 
     train_cols = []  # used for debug
@@ -165,11 +214,9 @@ class ClassifierDarts():
             mode='min',
         )
 
-        checkpoint_callback = ModelCheckpoint(
-            dirpath=self.get_checkpoint_dir(),
-            filename="best-checkpoint",
-            save_top_k=1,
-            verbose=True,
+        # best weights are kept in memory, and written once at the end of training
+        checkpoint_callback = MemoryCheckpoint(
+            filepath=self.get_checkpoint_dir() + "best-checkpoint.ckpt",
             monitor="val_loss",
             mode="min")
 
@@ -179,7 +226,7 @@ class ClassifierDarts():
         self.trainer_args["benchmark"] = True
         self.trainer_args["enable_model_summary"] = True
         self.trainer_args["auto_scale_batch_size"] = True
-        self.trainer_args["enable_checkpointing"] = True
+        self.trainer_args["enable_checkpointing"] = False  # handled by checkpoint_callback
         self.trainer_args["enable_progress_bar"] = True
         self.trainer_args["min_epochs"] = 6
 
@@ -301,9 +348,9 @@ class ClassifierDarts():
         test_price_series = darts.TimeSeries.from_dataframe(df3, time_col='date', value_cols=self.target_column,
                                                             fillna_value=0)
 
-        # convert to 32-bit (allows use of GPU)
-        if self.is_gpu_available():
-            print("    Converting to 32-bit to allow GPU usage...")
+        # convert to 32-bit (allows use of GPU, and is faster on CPU if float32 precision was selected)
+        if self.is_gpu_available() or (self.precision == np.float32):
+            print("    Converting to 32-bit...")
             train_time_series = train_time_series.astype(np.float32)
             test_time_series = test_time_series.astype(np.float32)
             train_price_series = train_price_series.astype(np.float32)
@@ -357,6 +404,9 @@ class ClassifierDarts():
 
         self.is_trained = True
 
+        # export for CPU inference (the in-memory model changes on every training run, even if not saved)
+        self.export_model()
+
         return
 
     # ---------------------------
@@ -390,8 +440,8 @@ class ClassifierDarts():
         # convert dataframe to timeseries
         df_time_series = darts.TimeSeries.from_dataframe(df, time_col='date')
 
-        # convert to 32-bit (allows use of GPU)
-        if self.is_gpu_available():
+        # convert to 32-bit (allows use of GPU, and is faster on CPU if float32 precision was selected)
+        if self.is_gpu_available() or (self.precision == np.float32):
             price_series = price_series.astype(np.float32)
             df_time_series = df_time_series.astype(np.float32)
 
@@ -459,6 +509,9 @@ class ClassifierDarts():
             print(f"  train_cols:{self.train_cols}")
             print(f"  predict_cols:{predict_cols}")
 
+        if self.can_use_runner():
+            return self.predict_exported(dataframe)
+
         # use the whole dataframe the 'covariate' series
         df = dataframe.copy()
         df['date'] = pd.to_datetime(df.date).dt.tz_localize(None)
@@ -485,7 +538,6 @@ class ClassifierDarts():
         df_scaler = Scaler(MinMaxScaler())
         covariate_series = df_scaler.fit_transform(df_time_series)
 
-        self.trainer = Trainer(accelerator='mps', devices=1)
         # print(f'Prediction data size: {np.shape(df)}')
         # with torch.no_grad():
         with torch.inference_mode():
@@ -516,6 +568,38 @@ class ClassifierDarts():
 
     # ---------------------------
 
+    # returns True if predictions can be made with the exported model (only for forecasts that the model produces in
+    # a single step)
+    def can_use_runner(self) -> bool:
+        return self.use_exported_model and (self.runner is not None) and \
+            (self.lookahead <= self.model.output_chunk_length)
+
+    # returns the (scaled) input window for the exported model, and the scaler for the target column
+    # Scaling matches the Darts path: target and covariates (all columns) are scaled over the whole dataframe. The
+    # target is scaled at price_dtype and then converted to 32-bit, the covariates are converted first
+    def get_inference_window(self, dataframe: DataFrame, price_dtype=np.float64):
+        df = dataframe.drop(columns=['date']) if 'date' in dataframe.columns else dataframe
+        price = df[[self.target_column]].to_numpy(dtype=price_dtype)
+        covariates = df.to_numpy(dtype=np.float32)
+
+        price_scaler = MinMaxScaler().fit(price)
+        covariate_scaler = MinMaxScaler().fit(covariates)
+
+        nrows = self.model.input_chunk_length
+        window = np.concatenate([price_scaler.transform(price[-nrows:]).astype(np.float32),
+                                 covariate_scaler.transform(covariates[-nrows:])], axis=1)
+        return window, price_scaler
+
+    # get a prediction using the exported model, without the Darts/Lightning overhead. See scripts/BenchmarkInference.py
+    # for a comparison with the Darts path
+    def predict_exported(self, dataframe: DataFrame):
+        window, price_scaler = self.get_inference_window(dataframe)
+        output = self.runner.predict(window)
+        preds = output.reshape(output.shape[0], output.shape[1], -1)[0, :self.lookahead, 0]
+        return price_scaler.inverse_transform(preds.reshape(-1, 1)).ravel()
+
+    # ---------------------------
+
     # evaluate model using the supplied (normalised) dataframe as test data.
     def evaluate(self, df_norm: DataFrame):
 
@@ -573,22 +657,20 @@ class ClassifierDarts():
 
     # ---------------------------
 
-    # returns path to the coreml model file
-    def get_coreml_model_path(self):
+    # returns path to the exported model file (used for CPU inference)
+    def get_export_path(self):
         root_dir = self.get_model_root_dir()
         save_dir = root_dir + self.category + '/'
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
-        model_path = save_dir + self.model_name + '.coreml'
+        model_path = save_dir + self.model_name + InferenceRunner.get_extension(self.export_format)
         return model_path
 
     # ---------------------------
 
+    # checkpoints are private to this process (see CheckpointManager)
     def get_checkpoint_dir(self):
-        checkpoint_dir = '/tmp' + "/" + self.model_name + "/"
-        if not os.path.exists(checkpoint_dir):
-            os.makedirs(checkpoint_dir)
-        return checkpoint_dir
+        return CheckpointManager.get_checkpoint_dir(self.model_name)
 
     def get_checkpoint_path(self):
         checkpoint_dir = self.get_checkpoint_dir()
@@ -619,8 +701,32 @@ class ClassifierDarts():
 
     # ---------------------------
 
-    def save_as_coreml(self):
-        return
+    # export the network for CPU inference, and load the exported model
+    def export_model(self):
+        self.runner = None
+        path = self.get_export_path()
+        if InferenceRunner.export_darts_model(self.model, path, self.export_format, num_features=len(self.train_cols)):
+            self.runner = InferenceRunner.load(path, self.inference_threads)
+            self.check_runner()
+
+    # load the exported model. If it is missing or older than the model file, export it again
+    def load_runner(self):
+        path = self.get_export_path()
+        if os.path.exists(path) and (os.path.getmtime(path) >= os.path.getmtime(self.model_path)):
+            self.runner = InferenceRunner.load(path, self.inference_threads)
+            self.check_runner()
+        else:
+            self.export_model()
+        return self.runner
+
+    # drops the exported model if it does not give the same outputs as the Darts model
+    def check_runner(self):
+        if self.runner is None:
+            return
+        diff = InferenceRunner.compare_darts_model(self.model, self.runner, num_features=len(self.train_cols))
+        if diff > self.export_tolerance:
+            print(f"    WARN: exported model differs from the Darts model (max diff:{diff:.2e}), not used")
+            self.runner = None
 
     # ---------------------------
 
@@ -639,6 +745,7 @@ class ClassifierDarts():
             self.model = self.load_from_file(self.model_path, use_gpu=self.is_gpu_available())
             self.loaded_from_file = True
             self.is_trained = True
+            self.load_runner()
             print(f'Model: {self.model_path}')
             # summary(self.model, input_size=(self.batch_size, self.lookback, self.num_features))
         else:
@@ -685,6 +792,14 @@ class ClassifierDarts():
 
     # ---------------------------
 
+    # set the dtype used for data passed to the model (np.float32 or np.float64). Also applies to tensors
+    # created by this classifier
+    def set_precision(self, dtype):
+        self.dataframeUtils.set_precision(dtype)
+        self.precision = self.dataframeUtils.precision
+
+    # ---------------------------
+
     def prescale_data(self) -> bool:
         return self.prescale_dataframe
 
@@ -48,6 +48,9 @@ from keras import layers
 import h5py
 
 from DataframeUtils import DataframeUtils
+from AnomalyScorer import AnomalyScorer
+import ModelCache
+import CheckpointManager
 
 class ClassifierKeras():
 
@@ -70,6 +73,11 @@ class ClassifierKeras():
     requires_dataframes = False # set to True if classifier takes dataframes rather than tensors
     prescale_dataframe = True # set to True if algorithms need dataframes to be pre-scaled
     single_prediction = False # True if algorithm only produces 1 prediction (not entire data array)
+    precision = np.float64 # dtype of data passed to the model. See set_precision()
+    streaming = False # if True, predict() only scores new windows and uses a running threshold. See set_streaming()
+    scorer = None # running anomaly threshold state
+    prev_predictions = None # predictions from the last call to predict() (streaming mode only)
+    dbg_verbose = False # print model I/O statistics after each save
 
     # ---------------------------
 
@@ -102,6 +110,9 @@ class ClassifierKeras():
         if self.dataframeUtils is None:
             self.dataframeUtils = DataframeUtils()
 
+        self.scorer = AnomalyScorer()
+        self.prev_predictions = None
+
     # ---------------------------
 
     # set model name - this overrides the default naming. This allows the strategy to set the naming convention
@@ -180,7 +191,7 @@ class ClassifierKeras():
             self.model = self.compile_model(self.model)
             self.model.summary()
 
-        if self.dataframeUtils.is_dataframe(df_train):
+        if self.dataframeUtils.is_dataframe(df_train_norm):
             # remove rows with positive labels?!
             if self.clean_data_required:
                 df1 = df_train_norm.copy()
@@ -199,9 +210,9 @@ class ClassifierKeras():
             train_tensor = self.dataframeUtils.df_to_tensor(df_train, self.seq_len)
             test_tensor = self.dataframeUtils.df_to_tensor(df_test, self.seq_len)
         else:
-            # already in tensor format
-            train_tensor = df_train_norm.copy()
-            test_tensor = df_test_norm.copy()
+            # already in tensor format. Only converted (copied) if not already at the selected precision
+            train_tensor = self.dataframeUtils.as_precision(df_train_norm)
+            test_tensor = self.dataframeUtils.as_precision(df_test_norm)
 
         monitor_field = 'loss'
         monitor_mode = "min"
@@ -225,15 +236,8 @@ class ClassifierKeras():
             patience=plateau_patience,
             verbose=0)
 
-        # callback to control saving of 'best' model
-        # Note that we use validation loss as the metric, not training loss
-        checkpoint_callback = keras.callbacks.ModelCheckpoint(
-            filepath=self.checkpoint_path,
-            save_weights_only=True,
-            monitor=monitor_field,
-            mode=monitor_mode,
-            save_best_only=True,
-            verbose=0)
+        # callback to control saving of 'best' model (kept in memory, written at the end of training)
+        checkpoint_callback = self.get_checkpoint_callback(monitor_field, monitor_mode)
 
         callbacks = [plateau_callback, early_callback, checkpoint_callback]
 
@@ -243,7 +247,7 @@ class ClassifierKeras():
 
         # print("    train_tensor:{} test_tensor:{}".format(np.shape(train_tensor), np.shape(test_tensor)))
 
-        # Model weights are saved at the end of every epoch, if it's the best seen so far.
+        # The best weights (so far) are kept in memory at the end of every epoch, and written at the end of training
         fhis = self.model.fit(train_tensor, train_tensor,
                                     batch_size=self.batch_size,
                                     epochs=self.num_epochs,
@@ -254,6 +258,10 @@ class ClassifierKeras():
         # # The model weights (that are considered the best) are loaded into th model.
         # self.update_model_weights()
 
+        # the anomaly threshold (and any streamed results) belong to the old weights, so start again
+        self.scorer.reset()
+        self.prev_predictions = None
+
         self.save()
         self.is_trained = True
 
@@ -269,7 +277,9 @@ class ClassifierKeras():
 
     # ---------------------------
 
-    def predict(self, data):
+    # num_new is the number of rows added to the data since the last call. If supplied (and streaming is enabled),
+    # only the windows for those rows are run through the model and the rest of the results are re-used
+    def predict(self, data, num_new=None):
 
         # lazy loading because params can change up to this point
         if self.model is None:
@@ -281,45 +291,84 @@ class ClassifierKeras():
             # convert dataframe to tensor
             tensor = self.dataframeUtils.df_to_tensor(data, self.seq_len)
         else:
-            tensor = data
+            tensor = self.dataframeUtils.as_precision(data)
+
+        nrows = np.shape(tensor)[0]
+
+        if self.can_stream(nrows, num_new):
+            # re-use the previous results and just score the new windows
+            keep = nrows - num_new
+            predictions = np.zeros(nrows, dtype=float)
+            if keep > 0:
+                predictions[:keep] = self.prev_predictions[-keep:]
+            if num_new > 0:
+                scores = self.get_anomaly_scores(tensor[-num_new:], verbose=0)
+                if scores is not None:
+                    self.scorer.update(scores)
+                    predictions[keep:] = self.scorer.classify(scores)
+
+        else:
+            scores = self.get_anomaly_scores(tensor, verbose=1)
 
+            if scores is None:
+                predictions = np.zeros(nrows, dtype=float)
+            else:
+                # mean + stddev method (see AnomalyScorer for the MAD alternative)
+                # threshold comes from the scores of the entire batch, unless restored from a previous (streaming) run
+                if (not self.streaming) or (not self.scorer.is_initialised()):
+                    self.scorer.reset()
+                    self.scorer.update(scores)
+
+                # anything anomylous results in a '1'
+                predictions = self.scorer.classify(scores)
+
+        if self.streaming:
+            self.prev_predictions = predictions
+
+        return predictions
+
+    # ---------------------------
 
-        predict_tensor = self.model.predict(tensor, verbose=1)
+    # returns the anomaly score (reconstruction error) for each window in the tensor, or None if the model failed
+    def get_anomaly_scores(self, tensor, verbose=1):
+
+        predict_tensor = self.model.predict(tensor, verbose=verbose)
 
         # not sure why, but predict sometimes returns an odd length
         if np.shape(predict_tensor)[0] != np.shape(tensor)[0]:
             print("    ERR: prediction length mismatch ({} vs {})".format(len(predict_tensor), np.shape(tensor)[0]))
-            predictions = np.zeros(np.shape(tensor)[0], dtype=float)
-        else:
-            # get losses by comparing input to output
-            msle = tf.keras.losses.msle(predict_tensor, tensor)
-            msle = msle[:, 0]
+            return None
 
-            # mean + stddev method
-            # threshold for anomaly scores
-            threshold = np.mean(msle.numpy()) + 2.0 * np.std(msle.numpy())
+        # get losses by comparing input to output
+        msle = tf.keras.losses.msle(predict_tensor, tensor)
+        return msle[:, 0].numpy()
 
-            # anything anomylous results in a '1'
-            predictions = np.where(msle > threshold, 1.0, 0.0)
+    # ---------------------------
 
-            # # Median Absolute Deviation method
-            # threshold = 3.0 # empirical for Dense
-            # # threshold = 2.0 # empirical for Conv
-            # z_scores = self.mad_score(msle)
-            # predictions = np.where(z_scores > threshold, 1.0, 0.0)
+    # returns True if predict() can re-use previous results and only score num_new windows
+    def can_stream(self, nrows, num_new) -> bool:
+        if (not self.streaming) or (num_new is None) or (self.prev_predictions is None):
+            return False
+        if not self.scorer.is_initialised():
+            return False
+        return (0 <= num_new < nrows) and ((nrows - num_new) <= len(self.prev_predictions))
 
-            # # Mean Absolute Error (MAE) method
-            # t1 = predict_tensor[:, 0, :].reshape(np.shape(predict_tensor)[0], np.shape(predict_tensor)[2])
-            # t2 = tensor[:, 0, :].reshape(np.shape(tensor)[0], np.shape(tensor)[2])
-            # print("    predict_tensor:{} tensor:{}".format(np.shape(predict_tensor), np.shape(tensor)))
+    # enable/disable streaming predictions. Intended for live/dry-run modes, where each call adds only a few rows
+    def set_streaming(self, streaming: bool):
+        self.streaming = streaming
+        self.prev_predictions = None
 
-            # mae_loss = np.mean(np.abs(predict_tensor - tensor), axis=1)
-            # threshold = np.max(mae_loss)
-            # predictions = np.where(mae_loss > threshold, 1.0, 0.0)
-            # print("    predictions:{} data:{}".format(np.shape(predictions), predictions))
+    # returns the threshold state of the anomaly scorer (so that it can be persisted by the caller)
+    def get_scorer_state(self) -> dict:
+        return self.scorer.get_state()
 
+    def set_scorer_state(self, state: dict):
+        self.scorer.set_state(state)
+        self.prev_predictions = None
 
-        return predictions
+    # path of the file used to save the scorer state, alongside the model
+    def get_scorer_path(self):
+        return os.path.splitext(self.model_path)[0] + "_scorer.json"
 
     # ---------------------------
 
@@ -335,7 +384,7 @@ class ClassifierKeras():
             # convert dataframe to tensor
             test_tensor = self.dataframeUtils.df_to_tensor(data, self.seq_len)
         else:
-            test_tensor = data
+            test_tensor = self.dataframeUtils.as_precision(data)
 
         print("    Predicting...")
         preds = self.model.predict(test_tensor, verbose=0)
@@ -417,12 +466,15 @@ class ClassifierKeras():
 
     # ---------------------------
 
+    # checkpoints are private to this process (see CheckpointManager)
     def get_checkpoint_path(self):
-        checkpoint_dir = '/tmp'+ "/" + self.name + "/"
-        if not os.path.exists(checkpoint_dir):
-            os.makedirs(checkpoint_dir)
-        model_path = checkpoint_dir + "checkpoint.h5"
-        return model_path
+        return CheckpointManager.get_checkpoint_path(self.name, "checkpoint.weights.h5")
+
+    # returns a callback that keeps the best weights in memory during training, and writes them to the checkpoint
+    # file once, at the end of training (see update_model_weights())
+    def get_checkpoint_callback(self, monitor_field, monitor_mode):
+        self.checkpoint_path = self.get_checkpoint_path()
+        return ModelCache.MemoryCheckpoint(filepath=self.checkpoint_path, monitor=monitor_field, mode=monitor_mode)
 
     # ---------------------------
 
@@ -435,10 +487,14 @@ class ClassifierKeras():
             self.model_path = path
             
         print("    saving model to: ", path)
-        save_dir = os.path.dirname(path)
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
-        keras.models.save_model(self.model, filepath=path)
+        ModelCache.save_model(self.model, path)
+
+        if self.streaming and self.scorer.is_initialised():
+            self.scorer.save(self.get_scorer_path())
+
+        # save() is called at the end of each training cycle, so report the I/O for the cycle
+        if self.dbg_verbose:
+            ModelCache.print_stats()
         return
 
     # ---------------------------
@@ -457,8 +513,11 @@ class ClassifierKeras():
         if os.path.exists(path):
             print("    Loading existing model ({})...".format(path))
             try:
-                model = keras.models.load_model(path, compile=False)
-                self.compile_model(model)
+                # re-uses the model if it has already been loaded by another instance (and the file is unchanged)
+                model = ModelCache.load_model(path, self.compile_model)
+                if self.streaming:
+                    # restore the anomaly threshold state, if present
+                    self.scorer.load(self.get_scorer_path())
                 # optimizer = keras.optimizers.Adam()
                 # optimizer = keras.optimizers.Adam(learning_rate=0.0001)
                 # model.compile(metrics=['mae', 'mse'], loss='mse', optimizer=optimizer)
@@ -499,6 +558,14 @@ class ClassifierKeras():
 
     # ---------------------------
 
+    # set the dtype used for data passed to the model (np.float32 or np.float64). Also applies to tensors
+    # created by this classifier
+    def set_precision(self, dtype):
+        self.dataframeUtils.set_precision(dtype)
+        self.precision = self.dataframeUtils.precision
+
+    # ---------------------------
+
     def prescale_data(self) -> bool:
         return self.prescale_dataframe
 
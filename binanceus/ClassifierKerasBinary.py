@@ -128,9 +128,9 @@ class ClassifierKerasBinary(ClassifierKeras):
             train_tensor = self.dataframeUtils.df_to_tensor(df_train, self.seq_len)
             test_tensor = self.dataframeUtils.df_to_tensor(df_test, self.seq_len)
         else:
-            # already in tensor format
-            train_tensor = df_train_norm.copy()
-            test_tensor = df_test_norm.copy()
+            # already in tensor format. Only converted (copied) if not already at the selected precision
+            train_tensor = self.dataframeUtils.as_precision(df_train_norm)
+            test_tensor = self.dataframeUtils.as_precision(df_test_norm)
 
         monitor_field = 'loss'
         monitor_mode = "min"
@@ -154,15 +154,8 @@ class ClassifierKerasBinary(ClassifierKeras):
             patience=plateau_patience,
             verbose=0)
 
-        # callback to control saving of 'best' model
-        # Note that we use validation loss as the metric, not training loss
-        checkpoint_callback = keras.callbacks.ModelCheckpoint(
-            filepath=self.checkpoint_path,
-            save_weights_only=True,
-            monitor=monitor_field,
-            mode=monitor_mode,
-            save_best_only=True,
-            verbose=0)
+        # callback to control saving of 'best' model (kept in memory, written at the end of training)
+        checkpoint_callback = self.get_checkpoint_callback(monitor_field, monitor_mode)
 
         callbacks = [plateau_callback, early_callback, checkpoint_callback]
 
@@ -172,7 +165,7 @@ class ClassifierKerasBinary(ClassifierKeras):
 
         # print("    train_tensor:{} test_tensor:{}".format(np.shape(train_tensor), np.shape(test_tensor)))
 
-        # Model weights are saved at the end of every epoch, if it's the best seen so far.
+        # The best weights (so far) are kept in memory at the end of every epoch, and written at the end of training
         fhis = self.model.fit(train_tensor, train_results,
                                     batch_size=self.batch_size,
                                     epochs=self.num_epochs,
@@ -200,7 +193,7 @@ class ClassifierKerasBinary(ClassifierKeras):
             # convert dataframe to tensor
             df_tensor = self.dataframeUtils.df_to_tensor(data, self.seq_len)
         else:
-            df_tensor = data
+            df_tensor = self.dataframeUtils.as_precision(data)
 
         if self.model == None:
             print("    ERR: no model for predictions")
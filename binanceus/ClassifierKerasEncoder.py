@@ -101,7 +101,7 @@ class ClassifierKerasEncoder(ClassifierKeras):
             self.model = self.compile_model(self.model)
             self.model.summary()
 
-        if self.dataframeUtils.is_dataframe(df_train):
+        if self.dataframeUtils.is_dataframe(df_train_norm):
             # remove rows with positive labels?!
             if self.clean_data_required:
                 df1 = df_train_norm.copy()
@@ -120,9 +120,9 @@ class ClassifierKerasEncoder(ClassifierKeras):
             train_tensor = self.dataframeUtils.df_to_tensor(df_train, self.seq_len)
             test_tensor = self.dataframeUtils.df_to_tensor(df_test, self.seq_len)
         else:
-            # already in tensor format
-            train_tensor = df_train_norm.copy()
-            test_tensor = df_test_norm.copy()
+            # already in tensor format. Only converted (copied) if not already at the selected precision
+            train_tensor = self.dataframeUtils.as_precision(df_train_norm)
+            test_tensor = self.dataframeUtils.as_precision(df_test_norm)
 
         monitor_field = 'loss'
         monitor_mode = "min"
@@ -146,15 +146,8 @@ class ClassifierKerasEncoder(ClassifierKeras):
             patience=plateau_patience,
             verbose=0)
 
-        # callback to control saving of 'best' model
-        # Note that we use validation loss as the metric, not training loss
-        checkpoint_callback = keras.callbacks.ModelCheckpoint(
-            filepath=self.checkpoint_path,
-            save_weights_only=True,
-            monitor=monitor_field,
-            mode=monitor_mode,
-            save_best_only=True,
-            verbose=0)
+        # callback to control saving of 'best' model (kept in memory, written at the end of training)
+        checkpoint_callback = self.get_checkpoint_callback(monitor_field, monitor_mode)
 
         callbacks = [plateau_callback, early_callback, checkpoint_callback]
 
@@ -164,7 +157,7 @@ class ClassifierKerasEncoder(ClassifierKeras):
 
         # print("    train_tensor:{} test_tensor:{}".format(np.shape(train_tensor), np.shape(test_tensor)))
 
-        # Model weights are saved at the end of every epoch, if it's the best seen so far.
+        # The best weights (so far) are kept in memory at the end of every epoch, and written at the end of training
         
         # Note that this compares the input tensors to themselves
         fhis = self.model.fit(train_tensor, train_tensor,
@@ -177,52 +170,12 @@ class ClassifierKerasEncoder(ClassifierKeras):
         # # The model weights (that are considered the best) are loaded into th model.
         # self.update_model_weights()
 
+        # the anomaly threshold (and any streamed results) belong to the old weights, so start again
+        self.scorer.reset()
+        self.prev_predictions = None
+
         self.save()
         self.is_trained = True
 
         return
 
-
-    def predict(self, data):
-
-
-        # convert to tensor format and run the autoencoder
-        # tensor = np.array(df_norm).reshape(df_norm.shape[0], 1, df_norm.shape[1])
-        tensor = self.dataframeUtils.df_to_tensor(data, self.seq_len)
-
-        predict_tensor = self.model.predict(tensor, verbose=1)
-
-        # not sure why, but predict sometimes returns an odd length
-        if np.shape(predict_tensor)[0] != np.shape(tensor)[0]:
-            print("    ERR: prediction length mismatch ({} vs {})".format(len(predict_tensor), np.shape(tensor)[0]))
-            predictions = np.zeros(data.shape[0], dtype=float)
-        else:
-            # get losses by comparing input to output
-            msle = tf.keras.losses.msle(predict_tensor, tensor)
-            msle = msle[:, 0]
-
-            # mean + stddev method
-            # threshold for anomaly scores
-            threshold = np.mean(msle.numpy()) + 2.0 * np.std(msle.numpy())
-
-            # anything anomylous results in a '1'
-            predictions = np.where(msle > threshold, 1.0, 0.0)
-
-            # # Median Absolute Deviation method
-            # threshold = 3.0 # empirical for Dense
-            # # threshold = 2.0 # empirical for Conv
-            # z_scores = self.mad_score(msle)
-            # predictions = np.where(z_scores > threshold, 1.0, 0.0)
-
-            # # Mean Absolute Error (MAE) method
-            # t1 = predict_tensor[:, 0, :].reshape(np.shape(predict_tensor)[0], np.shape(predict_tensor)[2])
-            # t2 = tensor[:, 0, :].reshape(np.shape(tensor)[0], np.shape(tensor)[2])
-            # print("    predict_tensor:{} tensor:{}".format(np.shape(predict_tensor), np.shape(tensor)))
-
-            # mae_loss = np.mean(np.abs(predict_tensor - tensor), axis=1)
-            # threshold = np.max(mae_loss)
-            # predictions = np.where(mae_loss > threshold, 1.0, 0.0)
-            # print("    predictions:{} data:{}".format(np.shape(predictions), predictions))
-
-        return predictions
-
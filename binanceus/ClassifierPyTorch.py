@@ -65,6 +65,8 @@ random.seed(seed)
 np.random.seed(seed)
 
 from DataframeUtils import DataframeUtils
+import InferenceRunner
+import CheckpointManager
 
 
 # ---------------------------
@@ -94,9 +96,16 @@ class ClassifierPyTorch():
     requires_dataframes = True  # set to True if classifier takes dataframes rather than tensors
     prescale_dataframe = False  # set to True if algorithms need dataframes to be pre-scaled
     single_prediction = True  # True if algorithm only produces 1 prediction (not entire data array)
+    precision = np.float64  # dtype of data passed to the model. See set_precision()
 
     trainer = None
     num_cpus = 1
+    export_format = 'torchscript'  # format of the exported model used for CPU inference ('torchscript' or 'onnx')
+    use_exported_model = False  # opt-in: predict() uses the exported model (if available), rather than the Darts path
+    export_tolerance = 1e-4  # max difference allowed between the outputs of the exported and the Darts network
+    inference_threads = 1  # intra-op threads used by the exported model
+    runner = None  # InferenceRunner for the exported model
+
     use_gpu = True # Note: not all classifiers can use the GPU, and some are slower when they do
 
     train_cols = []  # used for debug
@@ -259,9 +268,9 @@ class ClassifierPyTorch():
         df3['close'] = test_results
         test_price_series = darts.TimeSeries.from_dataframe(df3, time_col='date', value_cols='close', fillna_value=0)
 
-        # convert to 32-bit (allows use of GPU)
-        if self.is_gpu_available():
-            print("    Converting to 32-bit to allow GPU usage...")
+        # convert to 32-bit (allows use of GPU, and is faster on CPU if float32 precision was selected)
+        if self.is_gpu_available() or (self.precision == np.float32):
+            print("    Converting to 32-bit...")
             train_time_series = train_time_series.astype(np.float32)
             test_time_series = test_time_series.astype(np.float32)
             train_price_series = train_price_series.astype(np.float32)
@@ -311,6 +320,9 @@ class ClassifierPyTorch():
 
         self.is_trained = True
 
+        # export for CPU inference (the in-memory model changes on every training run, even if not saved)
+        self.export_model()
+
         return
 
     # ---------------------------
@@ -344,8 +356,8 @@ class ClassifierPyTorch():
         # convert dataframe to timeseries
         df_time_series = darts.TimeSeries.from_dataframe(df, time_col='date')
 
-        # convert to 32-bit (allows use of GPU)
-        if self.is_gpu_available():
+        # convert to 32-bit (allows use of GPU, and is faster on CPU if float32 precision was selected)
+        if self.is_gpu_available() or (self.precision == np.float32):
             price_series = price_series.astype(np.float32)
             df_time_series = df_time_series.astype(np.float32)
 
@@ -407,6 +419,9 @@ class ClassifierPyTorch():
             print(f"  train_cols:{self.train_cols}")
             print(f"  predict_cols:{predict_cols}")
 
+        if self.can_use_runner():
+            return self.predict_exported(dataframe)
+
         # use the whole dataframe the 'covariate' series
         df = dataframe.copy()
         df['date'] = pd.to_datetime(df.date).dt.tz_localize(None)
@@ -434,7 +449,6 @@ class ClassifierPyTorch():
         df_scaler = Scaler(RobustScaler())
         covariate_series = df_scaler.fit_transform(df_time_series)
 
-        self.trainer = Trainer(accelerator='mps', devices=1)
         # print(f'Prediction data size: {np.shape(df)}')
         # with torch.no_grad():
         with torch.inference_mode():
@@ -464,6 +478,83 @@ class ClassifierPyTorch():
 
     # ---------------------------
 
+    # get predictions for a batch of dataframe windows in a single call to the model. Used by RollingPredictor
+    # Returns one prediction (the last value of the forecast) per window
+    def predict_batch(self, windows):
+
+        if self.model is None:
+            print("    ERR: no model")
+            return np.zeros(len(windows))
+
+        if self.can_use_runner():
+            inputs = [self.get_inference_window(window, price_dtype=np.float32) for window in windows]
+            output = self.runner.predict(np.stack([w for w, _ in inputs]))
+            preds = output.reshape(output.shape[0], output.shape[1], -1)[:, self.lookahead - 1, 0]
+            return np.array([scaler.inverse_transform([[p]])[0, 0] for p, (_, scaler) in zip(preds, inputs)],
+                            dtype=float)
+
+        price_list = []
+        covariate_list = []
+        for window in windows:
+            df = window.copy()
+            df['date'] = pd.to_datetime(df.date).dt.tz_localize(None)
+            price_list.append(darts.TimeSeries.from_dataframe(df, time_col='date', value_cols='close')
+                              .astype(np.float32))
+            covariate_list.append(darts.TimeSeries.from_dataframe(df, time_col='date').astype(np.float32))
+
+        # Scaler fits a separate scaler for each series in a list, so this matches the scaling used in predict()
+        price_scaler = Scaler(RobustScaler())
+        price_list = price_scaler.fit_transform(price_list)
+        df_scaler = Scaler(RobustScaler())
+        covariate_list = df_scaler.fit_transform(covariate_list)
+
+        with torch.inference_mode():
+            preds = self.model.predict(n=self.lookahead,
+                                       series=price_list,
+                                       past_covariates=covariate_list,
+                                       batch_size=self.batch_size,
+                                       verbose=False)
+
+        preds = price_scaler.inverse_transform(preds)
+
+        predictions = np.array([p.univariate_values()[-1] for p in preds], dtype=float)
+
+        return predictions
+
+    # ---------------------------
+
+    # returns True if predictions can be made with the exported model (only for forecasts that the model produces in
+    # a single step)
+    def can_use_runner(self) -> bool:
+        return self.use_exported_model and (self.runner is not None) and \
+            (self.lookahead <= self.model.output_chunk_length)
+
+    # returns the (scaled) input window for the exported model, and the scaler for the target column
+    # Scaling matches the Darts path: target and covariates (all columns) are scaled over the whole dataframe. The
+    # target is scaled at price_dtype and then converted to 32-bit, the covariates are converted first
+    def get_inference_window(self, dataframe: DataFrame, price_dtype=np.float64):
+        df = dataframe.drop(columns=['date']) if 'date' in dataframe.columns else dataframe
+        price = df[['close']].to_numpy(dtype=price_dtype)
+        covariates = df.to_numpy(dtype=np.float32)
+
+        price_scaler = RobustScaler().fit(price)
+        covariate_scaler = RobustScaler().fit(covariates)
+
+        nrows = self.model.input_chunk_length
+        window = np.concatenate([price_scaler.transform(price[-nrows:]).astype(np.float32),
+                                 covariate_scaler.transform(covariates[-nrows:])], axis=1)
+        return window, price_scaler
+
+    # get a prediction using the exported model, without the Darts/Lightning overhead. See scripts/BenchmarkInference.py
+    # for a comparison with the Darts path
+    def predict_exported(self, dataframe: DataFrame):
+        window, price_scaler = self.get_inference_window(dataframe)
+        output = self.runner.predict(window)
+        preds = output.reshape(output.shape[0], output.shape[1], -1)[0, :self.lookahead, 0]
+        return price_scaler.inverse_transform(preds.reshape(-1, 1)).ravel()
+
+    # ---------------------------
+
     # evaluate model using the supplied (normalised) dataframe as test data.
     def evaluate(self, df_norm: DataFrame):
 
@@ -521,23 +612,20 @@ class ClassifierPyTorch():
 
     # ---------------------------
 
-    # returns path to the coreml model file
-    def get_coreml_model_path(self):
+    # returns path to the exported model file (used for CPU inference)
+    def get_export_path(self):
         root_dir = self.get_model_root_dir()
         save_dir = root_dir + self.category + '/'
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
-        model_path = save_dir + self.name + '.coreml'
+        model_path = save_dir + self.name + InferenceRunner.get_extension(self.export_format)
         return model_path
 
     # ---------------------------
 
+    # checkpoints are private to this process (see CheckpointManager)
     def get_checkpoint_path(self):
-        checkpoint_dir = '/tmp' + "/" + self.name + "/"
-        if not os.path.exists(checkpoint_dir):
-            os.makedirs(checkpoint_dir)
-        model_path = checkpoint_dir + "checkpoint" + self.model_ext
-        return model_path
+        return CheckpointManager.get_checkpoint_path(self.name, "checkpoint" + self.model_ext)
 
     # ---------------------------
 
@@ -563,8 +651,32 @@ class ClassifierPyTorch():
 
     # ---------------------------
 
-    def save_as_coreml(self):
-        return
+    # export the network for CPU inference, and load the exported model
+    def export_model(self):
+        self.runner = None
+        path = self.get_export_path()
+        if InferenceRunner.export_darts_model(self.model, path, self.export_format, num_features=len(self.train_cols)):
+            self.runner = InferenceRunner.load(path, self.inference_threads)
+            self.check_runner()
+
+    # load the exported model. If it is missing or older than the model file, export it again
+    def load_runner(self):
+        path = self.get_export_path()
+        if os.path.exists(path) and (os.path.getmtime(path) >= os.path.getmtime(self.model_path)):
+            self.runner = InferenceRunner.load(path, self.inference_threads)
+            self.check_runner()
+        else:
+            self.export_model()
+        return self.runner
+
+    # drops the exported model if it does not give the same outputs as the Darts model
+    def check_runner(self):
+        if self.runner is None:
+            return
+        diff = InferenceRunner.compare_darts_model(self.model, self.runner, num_features=len(self.train_cols))
+        if diff > self.export_tolerance:
+            print(f"    WARN: exported model differs from the Darts model (max diff:{diff:.2e}), not used")
+            self.runner = None
 
     # ---------------------------
 
@@ -584,6 +696,7 @@ class ClassifierPyTorch():
             self.model = self.load_from_file(self.model_path)
             self.loaded_from_file = True
             self.is_trained = True
+            self.load_runner()
             print(f'Model: {self.model_path}')
             # summary(self.model, input_size=(self.batch_size, self.seq_len, self.num_features))
         else:
@@ -624,6 +737,14 @@ class ClassifierPyTorch():
 
     # ---------------------------
 
+    # set the dtype used for data passed to the model (np.float32 or np.float64). Also applies to tensors
+    # created by this classifier
+    def set_precision(self, dtype):
+        self.dataframeUtils.set_precision(dtype)
+        self.precision = self.dataframeUtils.precision
+
+    # ---------------------------
+
     def prescale_data(self) -> bool:
         return self.prescale_dataframe
 
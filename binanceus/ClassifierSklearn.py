@@ -1,5 +1,11 @@
 # base class that implements an Anomaly detector using sklearn algorithms
 # subclasses should override the create_classifier() method
+#
+# Predictions are derived from the raw anomaly scores (score_samples(), lower is more anomalous), which are computed
+# once per input and cached by a fingerprint of the data, so repeated calls on the same data (e.g. buy/sell
+# detectors sharing a model, or backtest() followed by predict()) do not re-run inference.
+# The threshold is either mean - threshold_std * std of the scores, or the contamination quantile (threshold_type).
+# Models that do not provide scores use their predict() labels (-1 = anomaly).
 
 
 import numpy as np
@@ -44,6 +50,7 @@ from sklearn.ensemble import IsolationForest
 
 import h5py
 import joblib
+import hashlib
 
 from numpy import quantile
 from DataframeUtils import DataframeUtils
@@ -69,6 +76,13 @@ class ClassifierSklearn():
     requires_dataframes = True  # set to True if classifier takes dataframes rather than tensors
     prescale_dataframe = False  # set to True if algorithms need dataframes to be pre-scaled
     single_prediction = False  # True if alogorithm only produces 1 prediction (not entire data array)
+    precision = np.float64  # dtype of data passed to the model. See set_precision()
+
+    threshold_type = 'std'  # 'std': mean - threshold_std * std of scores, 'quantile': contamination quantile
+    threshold_std = 2.0
+    allow_fit_predict = False  # allow (re-)fitting models that only have fit_predict() on the prediction data (slow)
+    score_cache = None  # fingerprint -> scores (or labels, for models without scores)
+    score_cache_size = 4
 
     def __init__(self, pair, tag=""):
         super().__init__()
@@ -94,6 +108,8 @@ class ClassifierSklearn():
         if self.dataframeUtils is None:
             self.dataframeUtils = DataframeUtils()
 
+        self.score_cache = {}
+
     # set model name - this overrides the default naming. This allows the strategy to set the naming convention
     # directory and extension are handled, just need to supply the category (e.g. the strat name) and main file name
     # caller will have to take care of adding pair names, tag etc.
@@ -152,6 +168,7 @@ class ClassifierSklearn():
         # self.num_estimators = self.num_estimators + 1
         # self.model.set_params(n_estimators=self.num_estimators)
         self.model = self.model.fit(df_train, labels)
+        self.clear_score_cache()
 
         # only save if this is the first time training
         if not self.is_trained:
@@ -178,6 +195,51 @@ class ClassifierSklearn():
         # for sklearn-based models, this is the same thing as running predict(). Here for compatibility with other types
         return self.predict(data)
 
+    # returns a key that identifies the supplied data (shape and contents)
+    def get_fingerprint(self, df_norm) -> str:
+        data = np.ascontiguousarray(df_norm)
+        h = hashlib.sha1()
+        h.update(f"{data.shape}:{data.dtype}".encode())
+        h.update(data.tobytes())
+        return h.hexdigest()
+
+    def clear_score_cache(self):
+        self.score_cache = {}
+
+    def has_scores(self) -> bool:
+        return callable(getattr(self.model, "score_samples", None))
+
+    # returns the raw anomaly scores (lower is more anomalous), or the labels (-1 = anomaly) for models that do not
+    # provide scores. Results are cached, so inference only runs once for a given input
+    def score(self, df_norm: DataFrame):
+
+        key = self.get_fingerprint(df_norm)
+        if key in self.score_cache:
+            return self.score_cache[key]
+
+        if self.has_scores():
+            scores = self.model.score_samples(df_norm)
+        elif callable(getattr(self.model, "predict", None)):
+            scores = np.asarray(self.model.predict(df_norm))
+        elif self.allow_fit_predict and callable(getattr(self.model, "fit_predict", None)):
+            # note: this re-fits the model on the prediction data
+            print(f"    WARN: {self.__class__.__name__} has no predict(), using fit_predict()")
+            scores = np.asarray(self.model.fit_predict(df_norm))
+        else:
+            print("    ERR: classifier does not have a predict() or score_samples() method")
+            return None
+
+        if len(self.score_cache) >= self.score_cache_size:
+            self.score_cache.pop(next(iter(self.score_cache)))
+        self.score_cache[key] = scores
+        return scores
+
+    # returns the anomaly threshold for the supplied scores
+    def get_threshold(self, scores) -> float:
+        if self.threshold_type == 'quantile':
+            return np.quantile(scores, max(self.contamination, 0.0))
+        return scores.mean() - self.threshold_std * scores.std()
+
     # only need to override/define the predict function
     def predict(self, df_norm: DataFrame):
 
@@ -185,37 +247,18 @@ class ClassifierSklearn():
             print("    ERR: no classifier")
             return np.zeros(np.shape(df_norm)[0])
 
-        has_predict = getattr(self.model, "predict", None)
-        if callable(has_predict):
-            pred = self.model.predict(df_norm)
-        else:
-            # some sklearn classifiers have fit_predict instead
-            has_fit_predict = getattr(self.model, "fit_predict", None)
-            if callable(has_fit_predict):
-                pred = self.model.fit_predict(df_norm)
-            else:
-                print("    ERR: classifier does not have a predict() or fit_predict() method")
-                return np.zeros(np.shape(df_norm)[0])
-
-        use_scores = True
-
-        # not all sklearn algorithms support score_samples method, so double-check
-        has_scores = getattr(self.model, "score_samples", None)
-        if not callable(has_scores):
-            use_scores = False
+        scores = self.score(df_norm)
+        if scores is None:
+            return np.zeros(np.shape(df_norm)[0])
 
-        if use_scores:
-            scores = self.model.score_samples(df_norm)
-            # thresh = np.quantile(scores, self.contamination)
-            thresh = scores.mean() - 2.0 * scores.std()
+        if self.has_scores():
+            thresh = self.get_threshold(scores)
             # print("thresh:{:.3f} min:{:.3f} max:{:.3f} mean:{:.3f} std:{:.3f}".format(thresh,
             #                                                                           scores.min(), scores.max(),
             #                                                                           scores.mean(), scores.std()))
-            index = np.where(scores <= thresh)
-            predictions = np.zeros(np.shape(pred)[0])
-            predictions[index] = 1.0
+            predictions = np.where(scores <= thresh, 1.0, 0.0)
         else:
-            predictions = pd.Series(pred).replace([-1, 1], [1.0, 0.0])
+            predictions = pd.Series(scores).replace([-1, 1], [1.0, 0.0])
 
         return predictions
 
@@ -276,6 +319,7 @@ class ClassifierSklearn():
                 # use joblib to reload model state
                 print("    loading from: ", self.model_path)
                 self.model = joblib.load(self.model_path)
+                self.clear_score_cache()
                 self.loaded_from_file = True
                 # self.is_trained = True # training is NOT cumulative for sklearn classifiers
             else:
@@ -296,6 +340,11 @@ class ClassifierSklearn():
     def needs_dataframes(self) -> bool:
         return self.requires_dataframes
 
+    # set the dtype used for data passed to the model (np.float32 or np.float64)
+    def set_precision(self, dtype):
+        self.dataframeUtils.set_precision(dtype)
+        self.precision = self.dataframeUtils.precision
+
     def prescale_data(self) -> bool:
         return self.prescale_dataframe
 
@@ -45,12 +45,21 @@ class DataframePopulator():
     n_profit_stddevs = 1.0
     n_loss_stddevs = 1.0
 
+    # increment this whenever the generated features change, so that stored features are re-generated (see FeatureStore)
+    feature_version = 1
+
     dataframeUtils = None
 
     def __init__(self):
         super().__init__()
         self.dataframeUtils = DataframeUtils()
 
+    # returns a string that identifies the code version and the settings that affect the generated features
+    def get_feature_version(self) -> str:
+        rolling = self.runmode in ('hyperopt', 'backtest', 'plot')
+        return f"{self.feature_version}:{self.startup_win}:{self.win_size}:" \
+               f"{self.n_profit_stddevs}:{self.n_loss_stddevs}:{rolling}"
+
     #################
     
     # populate dataframe with desired technical indicators
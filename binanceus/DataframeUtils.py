@@ -35,6 +35,55 @@ class ScalerType(Enum):
     MinMax = 3
 
 
+# Calendar features derived from the 'date' column (the date itself, as seconds since start_date, then the columns
+# below). These only depend on the date, so are cached across calls (and pairs, which share the same candle dates),
+# and only calculated for dates that have not been seen before
+class CalendarCache():
+    columns = ['days_from_start', 'day_of_week', 'day_of_month', 'week_of_year', 'month']
+    start_date = datetime(2020, 1, 1).astimezone(timezone.utc)
+
+    keys = None  # sorted dates (int64 nanoseconds)
+    values = None  # features for each date, shape (len(keys), 1 + len(columns))
+
+    def __init__(self):
+        super().__init__()
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.values = np.zeros((0, 1 + len(self.columns)), dtype=np.float64)
+
+    def calculate(self, keys) -> np.ndarray:
+        dates = pd.Series(pd.to_datetime(keys, utc=True))
+        values = np.empty((len(keys), 1 + len(self.columns)), dtype=np.float64)
+        # use seconds since start_date rather than raw nanoseconds. The scalers are invariant to offset and scale,
+        # so results are the same, but the values are small enough to be represented in float32
+        values[:, 0] = (dates - self.start_date).dt.total_seconds()
+        values[:, 1] = (dates - self.start_date).dt.days
+        values[:, 2] = dates.dt.dayofweek
+        values[:, 3] = dates.dt.day
+        values[:, 4] = dates.dt.isocalendar().week
+        values[:, 5] = dates.dt.month
+        return values
+
+    # returns the features for each date in the supplied column
+    def get_features(self, dates: Series) -> np.ndarray:
+        keys = pd.to_datetime(dates, utc=True).values.astype('datetime64[ns]').view(np.int64)  # .values is UTC
+
+        pos = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        if (len(self.keys) == 0) or not np.array_equal(self.keys[pos], keys):
+            # add the new dates
+            found = (self.keys[pos] == keys) if len(self.keys) > 0 else np.zeros(len(keys), dtype=bool)
+            new_keys = np.unique(keys[~found])
+            all_keys = np.concatenate([self.keys, new_keys])
+            order = np.argsort(all_keys, kind='stable')
+            self.keys = all_keys[order]
+            self.values = np.concatenate([self.values, self.calculate(new_keys)])[order]
+            pos = np.searchsorted(self.keys, keys)
+
+        return self.values[pos]
+
+
+calendar_cache = CalendarCache()
+
+
 class DataframeUtils():
 
     #################################
@@ -44,6 +93,13 @@ class DataframeUtils():
     scaler_type:ScalerType = ScalerType.NoScaling
     scaler_fitted = False
 
+    # column plans for norm_dataframe(): input columns -> (output columns, source of each output column). Shared, since
+    # plans only depend on the columns
+    norm_plans = {}
+
+    # dtype used for normalised dataframes and tensors. np.float32 halves memory usage (and speeds up CPU-based
+    # training), np.float64 is the 'classic' behaviour. Call set_precision() to change
+    precision = np.float64
 
     # sets the type of scaler desired, and initialises associated vars
     def set_scaler_type(self, type:ScalerType):
@@ -77,6 +133,14 @@ class DataframeUtils():
             print(f"    Unknown scaler type: {self.scaler_type}")
         return scaler
 
+    # sets the dtype used for normalised data and tensors
+    def set_precision(self, dtype):
+        self.precision = np.dtype(dtype).type
+
+    # returns the supplied array at the selected precision. Does not copy if it is already the right dtype
+    def as_precision(self, data):
+        return np.asarray(data, dtype=self.precision)
+
     def fit_scaler(self, dataframe: DataFrame):
         if self.scaler is not None:
             if self.scaler_fitted:
@@ -118,51 +182,102 @@ class DataframeUtils():
 
     ###################################
 
-    # Normalise a dataframe
-    def norm_dataframe(self, dataframe: DataFrame) -> DataFrame:
-
-        self.check_inf(dataframe)
+    # returns the plan for normalising a dataframe with the supplied columns: the output columns, and the source of
+    # each output column: ('frame', position) or ('calendar', index into CalendarCache features)
+    # Debug columns (starting with '%') are removed, and calendar columns added (if there is a 'date' column)
+    def get_norm_plan(self, columns):
+        key = tuple(columns)
+        plan = self.norm_plans.get(key, None)
+        if plan is not None:
+            return plan
+
+        out_cols = []
+        sources = []
+        has_date = 'date' in columns
+        for pos, col in enumerate(columns):
+            if str(col).startswith('%'):
+                continue
+            out_cols.append(col)
+            if has_date and (col == 'date'):
+                sources.append(('calendar', 0))
+            elif has_date and (col in CalendarCache.columns):
+                sources.append(('calendar', 1 + CalendarCache.columns.index(col)))
+            else:
+                sources.append(('frame', pos))
+
+        if has_date:
+            for i, col in enumerate(CalendarCache.columns):
+                if col not in columns:
+                    out_cols.append(col)
+                    sources.append(('calendar', 1 + i))
+
+        plan = (out_cols, sources)
+        self.norm_plans[key] = plan
+        return plan
+
+    # apply the (fitted) scaler to data, in place where possible
+    def transform_inplace(self, data):
+        scaler = self.scaler
+        if isinstance(scaler, StandardScaler):
+            if scaler.with_mean:
+                data -= scaler.mean_.astype(data.dtype)
+            if scaler.with_std:
+                data /= scaler.scale_.astype(data.dtype)
+        elif isinstance(scaler, MinMaxScaler) and not scaler.clip:
+            data *= scaler.scale_
+            data += scaler.min_
+        elif isinstance(scaler, RobustScaler):
+            if scaler.with_centering:
+                data -= scaler.center_
+            if scaler.with_scaling:
+                data /= scaler.scale_
+        else:
+            data = scaler.transform(data)
+        return data
 
-        df = dataframe.copy()
+    # Normalise a dataframe. Returns a dataframe, or the (float) array if as_array is True
+    # The data is assembled directly into a single array (calendar features are cached), which is then scaled in place
+    def norm_dataframe(self, dataframe: DataFrame, as_array=False):
 
         # if no scaling then just return a copy
         if self.scaler_type == ScalerType.NoScaling:
-            return df
+            self.check_inf(dataframe)
+            df = dataframe.copy()
+            return df.to_numpy(dtype=self.precision) if as_array else df
 
         # if scaler not created, then do so
         if self.scaler is  None:
             self.scaler = self.get_scaler()
 
-        # convert date column so that it can be scaled.
-        # Also, add in date components (maybe there's a pattern, who knows?)
-        if 'date' in df.columns:
-            dates = pd.to_datetime(df['date'], utc=True)
-            # dates = pd.to_datetime(df['date'])
-            start_date = datetime(2020, 1, 1).astimezone(timezone.utc)
-            df['date'] = dates.astype('int64')
-            df['days_from_start'] = (dates - start_date).dt.days
-            df['day_of_week'] = dates.dt.dayofweek
-            df['day_of_month'] = dates.dt.day
-            df['week_of_year'] = dates.dt.isocalendar().week
-            df['month'] = dates.dt.month
-            # df['year'] = dates.dt.year
-
-        df = self.remove_debug_columns(df)
+        cols, sources = self.get_norm_plan(dataframe.columns)
 
-        df.set_index('date')
-        df.reindex()
+        # convert once to the selected precision. The scalers preserve float32, so no float64 copies are created
+        data = np.empty((dataframe.shape[0], len(cols)), dtype=self.precision, order='F')  # columns are contiguous
+        calendar = None
+        for i, (source, index) in enumerate(sources):
+            if source == 'frame':
+                data[:, i] = dataframe.iloc[:, index].to_numpy()
+            else:
+                if calendar is None:
+                    # Also, add in date components (maybe there's a pattern, who knows?)
+                    calendar = calendar_cache.get_features(dataframe['date'])
+                data[:, i] = calendar[:, index]
 
-        cols = df.columns
+        inf_cols = np.isinf(data).any(axis=0)
+        if inf_cols.any():
+            print("*** Infinity in cols: ", [col for col, inf in zip(cols, inf_cols) if inf])
 
         # fit, if not already done
         # Note that fitting is only done once, then reused on subsequent calls to norm/denorm.
         # Call set_scaler() to reset
         if not self.scaler_fitted:
-            self.fit_scaler(df)
+            self.fit_scaler(data)
 
-        df = pd.DataFrame(self.scaler.transform(df), columns=cols)
+        data = self.transform_inplace(data)
 
-        return df
+        if as_array:
+            return data
+        return pd.DataFrame(data, columns=cols, copy=False)
 
 
     # De-Normalise a dataframe - note this relies on the scaler still being valid
@@ -193,30 +308,23 @@ class DataframeUtils():
         # print ("label output: ", result)
         return result
 
+    # returns the positions of the rows (of the normalised data, buys & sells) that are within [-limit, limit]
+    def get_inlier_indices(self, df_norm, buys, sells, limit=3.0) -> np.ndarray:
+        data = df_norm.to_numpy() if self.is_dataframe(df_norm) else np.asarray(df_norm)
+        mask = ((data >= -limit) & (data <= limit)).all(axis=1)
+        for labels in (buys, sells):
+            labels = np.asarray(labels)
+            mask &= (labels >= -limit) & (labels <= limit)
+        return np.flatnonzero(mask)
+
     # remove outliers from normalised dataframe
     def remove_outliers(self, df_norm: DataFrame, buys, sells):
-        # for col in df_norm.columns.values:
-        #     if col != 'date':
-        #         df_norm = df_norm[(df_norm[col] <= 3.0)]
-        # return df_norm
-        df = df_norm.copy()
-        df['%temp_buy'] = buys.copy()
-        df['%temp_sell'] = sells.copy()
-        #
-        df2 = df[((df >= -3.0) & (df <= 3.0)).all(axis=1)]
-        # df_out = df[~((df >= -3.0) & (df <= 3.0)).all(axis=1)] # for debug
-        ndrop = df_norm.shape[0] - df2.shape[0]
+        idx = self.get_inlier_indices(df_norm, buys, sells)
+        ndrop = df_norm.shape[0] - len(idx)
         if ndrop > 0:
-            b = df2['%temp_buy'].copy()
-            s = df2['%temp_sell'].copy()
-            df2.drop('%temp_buy', axis=1, inplace=True)
-            df2.drop('%temp_sell', axis=1, inplace=True)
-            df2.reindex()
+            df2, b, s = self.gather_rows(idx, df_norm, buys, sells)
             # if dbg_verbose:
             print("    Removed ", ndrop, " outliers")
-            # print(" df2:", df2)
-            # print(" df_out:", df_out)
-            # print ("df_norm:", df_norm.shape, "df2:", df2.shape, "df_out:", df_out.shape)
         else:
             # no outliers, just return originals
             df2 = df_norm
@@ -226,95 +334,66 @@ class DataframeUtils():
 
     ###################################
     # train/test dataset utilities
+    # The datasets are selected as row positions, and the rows are only extracted (once) at the end
 
-    # build a 'viable' dataframe sample set. Needed because the positive labels are sparse
-    def build_viable_dataset(self, size: int, df_norm: DataFrame, buys, sells):
-        # if dbg_verbose:
-        #     print("     df_norm:{} size:{} buys:{} sells:{}".format(df_norm.shape, size, buys.shape[0], sells.shape[0]))
-
-        # copy and combine the data into one dataframe
-        df = df_norm.copy()
-        df['%temp_buy'] = buys.copy()
-        df['%temp_sell'] = sells.copy()
+    # returns the rows at the supplied positions, with the matching buys & sells (as Series with the same index)
+    def gather_rows(self, idx, df_norm: DataFrame, buys, sells):
+        df2 = df_norm.iloc[idx]
+        b = pd.Series(np.asarray(buys)[idx], index=df2.index)
+        s = pd.Series(np.asarray(sells)[idx], index=df2.index)
+        return df2, b, s
 
-        # df_buy = df[( (df['%temp_buy'] > 0) ).all(axis=1)]
-        # df_sell = df[((df['%temp_sell'] > 0)).all(axis=1)]
-        # df_nosig = df[((df['%temp_buy'] == 0) & (df['%temp_sell'] == 0)).all(axis=1)]
+    # returns the positions of the rows for a 'viable' sample set. Needed because the positive labels are sparse
+    # Rows are ordered buys, sells then 'no signal' (each in the original order)
+    def get_viable_indices(self, size: int, buys, sells) -> np.ndarray:
+        buys = np.asarray(buys)
+        sells = np.asarray(sells)
 
-        df_buy = df.loc[df['%temp_buy'] == 1]
-        df_sell = df.loc[df['%temp_sell'] == 1]
-        df_nosig = df.loc[(df['%temp_buy'] == 0) & (df['%temp_sell'] == 0)]
+        buy_idx = np.flatnonzero(buys == 1)
+        sell_idx = np.flatnonzero(sells == 1)
+        nosig_idx = np.flatnonzero((buys == 0) & (sells == 0))
 
         # make sure there aren't too many buys & sells
         # We are aiming for a roughly even split between buys, sells, and 'no signal' (no buy or sell)
         max_signals = int(2 * size / 3)
-        buy_train_size = df_buy.shape[0]
-        sell_train_size = df_sell.shape[0]
+        buy_train_size = len(buy_idx)
+        sell_train_size = len(sell_idx)
 
-        if max_signals > df_nosig.shape[0]:
-            max_signals = int((size - df_nosig.shape[0])) - 1
+        if max_signals > len(nosig_idx):
+            max_signals = int((size - len(nosig_idx))) - 1
 
-        if ((df_buy.shape[0] + df_sell.shape[0]) > max_signals):
+        if (len(buy_idx) + len(sell_idx)) > max_signals:
             # both exceed max?
             sig_size = int(max_signals / 2)
-            # if dbg_verbose:
-            #     print("     sig_size:{} max_signals:{} buys:{} sells:{}".format(sig_size, max_signals, df_buy.shape[0],
-            #                                                                     df_sell.shape[0]))
 
-            if (df_buy.shape[0] > sig_size) & (df_sell.shape[0] > sig_size):
+            if (len(buy_idx) > sig_size) & (len(sell_idx) > sig_size):
                 # resize both buy & sell to 1/3 of requested size
                 buy_train_size = sig_size
                 sell_train_size = sig_size
             else:
                 # only one them is too big, so figure out which
-                if (df_buy.shape[0] > df_sell.shape[0]):
-                    buy_train_size = max_signals - df_sell.shape[0]
+                if len(buy_idx) > len(sell_idx):
+                    buy_train_size = max_signals - len(sell_idx)
                 else:
-                    sell_train_size = max_signals - df_buy.shape[0]
-
-            # if dbg_verbose:
-            #     print("     buy_train_size:{} sell_train_size:{}".format(buy_train_size, sell_train_size))
-
-        if buy_train_size < df_buy.shape[0]:
-            df_buy, _ = train_test_split(df_buy, train_size=buy_train_size, shuffle=False)
-        if sell_train_size < df_sell.shape[0]:
-            df_sell, _ = train_test_split(df_sell, train_size=sell_train_size, shuffle=False)
+                    sell_train_size = max_signals - len(buy_idx)
 
         # extract enough rows to fill the requested size
         fill_size = size - buy_train_size - sell_train_size - 1
-        # if dbg_verbose:
-        #     print("     df_nosig:{} fill_size:{}".format(df_nosig.shape, fill_size))
-
-        if fill_size < df_nosig.shape[0]:
-            df_nosig, _ = train_test_split(df_nosig, train_size=fill_size, shuffle=False)
-
-        # print("viable df - buys:{} sells:{} fill:{}".format(df_buy.shape[0], df_sell.shape[0], df_nosig.shape[0]))
 
-        # concatenate the dataframes
-        frames = [df_buy, df_sell, df_nosig]
-        df2 = pd.concat(frames)
+        # print("viable df - buys:{} sells:{} fill:{}".format(buy_train_size, sell_train_size, fill_size))
 
-        # # shuffle rows
-        # df2 = df2.sample(frac=1)
-
-        # separate out the data, buys & sells
-        b = df2['%temp_buy'].copy()
-        s = df2['%temp_sell'].copy()
-        df2.drop('%temp_buy', axis=1, inplace=True)
-        df2.drop('%temp_sell', axis=1, inplace=True)
-        df2.reindex()
-
-        # print("     df2:", df2.shape, " b:", b.shape, " s:", s.shape)
-
-        return df2, b, s
+        return np.concatenate([buy_idx[:max(buy_train_size, 0)],
+                               sell_idx[:max(sell_train_size, 0)],
+                               nosig_idx[:max(fill_size, 0)]])
 
+    # build a 'viable' dataframe sample set. Needed because the positive labels are sparse
+    def build_viable_dataset(self, size: int, df_norm: DataFrame, buys, sells):
+        idx = self.get_viable_indices(size, buys, sells)
+        return self.gather_rows(idx, df_norm, buys, sells)
 
-    # build a dataset that mimics 'live' runs
-    def build_standard_dataset(self, size: int, df_norm: DataFrame, buys, sells, lookahead, seq_len):
+    # returns the position of the first row of a dataset that mimics 'live' runs
+    def get_standard_start(self, size: int, df_size: int, buys, lookahead) -> int:
 
-        # constrain size to what will be available in run modes
-        # df_size = df_norm.shape[0]
-        df_size = df_norm.shape[0]
         # data_size = int(min(975, size))
         data_size = size
 
@@ -346,28 +425,36 @@ class DataframeUtils():
             # take the end  (better fit for recent data)
             start = int(df_size - (data_size + pad))
 
-        result_start = start + lookahead
-
         # just double-check ;-)
         if (data_size + lookahead) > df_size:
             print("ERR: invalid data size")
             print("     df:{} data_size:{}".format(df_size, data_size))
 
-        # print("    df:[{}:{}] start:{} end:{} length:{}]".format(0, (data_size - 1),
-        #                                                          start, (start + data_size), data_size))
+        return start
 
-        # convert dataframe to tensor before extracting train/test data (avoid edge effects)
-        tensor = self.df_to_tensor(df_norm, seq_len)
-        buy_tensor = self.df_to_tensor(np.array(buys).reshape(-1, 1), seq_len)
-        sell_tensor = self.df_to_tensor(np.array(sells).reshape(-1, 1), seq_len)
+    # build a dataset that mimics 'live' runs
+    # Only the selected rows are converted to tensors (the windows still include the preceding rows, so there are no
+    # edge effects)
+    def build_standard_dataset(self, size: int, df_norm: DataFrame, buys, sells, lookahead, seq_len):
 
-        # extract desired rows
-        t = tensor[start:start + data_size]
-        b = buy_tensor[start:start + data_size]
-        s = sell_tensor[start:start + data_size]
+        df_size = df_norm.shape[0]
+        start = self.get_standard_start(size, df_size, buys, lookahead)
+
+        # print("    df:[{}:{}] start:{} end:{} length:{}]".format(0, (size - 1), start, (start + size), size))
+
+        rows = np.arange(df_size)[start:start + size]  # same rows as slicing the full tensor
+
+        t = self.rows_to_tensor(df_norm, rows, seq_len)
+        b = self.rows_to_tensor(self.as_precision(buys).reshape(-1, 1), rows, seq_len)
+        s = self.rows_to_tensor(self.as_precision(sells).reshape(-1, 1), rows, seq_len)
 
         return t, b, s
 
+    # returns the positions of the rows on either side of the split row (the split row itself is not included)
+    def get_split_indices(self, nrows: int, ratio: float) -> (np.ndarray, np.ndarray):
+        split_row = int(ratio * nrows)
+        return np.arange(0, split_row), np.arange(split_row + 1, nrows)
+
     ###################################
     # Utilities for 'splitting' various datastructures
 
@@ -467,45 +554,39 @@ class DataframeUtils():
 
     # convert dataframe to 3D tensor (for use with keras models)
     def df_to_tensor(self, df, seq_len):
+        return self.rows_to_tensor(df, np.arange(np.shape(df)[0]), seq_len)
+
+    # convert the selected rows of a dataframe (or array) to a 3D tensor, shape (len(rows), seq_len, nfeatures)
+    # Each entry holds the row followed by the preceding seq_len-1 rows (most recent first). Rows before the start of the
+    # data are zero
+    def rows_to_tensor(self, df, rows, seq_len):
 
         if self.is_dataframe(df):
-            data = np.array(df)
+            data = df.to_numpy(dtype=self.precision)
         else:
-            data = df
+            data = self.as_precision(df)
 
-        nrows = np.shape(data)[0]
-        nfeatures = np.shape(data)[1]
-        tensor_arr = np.zeros((nrows, seq_len, nfeatures), dtype=float)
-        zero_row = np.zeros((nfeatures), dtype=float)
-        # tensor_arr = []
+        # source row for each entry, gathered in one step
+        src_rows = np.asarray(rows).reshape(-1, 1) - np.arange(seq_len)
+        padding = src_rows < 0
+        tensor_arr = data[np.where(padding, 0, src_rows)]
+        tensor_arr[padding] = 0.0
 
-        # print("data:{} tensor:{}".format(np.shape(data), np.shape(tensor_arr)))
-        # print("nrows:{} nfeatures:{}".format(nrows, nfeatures))
+        return tensor_arr
 
-        reverse = True
+    # returns a (read-only) strided view of the supplied data, split into overlapping windows of win_size rows.
+    # Output shape is (nrows-win_size+1, win_size, ...), and window i covers rows [i, i+win_size-1].
+    # Unlike df_to_tensor(), no data is copied, so this is suitable for rolling through large datasets
+    def df_to_windows(self, df, win_size):
 
-        # fill the first part (0..seqlen rows), which are only sparsely populated
-        for row in range(seq_len):
-            for seq in range(seq_len):
-                if seq >= (seq_len - row - 1):
-                    src_row = (row + seq) - seq_len + 1
-                    tensor_arr[row][seq] = data[src_row]
-                else:
-                    tensor_arr[row][seq] = zero_row
-            if reverse:
-                tensor_arr[row] = np.flipud(tensor_arr[row])
-
-        # fill the rest
-        # print("Data:{}, len:{}".format(np.shape(data), seq_len))
-        for row in range(seq_len, nrows):
-            tensor_arr[row] = data[(row - seq_len) + 1:row + 1]
-            if reverse:
-                tensor_arr[row] = np.flipud(tensor_arr[row])
-
-        # print("data: ", data)
-        # print("tensor: ", tensor_arr)
-        # print("data:{} tensor:{}".format(np.shape(data), np.shape(tensor_arr)))
-        return tensor_arr
+        if self.is_dataframe(df):
+            data = df.to_numpy()
+        else:
+            data = np.asarray(df)
+
+        # sliding_window_view() adds the window as the last axis, so move it to be just after the row axis
+        windows = np.lib.stride_tricks.sliding_window_view(data, win_size, axis=0)
+        return np.moveaxis(windows, -1, 1)
 
     # utility to check whether an object is a Dataframe
     def is_dataframe(self, data) -> bool:
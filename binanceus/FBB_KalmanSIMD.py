@@ -33,6 +33,7 @@ log = logging.getLogger(__name__)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 import custom_indicators as cta
+import TradeState
 
 from  simdkalman import KalmanFilter
 
@@ -79,7 +80,9 @@ class FBB_KalmanSIMD(IStrategy):
     startup_candle_count: int = 128
     process_only_new_candles = True
 
-    custom_trade_info = {}
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'rmi-up-trend', 'ssl-dir', 'candle-up-trend']
+    trade_state = None
     filter_list = {}
     filter_init_list = {}
 
@@ -164,6 +167,9 @@ class FBB_KalmanSIMD(IStrategy):
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
 
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
+
         # Base pair informative timeframe indicators
         curr_pair = metadata['pair']
         informative = self.dp.get_pair_dataframe(pair=curr_pair, timeframe=self.inf_timeframe)
@@ -224,11 +230,6 @@ class FBB_KalmanSIMD(IStrategy):
 
         # Custom Stoploss
 
-        if not metadata['pair'] in self.custom_trade_info:
-            self.custom_trade_info[metadata['pair']] = {}
-            if not 'had-trend' in self.custom_trade_info[metadata["pair"]]:
-                self.custom_trade_info[metadata['pair']]['had-trend'] = False
-
         # RMI: https://www.tradingview.com/script/kwIt9OgQ-Relative-Momentum-Index/
         dataframe['rmi'] = cta.RMI(dataframe, length=24, mom=5)
 
@@ -250,6 +251,8 @@ class FBB_KalmanSIMD(IStrategy):
         dataframe['sroc'] = cta.SROC(dataframe, roclen=21, emalen=13, smooth=21)
         dataframe['ssl-dir'] = np.where(sslup > ssldown, 'up', 'down')
 
+        self.trade_state.update(metadata['pair'], dataframe)
+
         return dataframe
 
     ###################################
@@ -471,10 +474,11 @@ class FBB_KalmanSIMD(IStrategy):
     def custom_stoploss(self, pair: str, trade: 'Trade', current_time: datetime, current_rate: float,
                         current_profit: float, **kwargs) -> float:
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had-trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit <  self.cstop_max_stoploss.value:
@@ -504,8 +508,9 @@ class FBB_KalmanSIMD(IStrategy):
     def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0, trade.calc_profit_ratio(trade.max_rate))
@@ -538,7 +543,7 @@ class FBB_KalmanSIMD(IStrategy):
         # Don't sell if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful sell message later
-            self.custom_trade_info[trade.pair]['had-trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a sell, maybe
             if self.cexit_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -552,12 +557,12 @@ class FBB_KalmanSIMD(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had-trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_roi'
                 elif self.cexit_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_noroi'
             elif current_profit > min_roi:
                 return 'notrend_roi'
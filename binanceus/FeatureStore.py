@@ -0,0 +1,170 @@
+# Persistent store for the features generated by DataframePopulator
+#
+# All of the ML strategies (PCA_*, NNBC_*, Anomaly_*, NNPredict_*) populate the same set of indicators for a pair, so
+# running several of them over the same backtest range recomputes identical features many times (and the rolling DWT
+# is expensive). This class saves the populated dataframe for each (exchange, pair, timeframe, feature set, version)
+# as an (uncompressed, memory-mappable) Feather file and re-uses it on later runs:
+#
+#   - if the stored data covers the requested dataframe (same start date and candles), it is returned directly
+#   - if the dataframe extends past the stored data, only the new candles are calculated (plus a warmup period so that
+#     the rolling windows are primed) and the result is appended to the store
+#   - anything else (different start date, changed candle data, different settings) is recalculated in full
+#
+# Only backward-looking features should be stored. Results are only exact for indicators with finite windows;
+# exponential indicators (EMA, RSI etc.) converge within the warmup period, so may differ in the last decimal places
+# from a full recalculation. Set warmup to 0 to disable appending (exact matches only).
+#
+# Usage:
+#    store = FeatureStore('binanceus', '5m', version=populator.get_feature_version())
+#    dataframe = store.populate(pair, dataframe, 'indicators', populator.add_indicators)
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+import pyarrow.feather as feather
+
+# Strategy specific imports, files must reside in same folder as strategy
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class FeatureStore():
+
+    exchange = ""
+    timeframe = ""
+    version = ""  # identifies the code/settings used to generate the features. Change it to invalidate the store
+    warmup = 1024  # number of previous candles used when calculating new candles. 0 disables appending
+    enabled = True
+    verbose = True  # print a line for every request
+
+    hits = 0
+    appends = 0
+    misses = 0
+
+    # ---------------------------
+
+    def __init__(self, exchange, timeframe, version="", warmup=1024):
+        super().__init__()
+
+        self.exchange = exchange
+        self.timeframe = timeframe
+        self.version = version
+        self.warmup = warmup
+
+        self.frames = {}  # in-memory copies, keyed by file path
+        self.hits = 0
+        self.appends = 0
+        self.misses = 0
+
+    # ---------------------------
+
+    # returns the root directory used for the store
+    def get_store_dir(self):
+        file_dir = os.path.dirname(str(Path(__file__)))
+        return file_dir + "/cache/features/" + self.exchange + "/" + self.timeframe + "/"
+
+    def get_path(self, pair, feature_set) -> str:
+        version = hashlib.sha1(str(self.version).encode()).hexdigest()[:12]
+        return self.get_store_dir() + pair.replace("/", "_") + "_" + feature_set + "_" + version + ".feather"
+
+    def load(self, path):
+        if path in self.frames:
+            return self.frames[path]
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            frame = feather.read_table(path, memory_map=True).to_pandas()
+        except Exception as e:
+            print(f"    WARN: could not read feature store ({path}): {e}")
+            return None
+
+        self.frames[path] = frame
+        return frame
+
+    def save(self, path, frame: DataFrame):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + f".tmp{os.getpid()}"
+        feather.write_feather(frame.reset_index(drop=True), tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+        self.frames[path] = frame
+
+    # ---------------------------
+
+    # returns the number of leading rows of dataframe that match the stored frame (same dates and prices)
+    def get_num_matching(self, stored: DataFrame, dataframe: DataFrame) -> int:
+        if (stored is None) or (len(stored) == 0) or (len(dataframe) == 0):
+            return 0
+        if stored['date'].iloc[0] != dataframe['date'].iloc[0]:
+            return 0
+
+        n = min(len(stored), len(dataframe))
+        if stored['date'].iloc[n - 1] != dataframe['date'].iloc[n - 1]:
+            return 0
+
+        for col in ('open', 'high', 'low', 'close', 'volume'):
+            if not np.array_equal(stored[col].to_numpy()[:n], dataframe[col].to_numpy()[:n]):
+                return 0
+        return n
+
+    # returns the dataframe with the features produced by func(dataframe) added, using the store where possible
+    def populate(self, pair, dataframe: DataFrame, feature_set, func) -> DataFrame:
+        if not self.enabled:
+            return func(dataframe)
+
+        path = self.get_path(pair, feature_set)
+        stored = self.load(path)
+        nrows = len(dataframe)
+        nmatch = self.get_num_matching(stored, dataframe)
+
+        # stored data covers the whole dataframe (including the last candle)
+        if (nmatch == nrows) and (nrows == len(stored)):
+            self.hits += 1
+            self.report(pair, feature_set, "hit")
+            return self.restore_index(stored.copy(), dataframe)
+
+        # features of the last stored row can depend on the next row (e.g. gradients), so do not re-use that row
+        nkeep = nmatch - 1
+        if (self.warmup <= 0) or (nkeep <= 0):
+            result = func(dataframe)
+            self.misses += 1
+            self.report(pair, feature_set, "miss")
+        else:
+            # calculate the new rows (plus warmup), then combine with the stored rows
+            start = max(0, nkeep - self.warmup)
+            tail = func(dataframe.iloc[start:].copy())
+            tail = tail.iloc[nkeep - start:]
+            result = pd.concat([stored.iloc[:nkeep], tail[stored.columns]], ignore_index=True)
+            self.appends += 1
+            self.report(pair, feature_set, f"append ({nrows - nkeep} rows)")
+
+        # only grow the store, never replace longer data with a shorter (prefix) range
+        if (stored is None) or (nmatch == 0) or (nrows > len(stored)):
+            self.save(path, result)
+
+        return self.restore_index(result.copy(), dataframe)
+
+    # the returned dataframe should have the same index as the original
+    def restore_index(self, frame: DataFrame, dataframe: DataFrame) -> DataFrame:
+        frame = frame.iloc[:len(dataframe)]
+        frame.index = dataframe.index
+        return frame
+
+    # ---------------------------
+
+    def report(self, pair, feature_set, status):
+        if self.verbose:
+            print(f"    Feature store ({feature_set}): {status}")
+
+    def print_stats(self):
+        print(f"    Feature store - hits:{self.hits} appends:{self.appends} misses:{self.misses}")
@@ -0,0 +1,217 @@
+# Portable CPU inference for the Darts/PyTorch predictors
+#
+# Running predictions through Darts means building TimeSeries objects, a DataLoader and a Lightning Trainer on every
+# call, which dominates the time taken for single predictions (the network itself is small).
+# Instead, the trained network is exported (TorchScript, or ONNX if onnxruntime is installed) to a file next to the
+# model file, and predictions are made by evaluating the exported network directly on numpy windows on the CPU.
+#
+# Only the network is exported, so callers are responsible for scaling the inputs/outputs in the same way as the
+# model was trained. For Darts 'past covariates' models, the input window is the (scaled) target followed by the
+# (scaled) covariates, i.e. shape (batch, input_chunk_length, 1 + num_covariates), and the output has shape
+# (batch, output_chunk_length, ...), where the first value of each step is the prediction for the (single) target.
+#
+# Usage:
+#    InferenceRunner.export_darts_model(darts_model, path)
+#    runner = InferenceRunner.load(path, num_threads=1)
+#    if InferenceRunner.compare_darts_model(darts_model, runner) > tolerance:
+#        runner = None  # exported model does not match, use the Darts path
+#    preds = runner.predict(windows)  # numpy in, numpy out
+
+import os
+import time
+
+import numpy as np
+import torch
+
+try:
+    import onnxruntime
+    onnx_installed = True
+except ModuleNotFoundError:
+    onnx_installed = False
+
+
+# wraps a Darts network so that it can be called with a single tensor
+class DartsModuleWrapper(torch.nn.Module):
+
+    def __init__(self, module, takes_tuple):
+        super().__init__()
+        self.module = module
+        self.takes_tuple = takes_tuple  # newer versions of Darts pass (inputs, static covariates)
+
+    def forward(self, x):
+        if self.takes_tuple:
+            return self.module((x, None))
+        return self.module(x)
+
+
+# ---------------------------
+
+# returns the file extension used for the export format (TorchScript is used if onnxruntime is not installed)
+def get_extension(export_format) -> str:
+    return '.onnx' if (export_format == 'onnx') and onnx_installed else '.ts'
+
+
+# exports a torch module. The example input is only used to trace the module (batch size is not fixed)
+def export_module(module, example, path, export_format='torchscript') -> bool:
+
+    module = module.eval()
+
+    if (export_format == 'onnx') and (not onnx_installed):
+        print("    WARN: onnxruntime not installed, using TorchScript")
+        export_format = 'torchscript'
+
+    save_dir = os.path.dirname(path)
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    with torch.no_grad():
+        if export_format == 'onnx':
+            torch.onnx.export(module, example, path, input_names=['x'], output_names=['y'],
+                              dynamic_axes={'x': {0: 'batch'}, 'y': {0: 'batch'}})
+        else:
+            traced = torch.jit.trace(module, example, check_trace=False)
+            torch.jit.save(traced, path)
+
+    print(f"    exported model to: {path}")
+    return True
+
+
+# wraps the network of a Darts model, using whichever call convention works for the example input (this changed
+# between Darts versions). Returns None if neither works
+def get_darts_wrapper(module, example):
+    for takes_tuple in (True, False):
+        try:
+            with torch.no_grad():
+                DartsModuleWrapper(module, takes_tuple)(example)
+            return DartsModuleWrapper(module, takes_tuple)
+        except (TypeError, ValueError, RuntimeError, AttributeError):
+            continue
+    return None
+
+
+# exports the network of a (trained) Darts 'past covariates' model. num_features is the number of input columns
+# (target + covariates), and is only needed if the model does not record it (older versions of Darts)
+# Returns False if the model type is not supported (use the Darts prediction path instead)
+def export_darts_model(model, path, export_format='torchscript', num_features=0) -> bool:
+
+    from darts.models.forecasting.torch_forecasting_model import PastCovariatesTorchModel
+
+    if not isinstance(model, PastCovariatesTorchModel):
+        print(f"    WARN: export not supported for {type(model).__name__}")
+        return False
+
+    if getattr(model, 'likelihood', None) is not None:
+        print("    WARN: export not supported for probabilistic models")
+        return False
+
+    module = getattr(model, 'model', None)
+    if module is None:
+        print("    WARN: model has not been trained, not exported")
+        return False
+
+    module = module.eval()
+    dtype = next(module.parameters()).dtype
+    sample = getattr(model, 'train_sample', None)
+    if sample is not None:
+        nfeatures = sum(np.shape(s)[1] for s in sample[:2] if s is not None)
+    else:
+        nfeatures = num_features
+    example = torch.zeros((1, model.input_chunk_length, nfeatures), dtype=dtype)
+
+    wrapper = get_darts_wrapper(module, example)
+    if wrapper is None:
+        print("    WARN: could not determine model inputs, not exported")
+        return False
+
+    return export_module(wrapper, example, path, export_format)
+
+
+# checks that the exported model gives the same outputs as the network of the Darts model, using the model's training
+# sample (scaled target + covariates) as input, or a random window (num_features columns) if that is not available.
+# Returns the largest absolute difference
+def compare_darts_model(model, runner, num_features=0) -> float:
+
+    module = model.model.eval()
+    dtype = next(module.parameters()).dtype
+    sample = getattr(model, 'train_sample', None)
+    if sample is not None:
+        window = np.concatenate([s for s in sample[:2] if s is not None], axis=1)
+    else:
+        window = np.random.default_rng(0).random((model.input_chunk_length, num_features))
+    x = torch.as_tensor(np.asarray(window)[np.newaxis], dtype=dtype)
+
+    wrapper = get_darts_wrapper(module, x)
+    if wrapper is None:
+        return np.inf
+
+    with torch.no_grad():
+        expected = wrapper(x).numpy()
+    actual = runner.predict(x.numpy())
+    if np.shape(actual) != np.shape(expected):
+        return np.inf
+    return float(np.max(np.abs(actual.astype(float) - expected.astype(float))))
+
+
+# loads an exported model. Returns None if the file does not exist
+def load(path, num_threads=1):
+    if not os.path.exists(path):
+        return None
+    return InferenceRunner(path, num_threads)
+
+
+# ---------------------------
+
+class InferenceRunner():
+    path = ""
+    num_threads = 1  # intra-op threads. Predictions are usually small, so more threads mostly add overhead
+    session = None  # ONNX Runtime session
+    module = None  # TorchScript module
+    dtype = np.float32
+
+    # ---------------------------
+
+    def __init__(self, path, num_threads=1):
+        super().__init__()
+        self.path = path
+        self.num_threads = num_threads
+
+        if path.endswith('.onnx'):
+            options = onnxruntime.SessionOptions()
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+            self.session = onnxruntime.InferenceSession(path, sess_options=options,
+                                                        providers=['CPUExecutionProvider'])
+            self.dtype = np.float64 if ('double' in self.session.get_inputs()[0].type) else np.float32
+        else:
+            self.module = torch.jit.load(path, map_location='cpu').eval()
+            params = list(self.module.parameters())
+            self.dtype = np.float64 if (len(params) > 0) and (params[0].dtype == torch.float64) else np.float32
+
+    # ---------------------------
+
+    # evaluate the model on a batch of windows (numpy array, shape (batch, steps, features))
+    def predict(self, windows) -> np.ndarray:
+
+        x = np.ascontiguousarray(windows, dtype=self.dtype)
+        if x.ndim == 2:
+            x = x[np.newaxis]
+
+        if self.session is not None:
+            return self.session.run(None, {'x': x})[0]
+
+        # torch thread settings are global, so restore them afterwards
+        threads = torch.get_num_threads()
+        torch.set_num_threads(self.num_threads)
+        try:
+            with torch.inference_mode():
+                return self.module(torch.from_numpy(x)).numpy()
+        finally:
+            torch.set_num_threads(threads)
+
+    # returns the average time (secs) taken per call to predict() for the supplied windows
+    def benchmark(self, windows, num_calls=100) -> float:
+        self.predict(windows)  # warm up
+        start = time.perf_counter()
+        for _ in range(num_calls):
+            self.predict(windows)
+        return (time.perf_counter() - start) / num_calls
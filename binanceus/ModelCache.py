@@ -0,0 +1,150 @@
+# Process-wide cache and fast save/load for keras models (used by the ClassifierKeras family)
+#
+# Strategies create one classifier per pair (and tag) and each one used to load its model from disk and re-compile it,
+# even if another instance had already loaded the same file, and the ModelCheckpoint callback wrote an h5 file to /tmp
+# on every improved epoch.
+# This module:
+#   - caches loaded models, keyed by path and file modification time, so instances share already-loaded models.
+#     Saves always write the full model, since the model files are shared (and may be loaded without this module)
+#   - provides a checkpoint callback that keeps the best weights in memory, and only writes them at the end of training
+#   - tracks the time and bytes spent on model I/O, which can be reported per training cycle
+#
+# Usage:
+#    import ModelCache
+#
+#    model = ModelCache.load_model(path, compile_func)
+#    ModelCache.save_model(model, path)
+#    callback = ModelCache.MemoryCheckpoint(filepath, monitor='loss', mode='min')
+#    ModelCache.print_stats()
+
+import os
+import time
+
+import numpy as np
+
+import keras
+
+# path -> {'mtime': modification time of the model file, 'model': model}
+models = {}
+
+# I/O statistics for the current training cycle (see print_stats())
+stats = {'load_time': 0.0, 'save_time': 0.0, 'bytes_read': 0, 'bytes_written': 0, 'cache_hits': 0}
+
+
+def reset_stats():
+    for key in stats:
+        stats[key] = 0
+
+
+def print_stats(reset=True):
+    print("    model I/O - load:{:.2f}s save:{:.2f}s read:{:.0f}KB written:{:.0f}KB cache hits:{}".format(
+        stats['load_time'], stats['save_time'], stats['bytes_read'] / 1024, stats['bytes_written'] / 1024,
+        stats['cache_hits']))
+    if reset:
+        reset_stats()
+
+
+def get_file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+# returns the modification time of the model file (0 if the model does not exist)
+def get_mtime(path):
+    if not os.path.exists(path):
+        return 0.0
+    return os.path.getmtime(path)
+
+
+# ---------------------------
+
+# load a model, re-using an already loaded instance if the files have not changed.
+# compile_func(model) is only called for models that are actually loaded from disk
+def load_model(path, compile_func=None):
+    mtime = get_mtime(path)
+    if mtime == 0.0:
+        return None
+
+    entry = models.get(path, None)
+    if (entry is not None) and (entry['mtime'] == mtime):
+        stats['cache_hits'] += 1
+        return entry['model']
+
+    start = time.perf_counter()
+
+    model = keras.models.load_model(path, compile=False)
+    stats['bytes_read'] += get_file_size(path)
+
+    if compile_func is not None:
+        model = compile_func(model) or model
+
+    stats['load_time'] += time.perf_counter() - start
+
+    models[path] = {'mtime': mtime, 'model': model}
+    return model
+
+
+# save a model, and update the cache entry (so that other instances re-use it, rather than re-loading the file)
+def save_model(model, path):
+    start = time.perf_counter()
+
+    save_dir = os.path.dirname(path)
+    if not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+    keras.models.save_model(model, filepath=path)
+    stats['bytes_written'] += get_file_size(path)
+
+    models[path] = {'mtime': get_mtime(path), 'model': model}
+    stats['save_time'] += time.perf_counter() - start
+
+
+# remove a model from the cache (e.g. if the files were replaced)
+def evict(path):
+    models.pop(path, None)
+
+
+# ---------------------------
+
+# Keeps a copy of the best weights seen during training in memory, instead of writing a checkpoint file every time
+# the monitored value improves. If filepath is set, the best weights are written to it once, at the end of training
+class MemoryCheckpoint(keras.callbacks.Callback):
+
+    def __init__(self, filepath="", monitor='loss', mode='min', restore_best=False):
+        super().__init__()
+
+        self.filepath = filepath
+        self.monitor = monitor
+        self.mode = mode
+        self.restore_best = restore_best  # load the best weights into the model at the end of training
+
+        self.best = None
+        self.best_weights = None
+
+    def on_train_begin(self, logs=None):
+        self.best = np.inf if self.mode == 'min' else -np.inf
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor, None)
+        if current is None:
+            return
+
+        improved = (current < self.best) if self.mode == 'min' else (current > self.best)
+        if improved:
+            self.best = current
+            self.best_weights = [np.copy(w) for w in self.model.get_weights()]
+
+    def on_train_end(self, logs=None):
+        if self.best_weights is None:
+            return
+
+        if self.restore_best:
+            self.model.set_weights(self.best_weights)
+
+        if len(self.filepath) > 0:
+            start = time.perf_counter()
+            current_weights = self.model.get_weights()
+            self.model.set_weights(self.best_weights)
+            self.model.save_weights(self.filepath)
+            self.model.set_weights(current_weights)
+            stats['bytes_written'] += get_file_size(self.filepath)
+            stats['save_time'] += time.perf_counter() - start
@@ -40,6 +40,8 @@ log = logging.getLogger(__name__)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 import custom_indicators as cta
+import StageProfiler
+import TradeState
 from finta import TA as fta
 
 from sklearn.model_selection import RandomizedSearchCV, train_test_split
@@ -86,7 +88,10 @@ import RBM
 
 
 from DataframeUtils import DataframeUtils, ScalerType
+from WalkForward import WalkForward
+from PairPrecompute import PairPrecompute
 from DataframePopulator import DataframePopulator
+from FeatureStore import FeatureStore
 
 from NNBClassifier_MLP import NNBClassifier_MLP
 from NNBClassifier_MLP2 import NNBClassifier_MLP2
@@ -217,7 +222,9 @@ class NNBC(IStrategy):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'mfi', 'rmi_up_trend', 'ssl_dir', 'candle_up_trend']
+    trade_state = None
 
     # the following affect training of the model. Bigger numbers give better results, but take longer and use more memory
     seq_len = 8  # 'depth' of training sequence
@@ -229,9 +236,19 @@ class NNBC(IStrategy):
     model_per_pair = False
 
     scaler_type = ScalerType.Robust # scaler type used for normalisation
+    # dtype used for normalised data, tensors and models. Keras models compute in float32 anyway, so this just avoids
+    # creating (and casting) float64 copies. Set to np.float64 to restore the old behaviour
+    precision = np.float32
 
     dataframeUtils = None
     dataframePopulator = None
+    featureStore = None
+    use_feature_store = True  # load/save populated indicators in a persistent store (see FeatureStore)
+    walkForward = None
+    retrain_interval = 32  # number of candles between re-training of the models (see WalkForward)
+    pairPrecompute = None
+    parallel_precompute = True  # pre-compute all pairs in parallel (backtest only, see PairPrecompute)
+    precompute_workers = 0  # number of processes used for pre-computation. 0 means use all CPUs
 
     buy_tag = 'Buy'
     sell_tag = 'Sell'
@@ -352,10 +369,33 @@ class NNBC(IStrategy):
 
     ###################################
 
+    # called by freqtrade after the strategy has been loaded (and dp is available)
+    def bot_start(self, **kwargs) -> None:
+        if self.parallel_precompute:
+            if self.can_precompute():
+                self.run_precompute()
+            else:
+                print("    WARN: parallel_precompute is not used, since models are shared across pairs")
+
+    # runs populate_indicators() for all pairs in parallel worker processes (backtest only, first call only)
+    def run_precompute(self):
+        if self.pairPrecompute is None:
+            self.pairPrecompute = PairPrecompute(max_workers=self.precompute_workers)
+        if self.pairPrecompute.is_enabled(self):
+            self.pairPrecompute.run(self)
+
+    # returns True if the pairs can be processed independently (in parallel). A shared model is trained on each pair
+    # in turn, and the workers would all write the same model file
+    def can_precompute(self) -> bool:
+        return self.model_per_pair
+
+    ###################################
+
     """
     Indicator Definitions
     """
 
+    @StageProfiler.profile('indicators')
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
         # Base pair inf timeframe indicators
@@ -369,6 +409,12 @@ class NNBC(IStrategy):
         if self.dataframeUtils is None:
             self.dataframeUtils = DataframeUtils()
 
+        if self.walkForward is None:
+            # datasets can only be re-used if the same data is processed again, so only cache them in backtests
+            self.walkForward = WalkForward(self.__class__.__name__, retrain_interval=self.retrain_interval,
+                                           timeframe_mins=self.data_mins,
+                                           use_cache=(self.dp.runmode.value in ('backtest', 'hyperopt')))
+
         if self.dataframePopulator is None:
             if self.dbg_trace_memory:
                 profiler.start(10)
@@ -382,6 +428,13 @@ class NNBC(IStrategy):
             self.dataframePopulator.n_loss_stddevs = self.n_loss_stddevs
             self.dataframePopulator.n_profit_stddevs = self.n_profit_stddevs
 
+        # re-use indicators calculated by previous runs (rolling calculation modes only)
+        if self.featureStore is None:
+            self.featureStore = FeatureStore(self.config['exchange']['name'], self.timeframe,
+                                             version=self.dataframePopulator.get_feature_version())
+            self.featureStore.enabled = self.use_feature_store and \
+                                        (self.dp.runmode.value in ('hyperopt', 'backtest', 'plot'))
+
         if self.first_time:
             self.first_time = False
             print("")
@@ -397,15 +450,25 @@ class NNBC(IStrategy):
         print("")
         print(curr_pair)
 
+        # in backtest mode, run populate_indicators() for all pairs in parallel (on the first call), then just use
+        # the results
+        if self.parallel_precompute and self.can_precompute():
+            self.run_precompute()
+            cached = self.pairPrecompute.get(curr_pair, dataframe)
+            if cached is not None:
+                return self.add_stoploss_indicators(cached, curr_pair)
+
         # make sure we only retrain in backtest modes
         if self.dp.runmode.value not in ('backtest'):
             self.refit_model = False
 
         # (re-)set the scaler
         self.dataframeUtils.set_scaler_type(self.scaler_type)
+        self.dataframeUtils.set_precision(self.precision)
 
         # populate the normal dataframe
-        dataframe = self.dataframePopulator.add_indicators(dataframe)
+        dataframe = self.featureStore.populate(self.curr_pair, dataframe, 'indicators',
+                                               self.dataframePopulator.add_indicators)
 
         buys, sells = self.create_training_data(dataframe)
 
@@ -448,7 +511,8 @@ class NNBC(IStrategy):
     def create_training_data(self, dataframe: DataFrame):
 
         # future_df = self.add_future_data(dataframe.copy())
-        future_df = self.dataframePopulator.add_hidden_indicators(dataframe.copy())
+        future_df = self.featureStore.populate(self.curr_pair, dataframe.copy(), 'hidden',
+                                               self.dataframePopulator.add_hidden_indicators)
         future_df = self.dataframePopulator.add_future_data(future_df, self.curr_lookahead)
 
         future_df['train_buy'] = 0.0
@@ -506,13 +570,12 @@ class NNBC(IStrategy):
 
     # add indicators used by stoploss/custom sell logic
     def add_stoploss_indicators(self, dataframe, pair) -> DataFrame:
-        if not pair in self.custom_trade_info:
-            self.custom_trade_info[pair] = {}
-            if not 'had_trend' in self.custom_trade_info[pair]:
-                self.custom_trade_info[pair]['had_trend'] = False
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
 
         # Indicators used for ROI and Custom Stoploss
         dataframe = self.dataframePopulator.add_stoploss_indicators(dataframe)
+        self.trade_state.update(pair, dataframe)
         return dataframe
 
 
@@ -525,6 +588,7 @@ class NNBC(IStrategy):
 
     # train the PCA reduction and classification models
 
+    @StageProfiler.profile('training')
     def train_models(self, curr_pair, dataframe: DataFrame, buys, sells):
 
         # check input - need at least 2 samples or classifiers will not train
@@ -537,32 +601,37 @@ class NNBC(IStrategy):
         #     print("*** ERR: insufficient sells in expected results. Check training data")
         #     return
 
-        rand_st = 27  # use fixed number for reproducibility
-
-        remove_outliers = False
-        if remove_outliers:
-            # norm dataframe before splitting, otherwise variances are skewed
-            full_df_norm = self.dataframeUtils.norm_dataframe(dataframe)
-            full_df_norm, buys, sells = self.dataframeUtils.remove_outliers(full_df_norm, buys, sells)
-        else:
-            # full_df_norm = self.dataframeUtils.norm_dataframe(dataframe).clip(lower=-3.0, upper=3.0)  # supress outliers
-            full_df_norm = self.dataframeUtils.norm_dataframe(dataframe)
-
-
-        # compress data
-        if self.compress_data:
-            old_size = full_df_norm.shape[1]
-            full_df_norm = self.compress_dataframe(full_df_norm)
-            print("    Compressed data {} -> {} (features)".format(old_size, full_df_norm.shape[1]))
+        # only run when the data moves into a new retraining fold (no point retraining every candle). See WalkForward
+        if not self.walkForward.should_retrain(curr_pair, dataframe):
+            return
 
-        # constrain size to what will be available in run modes
-        if self.use_full_dataset:
-            data_size = int(0.9 * full_df_norm.shape[0])
+        # re-use the train/test tensors for this fold if they have already been built
+        fold_id = self.walkForward.get_fold_id(dataframe)
+        config = f"{self.scaler_type}:{self.precision}:{self.seq_len}:{self.curr_lookahead}:" \
+                 f"{self.compress_data}:{self.use_full_dataset}"
+        cache_key = self.walkForward.get_cache_key(curr_pair, fold_id, dataframe, buys, sells, config=config)
+        dataset = self.walkForward.load_dataset(curr_pair, cache_key)
+        if dataset is None:
+            v_tensor, v_buys, v_sells = self.build_standard_data(dataframe, buys, sells)
+
+            tsr_train, tsr_test, train_buys, test_buys, \
+            train_sells, test_sells, = self.dataframeUtils.split_tensor(v_tensor,
+                                                                   v_buys,
+                                                                   v_sells,
+                                                                   0.8,
+                                                                   self.curr_lookahead)
+            self.walkForward.save_dataset(curr_pair, cache_key, {
+                'tsr_train': tsr_train, 'tsr_test': tsr_test,
+                'train_buys': train_buys, 'test_buys': test_buys,
+                'train_sells': train_sells, 'test_sells': test_sells
+            })
         else:
-            data_size = int(min(975, full_df_norm.shape[0]))
+            tsr_train, tsr_test = dataset['tsr_train'], dataset['tsr_test']
+            train_buys, test_buys = dataset['train_buys'], dataset['test_buys']
+            train_sells, test_sells = dataset['train_sells'], dataset['test_sells']
 
         # create classifiers, if necessary
-        num_features = full_df_norm.shape[1]
+        num_features = np.shape(tsr_train)[2]
         if self.buy_classifier is None:
             self.buy_classifier, _ = self.classifier_factory(self.classifier_name, num_features, tag=self.buy_tag)
         if self.sell_classifier is None:
@@ -572,27 +641,13 @@ class NNBC(IStrategy):
         # if self.dp.runmode.value not in ('backtest'):
         #     return
 
-        # get training dataset
-        # Note: this returns tensors, not dataframes
-
-        v_tensor, v_buys, v_sells = self.dataframeUtils.build_standard_dataset(data_size, full_df_norm, buys, sells,
-                                                                          self.curr_lookahead, self.seq_len)
-
-        tsr_train, tsr_test, train_buys, test_buys, \
-        train_sells, test_sells, = self.dataframeUtils.split_tensor(v_tensor,
-                                                               v_buys,
-                                                               v_sells,
-                                                               0.8,
-                                                               self.curr_lookahead)
-
         num_buys = int(train_buys[:, 0].sum())
         num_sells = int(train_sells[:, 0].sum())
 
         if self.dbg_verbose:
-            # print("     df_norm:", df_norm.shape, ' v_tensor:', v_tensor.shape)
-            print("     tensor:", v_tensor.shape, ' -> train:', tsr_train.shape, " + test:", tsr_test.shape)
-            print("     buys:", v_buys.shape, ' -> train:', train_buys.shape, " + test:", test_buys.shape)
-            print("     sells:", v_sells.shape, ' -> train:', train_sells.shape, " + test:", test_sells.shape)
+            print("     train:", tsr_train.shape, " + test:", tsr_test.shape)
+            print("     buys -> train:", train_buys.shape, " + test:", test_buys.shape)
+            print("     sells -> train:", train_sells.shape, " + test:", test_sells.shape)
 
         print("    #training samples:", len(tsr_train), " #buys:", num_buys, ' #sells:', num_sells)
 
@@ -650,6 +705,34 @@ class NNBC(IStrategy):
 
         return
 
+    # build the (normalised) dataset used for training
+    # Note: this returns tensors, not dataframes
+    def build_standard_data(self, dataframe: DataFrame, buys, sells):
+
+        remove_outliers = False
+        if remove_outliers:
+            # norm dataframe before splitting, otherwise variances are skewed
+            full_df_norm = self.dataframeUtils.norm_dataframe(dataframe)
+            full_df_norm, buys, sells = self.dataframeUtils.remove_outliers(full_df_norm, buys, sells)
+        else:
+            # full_df_norm = self.dataframeUtils.norm_dataframe(dataframe).clip(lower=-3.0, upper=3.0)  # supress outliers
+            full_df_norm = self.dataframeUtils.norm_dataframe(dataframe)
+
+        # compress data
+        if self.compress_data:
+            old_size = full_df_norm.shape[1]
+            full_df_norm = self.compress_dataframe(full_df_norm)
+            print("    Compressed data {} -> {} (features)".format(old_size, full_df_norm.shape[1]))
+
+        # constrain size to what will be available in run modes
+        if self.use_full_dataset:
+            data_size = int(0.9 * full_df_norm.shape[0])
+        else:
+            data_size = int(min(975, full_df_norm.shape[0]))
+
+        return self.dataframeUtils.build_standard_dataset(data_size, full_df_norm, buys, sells,
+                                                          self.curr_lookahead, self.seq_len)
+
     # get a classifier for the supplied normalised dataframe and known results
     def get_buy_classifier(self, tensor, results, test_tensor, test_labels):
 
@@ -778,6 +861,7 @@ class NNBC(IStrategy):
         # set the model name
         category, model_name = self.get_model_identifiers(self.curr_pair, clf_name, tag)
         clf.set_model_name(category, model_name)
+        clf.set_precision(self.precision)
 
         return clf, clf_name
 
@@ -888,6 +972,7 @@ class NNBC(IStrategy):
         return clf, best_classifier
 
     # make predictions for supplied dataframe (returns column)
+    @StageProfiler.profile('prediction')
     def predict(self, dataframe: DataFrame, pair, clf):
 
         # predict = 0
@@ -1001,6 +1086,7 @@ class NNBC(IStrategy):
     Buy Signal
     """
 
+    @StageProfiler.profile('entry')
     def populate_entry_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'enter_tag'] = ''
@@ -1060,6 +1146,7 @@ class NNBC(IStrategy):
     Sell Signal
     """
 
+    @StageProfiler.profile('exit')
     def populate_exit_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'exit_tag'] = ''
@@ -1115,10 +1202,11 @@ class NNBC(IStrategy):
 
         # self.set_state(pair, self.State.STOPLOSS)
 
-        dataframe, last_updated = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had_trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit < self.cstop_max_stoploss.value:
@@ -1145,11 +1233,13 @@ class NNBC(IStrategy):
     Custom Sell
     """
 
+    @StageProfiler.profile('custom_exit')
     def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0, trade.calc_profit_ratio(trade.max_rate))
@@ -1192,7 +1282,7 @@ class NNBC(IStrategy):
         # Don't sell if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful sell message later
-            self.custom_trade_info[trade.pair]['had_trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a sell, maybe
             if self.cexit_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -1206,12 +1296,12 @@ class NNBC(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had_trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had_trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_roi'
                 elif self.cexit_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had_trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_noroi'
             elif current_profit > min_roi:
                 return 'notrend_roi'
@@ -86,7 +86,6 @@ class NNBC_jump(NNBC):
     preload_model = True # don't set to true if you are changing buy/sell conditions or tweaking models
 
 
-    custom_trade_info = {}
 
     dbg_scan_classifiers = False  # if True, scan all viable classifiers and choose the best. Very slow!
     dbg_test_classifier = True  # test classifiers after fitting
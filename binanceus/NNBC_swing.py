@@ -66,7 +66,6 @@ class NNBC_swing(NNBC):
     n_loss_stddevs = 0.0
     min_f1_score = 0.51
 
-    custom_trade_info = {}
 
     dbg_scan_classifiers = False  # if True, scan all viable classifiers and choose the best. Very slow!
     dbg_test_classifier = True  # test clasifiers after fitting
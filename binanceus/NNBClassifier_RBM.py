@@ -46,15 +46,17 @@ import RBM
 class NNBClassifier_RBM(ClassifierKerasBinary):
     is_trained = False
     clean_data_required = True  # training data cannot contain anomalies
+    num_hidden = 64  # number of RBM hidden units
 
     # override the build_model function in subclasses
     def create_model(self, seq_len, num_features):
 
         model = keras.Sequential(name=self.name)
 
-        model.add(layers.GRU(64, return_sequences=True, input_shape=(seq_len, num_features)))
-
-        model.add(RBM.RBM())
+        # RBM encoding of each step (pre-trained on the training data, see train())
+        model.add(layers.Input(shape=(seq_len, num_features)))
+        model.add(RBM.RBMLayer(self.num_hidden, name='rbm'))
+        model.add(layers.GRU(64, return_sequences=True))
         model.add(layers.LSTM(64, return_sequences=True))
         model.add(layers.Dropout(0.2))
         
@@ -62,3 +64,29 @@ class NNBClassifier_RBM(ClassifierKerasBinary):
         model.add(layers.Dense(1, activation='sigmoid'))
 
         return model
+
+    # new models are created here (rather than in the base class), so that the RBM layer can be pre-trained
+    def train(self, df_train_norm, df_test_norm, train_results, test_results, force_train=False):
+
+        if self.model is None:
+            self.model = self.load()
+
+        if self.model is None:
+            self.model = self.create_model(self.seq_len, self.num_features)
+            self.model = self.compile_model(self.model)
+            self.model.summary()
+            self.pretrain_rbm(df_train_norm)
+
+        super().train(df_train_norm, df_test_norm, train_results, test_results, force_train)
+        return
+
+    # train the RBM layer (contrastive divergence) on the rows of the training data
+    def pretrain_rbm(self, df_train_norm):
+        if self.dataframeUtils.is_dataframe(df_train_norm):
+            rows = df_train_norm.to_numpy()
+        else:
+            rows = np.reshape(df_train_norm, (-1, np.shape(df_train_norm)[-1]))
+
+        print("    pre-training RBM layer...")
+        rbm = RBM.RBM(num_hidden=self.num_hidden).fit(rows)
+        self.model.get_layer('rbm').set_rbm(rbm)
@@ -42,6 +42,9 @@ log = logging.getLogger(__name__)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 import custom_indicators as cta
+import StageProfiler
+import TradeState
+import TrainingBackend
 from finta import TA as fta
 
 import keras
@@ -58,6 +61,8 @@ import Attention
 
 from DataframeUtils import DataframeUtils, ScalerType
 from DataframePopulator import DataframePopulator
+from FeatureStore import FeatureStore
+from RollingPredictor import RollingPredictor
 from NNPredictor_LSTM import NNPredictor_LSTM
 import Environment
 import profiler
@@ -147,7 +152,9 @@ class NNPredict(IStrategy):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'mfi', 'rmi_up_trend', 'ssl_dir', 'candle_up_trend']
+    trade_state = None
 
     num_pairs = 0
     # pair_model_info = {}  # holds model-related info for each pair
@@ -159,6 +166,7 @@ class NNPredict(IStrategy):
     num_epochs = 128  # max number of iterations for training
     batch_size = 1024  # batch size for training
     predict_batch_size = 512
+    rolling_window = 64  # number of rows used for each prediction by classifiers that return a single prediction
 
     classifier_list = {}  # classifier for each pair
     init_done = {}  # flags whether initialisation has been done for a pair or not
@@ -168,14 +176,26 @@ class NNPredict(IStrategy):
     refit_model = False  # set to True if you want to re-train the model. Usually better to just delete it and restart
     scaler_type = ScalerType.Robust  # scaler type used for normalisation
     # scaler_type = ScalerType.Standard  # scaler type used for normalisation
+    # dtype used for normalised data, tensors and models. Keras models compute in float32 anyway, so this just avoids
+    # creating (and casting) float64 copies. Set to np.float64 to restore the old behaviour
+    precision = np.float32
     model_per_pair = False  # set to True to create pair-specific models (better but only works for pairs in whitelist)
     training_only = False  # set to True to just generate models, no backtesting or prediction
+    # where models are trained: '' (in this process), 'local' (pool of worker processes) or 'ray'. Only used for
+    # pair-specific models in training_only mode: freqtrade populates the indicators of all pairs before any entry/exit
+    # signals, so the models for all pairs train at the same time, and are collected in populate_entry_trend().
+    # In other modes, the predictions for a pair are needed straight after training, so there would be no overlap
+    training_backend = ''
+    training_workers = 0  # number of worker processes for the 'local' backend. 0 means one per core
+    training_jobs = {}  # pair -> training job (future) that has not been collected yet
 
     # target_column = 'close'  # which column should be used for training and prediction
     target_column = 'mid'
 
     dataframeUtils = None
     dataframePopulator = None
+    featureStore = None
+    use_feature_store = True  # load/save populated indicators in a persistent store (see FeatureStore)
 
     # flags used for initialisation
     first_time = True  # mostly for debug
@@ -260,6 +280,7 @@ class NNPredict(IStrategy):
     Indicator Definitions
     """
 
+    @StageProfiler.profile('indicators')
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
         # Base pair inf timeframe indicators
@@ -287,6 +308,13 @@ class NNPredict(IStrategy):
             self.dataframePopulator.n_loss_stddevs = self.n_loss_stddevs
             self.dataframePopulator.n_profit_stddevs = self.n_profit_stddevs
 
+        # re-use indicators calculated by previous runs (rolling calculation modes only)
+        if self.featureStore is None:
+            self.featureStore = FeatureStore(self.config['exchange']['name'], self.timeframe,
+                                             version=self.dataframePopulator.get_feature_version())
+            self.featureStore.enabled = self.use_feature_store and \
+                                        (self.dp.runmode.value in ('hyperopt', 'backtest', 'plot'))
+
         if NNPredict.first_time:
             NNPredict.first_time = False
 
@@ -300,6 +328,10 @@ class NNPredict(IStrategy):
             print(f"    Lookahead: {self.curr_lookahead} candles ({self.lookahead_hours} hours)")
             print(f"    Re-train existing models: {self.refit_model}")
             print(f"    Training (only) mode: {self.training_only}")
+            if self.training_backend and not (self.model_per_pair and self.training_only):
+                # a shared model is trained cumulatively on each pair in turn, so cannot be trained in parallel
+                print("    WARN: training backend requires model_per_pair=True and training_only=True. "
+                      "Training in this process")
 
             # debug tracing
             if self.dbg_enable_tracing:
@@ -315,6 +347,7 @@ class NNPredict(IStrategy):
 
         # (re-)set the scaler
         self.dataframeUtils.set_scaler_type(self.scaler_type)
+        self.dataframeUtils.set_precision(self.precision)
 
         if self.dbg_verbose:
             print("    Adding technical indicators...")
@@ -342,6 +375,7 @@ class NNPredict(IStrategy):
             # if first time through, run backtest
             if self.curr_pair not in self.init_done:
                 self.init_done[self.curr_pair] = True
+                self.wait_for_training(self.curr_pair)  # backtest needs the newly trained model
                 print("    running backtest...")
                 dataframe = self.backtest_data(dataframe)
 
@@ -366,7 +400,8 @@ class NNPredict(IStrategy):
     def add_indicators(self, dataframe: DataFrame) -> DataFrame:
 
         # populate the standard indicators
-        dataframe = self.dataframePopulator.add_indicators(dataframe)
+        dataframe = self.featureStore.populate(self.curr_pair, dataframe, 'indicators',
+                                               self.dataframePopulator.add_indicators)
 
         # populate the training indicators
         dataframe = self.add_training_indicators(dataframe)
@@ -387,18 +422,18 @@ class NNPredict(IStrategy):
 
     def add_stoploss_indicators(self, dataframe: DataFrame, pair) -> DataFrame:
 
-        if not pair in self.custom_trade_info:
-            self.custom_trade_info[pair] = {}
-            if not 'had_trend' in self.custom_trade_info[pair]:
-                self.custom_trade_info[pair]['had_trend'] = False
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
 
         # Indicators used for ROI and Custom Stoploss
         dataframe = self.dataframePopulator.add_stoploss_indicators(dataframe)
+        self.trade_state.update(pair, dataframe)
         return dataframe
 
     ################################
 
     # prepare data and train the model
+    @StageProfiler.profile('training')
     def train_model(self, dataframe: DataFrame, pair) -> DataFrame:
 
         nfeatures = np.shape(dataframe)[1]
@@ -530,6 +565,12 @@ class NNPredict(IStrategy):
         print("")
         force_train = self.refit_model if (self.dp.runmode.value in ('backtest')) else False
         # print(f"self.refit_model:{self.refit_model} self.dp.runmode.value:{self.dp.runmode.value}")
+
+        # train in the background (collected when the model is needed). Existing models are just loaded, below
+        if self.use_training_backend() and (force_train or not self.classifier_list[self.curr_pair].model_exists()):
+            self.submit_training(pair, train_data, test_data, train_results, test_results, force_train, nfeatures)
+            return dataframe
+
         self.classifier_list[self.curr_pair].train(train_data, test_data,
                                                    train_results, test_results,
                                                    force_train)
@@ -776,13 +817,12 @@ class NNPredict(IStrategy):
         dataframe['predict'] = predictions
         return dataframe
 
-    # run prediction in rolling fashion (one result at a time -> slow) over the entire history
+    # run prediction in rolling fashion (one result per window) over the entire history
+    # Windows are built as views of the data and passed to the classifier in batches (see RollingPredictor)
     def add_model_rolling_predictions(self, dataframe: DataFrame) -> DataFrame:
 
         print("    Adding rolling predictions. Might take a while...")
 
-        # probably don't need to handle tensor cases since those classifiers typically do not return single values
-
         # get the current clasifier
         classifier = self.classifier_list[self.curr_pair]
         use_dataframes = classifier.needs_dataframes()
@@ -794,28 +834,14 @@ class NNPredict(IStrategy):
         else:
             df_norm = dataframe
 
-        if not use_dataframes:
-            df_tensor = self.dataframeUtils.df_to_tensor(df_norm, self.seq_len)
-
-        window = 64
-        start = window
-        end = np.shape(df_norm)[0]
-
-        preds_notrend: np.array = []
-
-        # set values for startup window
-        for index in range(0, start):
-            preds_notrend = np.concatenate((preds_notrend, [df_norm[self.target_column].iloc[index]]))
+        if use_dataframes:
+            data = df_norm
+        else:
+            data = self.dataframeUtils.df_to_tensor(df_norm, self.seq_len)
 
-        # add predictions
-        for i in tqdm(range(start, end), desc="    Predicting…", ascii=True, ncols=75):
-            # for index in range(start, end):
-            if use_dataframes:
-                chunk = df_norm.iloc[start:end]
-            else:
-                chunk = df_tensor[start:end]
-            preds = self.get_predictions(chunk)
-            preds_notrend = np.concatenate((preds_notrend, preds))
+        # startup window is filled with the (unpredicted) target values
+        engine = RollingPredictor(window=self.rolling_window, batch_size=self.predict_batch_size)
+        preds_notrend = engine.predict(classifier, data, fill_values=df_norm[self.target_column].to_numpy())
 
         # re-scale, if needed
         if prescale_data:
@@ -835,12 +861,18 @@ class NNPredict(IStrategy):
     ################################
 
     # add columns based on predictions. Do not call until after model has been trained
+    @StageProfiler.profile('prediction')
     def add_predictions(self, dataframe: DataFrame, pair) -> DataFrame:
 
         win_size = max(self.curr_lookahead, 14)
 
-        # dataframe = self.add_model_predictions(dataframe)
-        dataframe = self.update_predictions(dataframe)
+        if self.training_only and (pair in self.training_jobs):
+            # model is still being trained, and predictions are not used in training mode
+            dataframe['predict'] = dataframe[self.target_column]
+        else:
+            self.wait_for_training(pair)
+            # dataframe = self.add_model_predictions(dataframe)
+            dataframe = self.update_predictions(dataframe)
         dataframe['predict_smooth'] = dataframe['predict'].rolling(window=win_size).apply(self.roll_strong_smooth)
 
         dataframe['predict_diff'] = 100.0 * (dataframe['predict'] - dataframe[self.target_column]) / \
@@ -852,6 +884,30 @@ class NNPredict(IStrategy):
 
     #######################################
 
+    # returns True if models should be trained via a training backend (see training_backend)
+    def use_training_backend(self) -> bool:
+        return bool(self.training_backend) and self.model_per_pair and self.training_only
+
+    # submit a training job for the pair
+    def submit_training(self, pair, train_data, test_data, train_results, test_results, force_train, nfeatures):
+        backend = TrainingBackend.get_backend(self.training_backend, self.training_workers)
+        if backend is None:
+            self.training_backend = ''
+            self.classifier_list[pair].train(train_data, test_data, train_results, test_results, force_train)
+            return
+
+        job = TrainingBackend.make_job(self.classifier_list[pair], pair, self.seq_len, nfeatures, force_train)
+        self.training_jobs[pair] = backend.submit(job, train_data, test_data, train_results, test_results)
+        print(f"    training submitted ({self.training_backend})")
+
+    # wait for the training job for the pair (or all pairs, if pair is None), and load the trained model(s)
+    def wait_for_training(self, pair=None):
+        pairs = list(self.training_jobs.keys()) if pair is None else [pair]
+        for p in pairs:
+            future = self.training_jobs.pop(p, None)
+            if future is not None:
+                TrainingBackend.load_result(self.classifier_list[p], future.result())
+
     # returns the classifier model.
     def make_classifier(self, pair, seq_len: int, num_features: int):
         predictor = self.get_classifier(pair, seq_len, num_features)
@@ -859,6 +915,7 @@ class NNPredict(IStrategy):
         # set the model name parameters (the predictor cannot know what we want to call the model)
         category, model_name = self.get_model_identifiers(pair)
         predictor.set_model_name(category, model_name)
+        predictor.set_precision(self.precision)
         return predictor
 
     # returns the classifier model. Override this function to change the type of classifier
@@ -966,6 +1023,7 @@ class NNPredict(IStrategy):
     Buy Signal
     """
 
+    @StageProfiler.profile('entry')
     def populate_entry_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'enter_tag'] = ''
@@ -973,6 +1031,8 @@ class NNPredict(IStrategy):
 
         # if we are training a new model, just return (this helps avoid runtime errors)
         if self.training_only:
+            # all pairs have been submitted by now, so wait for the models to finish training
+            self.wait_for_training()
             return dataframe
 
         # conditions.append(dataframe['volume'] > 0)
@@ -1014,6 +1074,7 @@ class NNPredict(IStrategy):
     Sell Signal
     """
 
+    @StageProfiler.profile('exit')
     def populate_exit_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'exit_tag'] = ''
@@ -1056,10 +1117,11 @@ class NNPredict(IStrategy):
     def custom_stoploss(self, pair: str, trade: 'Trade', current_time: datetime, current_rate: float,
                         current_profit: float, **kwargs) -> float:
 
-        dataframe, last_updated = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had_trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit < self.cstop_max_stoploss.value:
@@ -1086,11 +1148,13 @@ class NNPredict(IStrategy):
     Custom Sell
     """
 
+    @StageProfiler.profile('custom_exit')
     def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0, trade.calc_profit_ratio(trade.max_rate))
@@ -1133,7 +1197,7 @@ class NNPredict(IStrategy):
         # Don't sell if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful sell message later
-            self.custom_trade_info[trade.pair]['had_trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a sell, maybe
             if self.cexit_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -1147,12 +1211,12 @@ class NNPredict(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had_trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had_trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_roi'
                 elif self.cexit_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had_trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_noroi'
             elif current_profit > min_roi:
                 return 'notrend_roi'
@@ -105,7 +105,6 @@ class NNPredict_CNN(NNPredict):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
 
     refit_model = False
 
@@ -104,7 +104,6 @@ class NNPredict_MLP(NNPredict):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
 
     refit_model = False
     training_only = False
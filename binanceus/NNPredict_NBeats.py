@@ -104,7 +104,6 @@ class NNPredict_NBeats(NNPredict):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
 
     refit_model = False # set to True if you want to re-train the model. Usually better to just delete it and restart
     training_only = True
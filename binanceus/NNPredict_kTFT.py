@@ -105,7 +105,6 @@ class NNPredict_kTFT(NNPredict):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
 
     requires_dataframes = True
 
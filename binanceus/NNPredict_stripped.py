@@ -110,7 +110,6 @@ class NNPredict_stripped(NNPredict):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
 
     refit_model = True
     training_only = False
@@ -44,8 +44,8 @@ from ClassifierDarts import ClassifierDarts
 from darts.models import NLinearModel
 
 import multiprocessing
-import ray
 from ray_lightning import RayStrategy
+import TrainingBackend
 
 #------------------------
 
@@ -58,7 +58,7 @@ class NNPredictor_Ray(ClassifierDarts):
 
     def __init__(self, pair, seq_len, num_features, tag="", use_gpu=True):
         super().__init__(pair, seq_len, num_features, tag, use_gpu)
-        ray.init()
+        TrainingBackend.init_ray()  # only initialised once per process
 
     # ------------------------
 
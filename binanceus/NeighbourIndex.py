@@ -0,0 +1,260 @@
+# Nearest neighbour index used by the neighbour-based anomaly detectors (LOF, DBSCAN)
+#
+# The index is built once per training window, and new rows (candles) can be appended without a rebuild. Scoring the
+# latest candle(s) is then just a k-NN query.
+# For low dimensional data, a KD tree is used. Appended rows are searched by brute force until they exceed
+# rebuild_ratio of the tree size, at which point the tree is rebuilt.
+# Trees do not help for high dimensional data (which is the usual case here), so a brute force search is used (via
+# sklearn's NearestNeighbors, which is cheap to re-create when rows are appended).
+#
+# Indexes are shared: get_index() returns the existing index for the same data (or extends an index whose rows are
+# the start of the data), so detectors using the same training window use the same index.
+# Indexes can be saved/loaded (joblib) next to the model files.
+# Shared indexes are never modified: extend() appends to a copy of an index that is in the cache.
+#
+# Usage:
+#    index = NeighbourIndex.get_index(data)
+#    dist, idx = index.query(rows, k)           # k nearest indexed rows
+#    dist, idx = index.query_self(k)            # k nearest rows of each indexed row (excluding itself)
+#    graph = index.radius_graph(radius)         # sparse distance graph (e.g. for DBSCAN(metric='precomputed'))
+#    index = NeighbourIndex.extend(index, rows) # add rows
+
+import copy
+import hashlib
+import os
+
+import numpy as np
+import joblib
+import scipy.sparse as sp
+from scipy.spatial.distance import cdist
+from sklearn.neighbors import KDTree, NearestNeighbors
+
+# fingerprint of data -> index
+index_cache = {}
+index_cache_size = 4
+
+
+class NeighbourIndex():
+    data = None  # buffer containing the indexed rows (only the first num_rows are valid)
+    num_rows = 0
+    tree = None  # tree containing the first tree_rows rows
+    tree_rows = 0
+    leaf_size = 40
+    rebuild_ratio = 0.25  # rebuild the tree when the appended rows exceed this fraction of the tree rows
+    algorithm = 'auto'  # 'kd_tree', 'brute' or 'auto' (kd_tree for up to max_tree_dims columns)
+    max_tree_dims = 15
+    chunk_size = 1024  # rows per chunk for brute force radius searches
+    brute = None  # NearestNeighbors, for brute force searches
+
+    graphs = {}  # radius -> (rows, cols, dists) of the radius graph, kept up to date as rows are appended
+
+    # ---------------------------
+
+    def __init__(self, data=None, leaf_size=40, algorithm='auto'):
+        super().__init__()
+        self.leaf_size = leaf_size
+        self.algorithm = algorithm
+        self.graphs = {}
+        if data is not None:
+            self.fit(data)
+
+    # (re-)build the index from the supplied rows
+    def fit(self, data):
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        self.data = data.copy()
+        self.num_rows = np.shape(data)[0]
+        self.graphs = {}
+        self.build_tree()
+        return self
+
+    def use_tree(self) -> bool:
+        if self.algorithm == 'auto':
+            return np.shape(self.data)[1] <= self.max_tree_dims
+        return self.algorithm == 'kd_tree'
+
+    def build_tree(self):
+        self.tree_rows = self.num_rows
+        if self.use_tree():
+            self.tree = KDTree(self.data[:self.num_rows], leaf_size=self.leaf_size)
+        else:
+            self.tree = None
+            self.brute = NearestNeighbors(algorithm='brute').fit(self.data[:self.num_rows])
+
+    def get_data(self):
+        return self.data[:self.num_rows]
+
+    # returns True if the indexed rows are the start of the supplied data
+    def extends(self, data) -> bool:
+        if (self.num_rows == 0) or (np.shape(data)[0] < self.num_rows) or (np.shape(data)[1] != np.shape(self.data)[1]):
+            return False
+        return np.array_equal(data[:self.num_rows], self.get_data())
+
+    # add rows to the index
+    def append(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=np.float64)
+        num_new = np.shape(rows)[0]
+        if num_new == 0:
+            return
+
+        # grow the buffer (doubling, so appends are amortised O(1))
+        start = self.num_rows
+        if start + num_new > np.shape(self.data)[0]:
+            buffer = np.empty((max(2 * np.shape(self.data)[0], start + num_new), np.shape(self.data)[1]))
+            buffer[:start] = self.data[:start]
+            self.data = buffer
+        self.data[start:start + num_new] = rows
+        self.num_rows = start + num_new
+
+        if self.tree is None:
+            self.build_tree()
+
+        for radius in self.graphs.keys():
+            self.update_graph(radius, start)
+
+        if (self.num_rows - self.tree_rows) > self.rebuild_ratio * self.tree_rows:
+            self.build_tree()
+
+    # returns the distances and indices of the k nearest indexed rows for each row in X (sorted by distance)
+    def query(self, X, k):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        k = min(k, self.num_rows)
+        if self.tree is None:
+            return self.brute.kneighbors(X, n_neighbors=k)
+
+        dist, idx = self.tree.query(X, k=min(k, self.tree_rows))
+
+        if self.num_rows > self.tree_rows:
+            # brute force search of the rows appended since the tree was built
+            tail = self.data[self.tree_rows:self.num_rows]
+            tail_dist = cdist(X, tail)
+            tail_idx = np.broadcast_to(np.arange(self.tree_rows, self.num_rows), tail_dist.shape)
+
+            dist = np.concatenate([dist, tail_dist], axis=1)
+            idx = np.concatenate([idx, tail_idx], axis=1)
+            order = np.argsort(dist, axis=1, kind='stable')[:, :k]
+            dist = np.take_along_axis(dist, order, axis=1)
+            idx = np.take_along_axis(idx, order, axis=1)
+
+        return dist, idx
+
+    # returns the k nearest neighbours of the indexed rows (from row 'start'), excluding the row itself
+    def query_self(self, k, start=0):
+        k = min(k, self.num_rows - 1)
+        dist, idx = self.query(self.data[start:self.num_rows], k + 1)
+
+        # remove the row itself. With duplicate rows, it may not be in the result, so remove the furthest instead
+        own = (idx == np.arange(start, self.num_rows)[:, None])
+        missing = ~own.any(axis=1)
+        own[missing, -1] = True
+        keep = ~own
+        return dist[keep].reshape(-1, k), idx[keep].reshape(-1, k)
+
+    # ---------------------------
+
+    # returns the rows within 'radius' of each row in X, as (row, index, distance) arrays
+    def query_radius(self, X, radius):
+        X = np.ascontiguousarray(X, dtype=np.float64)
+        if self.tree is None:
+            return self.query_radius_brute(X, radius)
+
+        ind, dist = self.tree.query_radius(X, r=radius, return_distance=True)
+        counts = np.array([len(i) for i in ind])
+        rows = np.repeat(np.arange(np.shape(X)[0]), counts)
+        cols = np.concatenate(ind) if len(ind) > 0 else np.zeros(0, dtype=np.intp)
+        dists = np.concatenate(dist) if len(dist) > 0 else np.zeros(0)
+
+        if self.num_rows > self.tree_rows:
+            tail = self.data[self.tree_rows:self.num_rows]
+            tail_dist = cdist(X, tail)
+            r, c = np.nonzero(tail_dist <= radius)
+            rows = np.concatenate([rows, r])
+            cols = np.concatenate([cols, c + self.tree_rows])
+            dists = np.concatenate([dists, tail_dist[r, c]])
+
+        return rows, cols, dists
+
+    # (exact distances, since radius may be very small)
+    def query_radius_brute(self, X, radius):
+        data = self.get_data()
+        rows, cols, dists = [np.zeros(0, dtype=np.intp)], [np.zeros(0, dtype=np.intp)], [np.zeros(0)]
+        for start in range(0, np.shape(X)[0], self.chunk_size):
+            d = cdist(X[start:start + self.chunk_size], data)
+            r, c = np.nonzero(d <= radius)
+            rows.append(r + start)
+            cols.append(c)
+            dists.append(d[r, c])
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(dists)
+
+    # add the edges for the rows from 'start' to the radius graph (both directions)
+    def update_graph(self, radius, start):
+        rows, cols, dists = self.query_radius(self.data[start:self.num_rows], radius)
+        rows = rows + start
+
+        # drop self edges, and add the reverse of edges to existing rows (edges between new rows are found twice)
+        keep = rows != cols
+        rows, cols, dists = rows[keep], cols[keep], dists[keep]
+        old = cols < start
+
+        g_rows, g_cols, g_dists = self.graphs.get(radius, (np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp),
+                                                           np.zeros(0)))
+        self.graphs[radius] = (np.concatenate([g_rows, rows, cols[old]]),
+                               np.concatenate([g_cols, cols, rows[old]]),
+                               np.concatenate([g_dists, dists, dists[old]]))
+
+    # returns the (sparse) graph of the distances between indexed rows that are within 'radius' of each other
+    def radius_graph(self, radius):
+        if radius not in self.graphs:
+            self.update_graph(radius, 0)
+        rows, cols, dists = self.graphs[radius]
+        return sp.csr_matrix((dists, (rows, cols)), shape=(self.num_rows, self.num_rows))
+
+    # ---------------------------
+
+    def save(self, path):
+        save_dir = os.path.dirname(path)
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path):
+        if not os.path.exists(path):
+            return None
+        return joblib.load(path)
+
+
+# ---------------------------
+
+def get_fingerprint(data) -> str:
+    h = hashlib.sha1()
+    h.update(f"{data.shape}".encode())
+    h.update(data.tobytes())
+    return h.hexdigest()
+
+
+# returns an index for the supplied data. If 'index' contains the start of the data, it is extended with the new rows,
+# otherwise an existing index for the same data is used (or a new one is built)
+def get_index(data, index=None) -> NeighbourIndex:
+    data = np.ascontiguousarray(data, dtype=np.float64)
+
+    if (index is not None) and index.extends(data):
+        return extend(index, data[index.num_rows:])
+
+    key = get_fingerprint(data)
+    index = index_cache.get(key, None)
+    if (index is None) or (index.num_rows != np.shape(data)[0]):
+        index = NeighbourIndex(data)
+        if len(index_cache) >= index_cache_size:
+            index_cache.pop(next(iter(index_cache)))
+        index_cache[key] = index
+    return index
+
+
+# append rows to an index. Indexes in the cache may be used by other models, so a copy is extended instead
+def extend(index, rows) -> NeighbourIndex:
+    if np.shape(rows)[0] == 0:
+        return index
+    if any(cached is index for cached in index_cache.values()):
+        index = copy.deepcopy(index)
+    index.append(rows)
+    return index
@@ -41,6 +41,8 @@ log = logging.getLogger(__name__)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 import custom_indicators as cta
+import StageProfiler
+import TradeState
 from finta import TA as fta
 
 from sklearn.model_selection import RandomizedSearchCV, train_test_split
@@ -49,7 +51,6 @@ from sklearn.metrics import ConfusionMatrixDisplay
 from sklearn.preprocessing import StandardScaler, RobustScaler, MinMaxScaler
 import sklearn.decomposition as skd
 from sklearn.svm import SVC, SVR
-from sklearn.utils.fixes import loguniform
 from sklearn import preprocessing
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.model_selection import GridSearchCV
@@ -85,6 +86,9 @@ from RBMEncoder import RBMEncoder
 
 from DataframeUtils import DataframeUtils, ScalerType
 from DataframePopulator import DataframePopulator
+from FeatureStore import FeatureStore
+from WalkForward import WalkForward
+from PairPrecompute import PairPrecompute
 
 """
 ####################################################################################
@@ -204,7 +208,9 @@ class PCA(IStrategy):
     curr_lookahead = int(12 * lookahead_hours)
 
     curr_pair = ""
-    custom_trade_info = {}
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'mfi', 'rmi_up_trend', 'ssl_dir', 'candle_up_trend']
+    trade_state = None
 
     num_pairs = 0
     pair_model_info = {}  # holds model-related info for each pair
@@ -218,6 +224,13 @@ class PCA(IStrategy):
 
     dataframeUtils = None
     dataframePopulator = None
+    featureStore = None
+    use_feature_store = True  # load/save populated indicators in a persistent store (see FeatureStore)
+    walkForward = None
+    retrain_interval = 32  # number of candles between re-training of the models (see WalkForward)
+    pairPrecompute = None
+    parallel_precompute = True  # pre-compute all pairs in parallel (backtest only, see PairPrecompute)
+    precompute_workers = 0  # number of processes used for pre-computation. 0 means use all CPUs
 
     dbg_scan_classifiers = False  # if True, scan all viable classifiers and choose the best. Very slow!
     dbg_test_classifier = True  # test clasifiers after fitting
@@ -331,10 +344,25 @@ class PCA(IStrategy):
 
     ###################################
 
+    # called by freqtrade after the strategy has been loaded (and dp is available)
+    def bot_start(self, **kwargs) -> None:
+        if self.parallel_precompute:
+            self.run_precompute()
+
+    # runs populate_indicators() for all pairs in parallel worker processes (backtest only, first call only)
+    def run_precompute(self):
+        if self.pairPrecompute is None:
+            self.pairPrecompute = PairPrecompute(max_workers=self.precompute_workers)
+        if self.pairPrecompute.is_enabled(self):
+            self.pairPrecompute.run(self)
+
+    ###################################
+
     """
     Indicator Definitions
     """
 
+    @StageProfiler.profile('indicators')
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
         # Base pair inf timeframe indicators
@@ -348,6 +376,12 @@ class PCA(IStrategy):
         if self.dataframeUtils is None:
             self.dataframeUtils = DataframeUtils()
 
+        if self.walkForward is None:
+            # datasets can only be re-used if the same data is processed again, so only cache them in backtests
+            self.walkForward = WalkForward(self.__class__.__name__, retrain_interval=self.retrain_interval,
+                                           timeframe_mins=self.data_mins,
+                                           use_cache=(self.dp.runmode.value in ('backtest', 'hyperopt')))
+
         if self.dataframePopulator is None:
             self.dataframePopulator = DataframePopulator()
 
@@ -357,6 +391,13 @@ class PCA(IStrategy):
             self.dataframePopulator.n_loss_stddevs = self.n_loss_stddevs
             self.dataframePopulator.n_profit_stddevs = self.n_profit_stddevs
 
+        # re-use indicators calculated by previous runs (rolling calculation modes only)
+        if self.featureStore is None:
+            self.featureStore = FeatureStore(self.config['exchange']['name'], self.timeframe,
+                                             version=self.dataframePopulator.get_feature_version())
+            self.featureStore.enabled = self.use_feature_store and \
+                                        (self.dp.runmode.value in ('hyperopt', 'backtest', 'plot'))
+
         if self.first_time:
             self.first_time = False
             print("")
@@ -371,10 +412,17 @@ class PCA(IStrategy):
         print("")
         print(curr_pair)
 
+        # in backtest mode, run populate_indicators() for all pairs in parallel (on the first call), then just use
+        # the results
+        if self.parallel_precompute:
+            self.run_precompute()
+            cached = self.pairPrecompute.get(curr_pair, dataframe)
+            if cached is not None:
+                return self.add_stoploss_indicators(cached, curr_pair)
+
         # if first time through for this pair, add entry to pair_model_info
         if not (curr_pair in self.pair_model_info):
             self.pair_model_info[curr_pair] = {
-                'interval': 0,
                 'pca_size': 0,
                 'pca': None,
                 'clf_buy_name': "",
@@ -382,16 +430,14 @@ class PCA(IStrategy):
                 'clf_sell_name': "",
                 'clf_sell': None
             }
-        else:
-            # decrement interval. When this reaches 0 it will trigger re-fitting of the data
-            self.pair_model_info[curr_pair]['interval'] = self.pair_model_info[curr_pair]['interval'] - 1
 
         # (re-)set the scaler
         self.dataframeUtils.set_scaler_type(self.scaler_type)
 
         # populate the normal dataframe
         # dataframe = self.add_indicators(dataframe)
-        dataframe = self.dataframePopulator.add_indicators(dataframe)
+        dataframe = self.featureStore.populate(self.curr_pair, dataframe, 'indicators',
+                                               self.dataframePopulator.add_indicators)
 
         buys, sells = self.create_training_data(dataframe)
 
@@ -428,12 +474,11 @@ class PCA(IStrategy):
 
     # add indicators used by stoploss/custom sell logic
     def add_stoploss_indicators(self, dataframe, pair) -> DataFrame:
-        if not pair in self.custom_trade_info:
-            self.custom_trade_info[pair] = {}
-            if not 'had_trend' in self.custom_trade_info[pair]:
-                self.custom_trade_info[pair]['had_trend'] = False
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
 
         dataframe = self.dataframePopulator.add_stoploss_indicators(dataframe)
+        self.trade_state.update(pair, dataframe)
 
         return dataframe
 
@@ -442,7 +487,8 @@ class PCA(IStrategy):
     # creates the buy/sell labels absed on looking ahead into the supplied dataframe
     def create_training_data(self, dataframe: DataFrame):
 
-        future_df = self.dataframePopulator.add_hidden_indicators(dataframe.copy())
+        future_df = self.featureStore.populate(self.curr_pair, dataframe.copy(), 'hidden',
+                                               self.dataframePopulator.add_hidden_indicators)
         future_df = self.dataframePopulator.add_future_data(future_df, self.curr_lookahead)
 
         future_df['train_buy'] = 0.0
@@ -501,17 +547,12 @@ class PCA(IStrategy):
 
     # train the PCA reduction and classification models
 
+    @StageProfiler.profile('training')
     def train_models(self, curr_pair, dataframe: DataFrame, buys, sells):
 
-        # only run if interval reaches 0 (no point retraining every camdle)
-        count = self.pair_model_info[curr_pair]['interval']
-        if (count > 0):
-            self.pair_model_info[curr_pair]['interval'] = count - 1
+        # only run when the data moves into a new retraining fold (no point retraining every candle). See WalkForward
+        if not self.walkForward.should_retrain(curr_pair, dataframe):
             return
-        else:
-            # reset interval to a random number between 1 and the amount of lookahead
-            # self.pair_model_info[curr_pair]['interval'] = random.randint(1, self.curr_lookahead)
-            self.pair_model_info[curr_pair]['interval'] = random.randint(2, max(32, self.curr_lookahead))
 
         # Reset models for this pair. Makes it safe to just return on error
         self.pair_model_info[curr_pair]['pca_size'] = 0
@@ -531,33 +572,26 @@ class PCA(IStrategy):
             print("*** ERR: insufficient sells in expected results. Check training data")
             return
 
-        rand_st = 27  # use fixed number for reproducibility
-
-        remove_outliers = False
-        if remove_outliers:
-            # norm dataframe before splitting, otherwise variances are skewed
-            full_df_norm = self.dataframeUtils.norm_dataframe(dataframe)
-            full_df_norm, buys, sells = self.dataframeUtils.remove_outliers(full_df_norm, buys, sells)
+        # re-use the train/test datasets for this fold if they have already been built
+        fold_id = self.walkForward.get_fold_id(dataframe)
+        cache_key = self.walkForward.get_cache_key(curr_pair, fold_id, dataframe, buys, sells,
+                                                   config=str(self.scaler_type))
+        dataset = self.walkForward.load_dataset(curr_pair, cache_key)
+        if dataset is None:
+            df_train, df_test, train_buys, test_buys, train_sells, test_sells = self.build_train_test_data(dataframe,
+                                                                                                          buys, sells)
+            self.walkForward.save_dataset(curr_pair, cache_key, {
+                'df_train': df_train, 'df_test': df_test,
+                'train_buys': train_buys, 'test_buys': test_buys,
+                'train_sells': train_sells, 'test_sells': test_sells
+            })
         else:
-            full_df_norm = self.dataframeUtils.norm_dataframe(dataframe).clip(lower=-3.0, upper=3.0)  # supress outliers
-
-        # constrain size to what will be available in run modes
-        data_size = int(min(975, full_df_norm.shape[0]))
-
-        # get 'viable' data set (includes all buys/sells)
-        v_df_norm, v_buys, v_sells = self.dataframeUtils.build_viable_dataset(data_size, full_df_norm, buys, sells)
+            df_train, df_test = dataset['df_train'], dataset['df_test']
+            train_buys, test_buys = dataset['train_buys'], dataset['test_buys']
+            train_sells, test_sells = dataset['train_sells'], dataset['test_sells']
 
-        train_size = int(0.8 * data_size)
-        test_size = data_size - train_size
-
-        df_train, df_test, train_buys, test_buys, train_sells, test_sells, = train_test_split(v_df_norm,
-                                                                                              v_buys,
-                                                                                              v_sells,
-                                                                                              train_size=train_size,
-                                                                                              random_state=rand_st,
-                                                                                              shuffle=True)
         if self.dbg_verbose:
-            print("     dataframe:", v_df_norm.shape, ' -> train:', df_train.shape, " + test:", df_test.shape)
+            print("     train:", df_train.shape, " + test:", df_test.shape)
             print("     buys:", buys.shape, ' -> train:', train_buys.shape, " + test:", test_buys.shape)
             print("     sells:", sells.shape, ' -> train:', train_sells.shape, " + test:", test_sells.shape)
 
@@ -637,6 +671,30 @@ class PCA(IStrategy):
                 print(classification_report(test_sell_labels, pred_sells))
                 print("")
 
+    # build the (normalised) train/test datasets used for fitting the PCA and classification models
+    def build_train_test_data(self, dataframe: DataFrame, buys, sells):
+
+        rand_st = 27  # use fixed number for reproducibility
+
+        # norm dataframe before splitting, otherwise variances are skewed
+        full_df_norm = self.dataframeUtils.norm_dataframe(dataframe)
+
+        remove_outliers = False
+        if remove_outliers:
+            full_df_norm, buys, sells = self.dataframeUtils.remove_outliers(full_df_norm, buys, sells)
+
+        # constrain size to what will be available in run modes
+        data_size = int(min(975, full_df_norm.shape[0]))
+
+        # get 'viable' data set (includes all buys/sells)
+        v_df_norm, v_buys, v_sells = self.dataframeUtils.build_viable_dataset(data_size, full_df_norm, buys, sells)
+        if not remove_outliers:
+            v_df_norm = v_df_norm.clip(lower=-3.0, upper=3.0)  # supress outliers (only in the selected rows)
+
+        train_size = int(0.8 * data_size)
+
+        return train_test_split(v_df_norm, v_buys, v_sells, train_size=train_size, random_state=rand_st, shuffle=True)
+
     autoencoder = None
 
     # get the PCA model for the supplied dataframe (dataframe must be normalised)
@@ -739,7 +797,7 @@ class PCA(IStrategy):
         elif pca_type == 5:
             # Restricted Boltzmann Machine
             print("    Using Restricted Boltzmann Machine..")
-            pca = RBMEncoder()
+            pca = RBMEncoder().fit(df_norm)
 
 
         else:
@@ -1052,6 +1110,7 @@ class PCA(IStrategy):
         return clf, best_classifier
 
     # make predictions for supplied dataframe (returns column)
+    @StageProfiler.profile('prediction')
     def predict(self, dataframe: DataFrame, pair, clf):
 
         # predict = 0
@@ -1076,7 +1135,7 @@ class PCA(IStrategy):
 
         if clf is None:
             print("    No Buy Classifier for pair ", pair, " -Skipping predictions")
-            self.pair_model_info[pair]['interval'] = min(self.pair_model_info[pair]['interval'], 4)
+            self.walkForward.request_retrain(pair)
             predict = df['close'].copy()  # just to get the size
             predict = 0.0
             return predict
@@ -1108,7 +1167,7 @@ class PCA(IStrategy):
         clf = self.pair_model_info[pair]['clf_sell']
         if clf is None:
             print("    No Sell Classifier for pair ", pair, " -Skipping predictions")
-            self.pair_model_info[pair]['interval'] = min(self.pair_model_info[pair]['interval'], 4)
+            self.walkForward.request_retrain(pair)
             predict = df['close']  # just to get the size
             predict = 0.0
             return predict
@@ -1224,6 +1283,7 @@ class PCA(IStrategy):
     Buy Signal
     """
 
+    @StageProfiler.profile('entry')
     def populate_entry_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'enter_tag'] = ''
@@ -1278,6 +1338,7 @@ class PCA(IStrategy):
     Sell Signal
     """
 
+    @StageProfiler.profile('exit')
     def populate_exit_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'exit_tag'] = ''
@@ -1331,10 +1392,11 @@ class PCA(IStrategy):
 
         # self.set_state(pair, self.State.STOPLOSS)
 
-        dataframe, last_updated = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had_trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit < self.cstop_max_stoploss.value:
@@ -1361,11 +1423,13 @@ class PCA(IStrategy):
     Custom Sell
     """
 
+    @StageProfiler.profile('custom_exit')
     def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0, trade.calc_profit_ratio(trade.max_rate))
@@ -1408,7 +1472,7 @@ class PCA(IStrategy):
         # Don't sell if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful sell message later
-            self.custom_trade_info[trade.pair]['had_trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a sell, maybe
             if self.cexit_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -1422,12 +1486,12 @@ class PCA(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had_trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had_trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_roi'
                 elif self.cexit_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had_trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_noroi'
             elif current_profit > min_roi:
                 return 'notrend_roi'
@@ -68,7 +68,6 @@ class PCA_minmax(PCA):
     n_loss_stddevs = 2.0
     min_f1_score = 0.70
 
-    custom_trade_info = {}
 
     dbg_scan_classifiers = False  # if True, scan all viable classifiers and choose the best. Very slow!
     dbg_test_classifier = False  # test classifiers after fitting
@@ -65,7 +65,6 @@ class PCA_nseq2(PCA):
     n_loss_stddevs = 0.0
     min_f1_score = 0.60
 
-    custom_trade_info = {}
 
     dbg_scan_classifiers = True  # if True, scan all viable classifiers and choose the best. Very slow!
     dbg_test_classifier = True  # test clasifiers after fitting
@@ -0,0 +1,183 @@
+# Parallel (per-pair) pre-computation of populate_indicators() for the ML strategies (PCA, NNBC, Anomaly etc.)
+#
+# Freqtrade calls populate_indicators() one pair at a time, and for these strategies each call adds the indicators,
+# generates the training labels, trains the models and runs the predictions. In backtest mode that means a single
+# core does all the work, while the others sit idle.
+# This class runs the whole populate_indicators() pipeline for every pair up front, in a pool of worker processes, and
+# caches the resulting dataframes. The regular per-pair calls then just return the cached results.
+#
+# Each worker creates its own instance of the strategy (same class, config and parameter values), so nothing in the
+# strategy needs to be picklable. Cache entries are keyed by the date range and length of the dataframe, so if the
+# dataframe passed to populate_indicators() does not match what was pre-computed, the normal path is used instead.
+#
+# Usage (in a strategy):
+#    pairPrecompute = PairPrecompute()
+#
+#    def populate_indicators(self, dataframe, metadata):
+#        if self.parallel_precompute and self.pairPrecompute.is_enabled(self):
+#            self.pairPrecompute.run(self)
+#            cached = self.pairPrecompute.get(metadata['pair'], dataframe)
+#            if cached is not None:
+#                return cached
+#        ... normal processing ...
+
+import importlib.util
+import inspect
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pandas import DataFrame
+
+# Strategy specific imports, files must reside in same folder as strategy
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+# minimal stand-in for the freqtrade DataProvider inside worker processes. The strategies only use the run mode
+# during populate_indicators()
+class WorkerDataProvider():
+    runmode = None
+
+    def __init__(self, runmode):
+        self.runmode = runmode
+
+
+# worker function: create an instance of the strategy and run populate_indicators() for a single pair.
+# Must be module level so that it can be pickled
+def populate_pair(module_name, module_path, class_name, config, params, runmode, pair, dataframe: DataFrame):
+
+    module_dir = os.path.dirname(module_path)
+    if module_dir not in sys.path:
+        sys.path.insert(0, module_dir)
+
+    if module_name in sys.modules:
+        module = sys.modules[module_name]
+    else:
+        spec = importlib.util.spec_from_file_location(module_name, module_path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+
+    strategy = getattr(module, class_name)(config)
+    strategy.dp = WorkerDataProvider(runmode)
+    strategy.parallel_precompute = False  # no nested pre-computation
+
+    # use the same (hyperopt) parameter values as the main process
+    for name, value in params.items():
+        param = getattr(strategy, name, None)
+        if param is not None:
+            param.value = value
+
+    return strategy.populate_indicators(dataframe, {'pair': pair})
+
+
+class PairPrecompute():
+
+    max_workers = 0  # number of worker processes. 0 means use all CPUs
+    runmodes = ('backtest',)  # run modes in which pre-computation is used
+
+    # ---------------------------
+
+    def __init__(self, max_workers=0):
+        super().__init__()
+
+        self.max_workers = max_workers
+        self.done = False
+        self.cache = {}  # {pair: (key, dataframe)}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # ---------------------------
+
+    # returns True if pre-computation should be used for the supplied strategy
+    def is_enabled(self, strategy) -> bool:
+        return (strategy.dp is not None) and (strategy.dp.runmode.value in self.runmodes)
+
+    # returns the key used to check that a cached entry matches the dataframe being processed
+    def get_key(self, dataframe: DataFrame):
+        if 'date' not in dataframe.columns or len(dataframe) == 0:
+            return (len(dataframe),)
+        return (len(dataframe), str(dataframe['date'].iloc[0]), str(dataframe['date'].iloc[-1]))
+
+    # returns the names/values of the strategy's (hyperopt) parameters
+    def get_params(self, strategy) -> dict:
+        params = {}
+        if hasattr(strategy, 'enumerate_parameters'):
+            for name, param in strategy.enumerate_parameters():
+                params[name] = param.value
+        return params
+
+    # ---------------------------
+
+    # run populate_indicators() for all pairs in the whitelist, in parallel. Only runs once per strategy instance
+    def run(self, strategy, pairs=None):
+        if self.done:
+            return
+        self.done = True
+
+        if pairs is None:
+            pairs = strategy.dp.current_whitelist()
+
+        tasks = {}
+        for pair in pairs:
+            dataframe = strategy.dp.get_pair_dataframe(pair=pair, timeframe=strategy.timeframe)
+            if (dataframe is not None) and (len(dataframe) > 0):
+                tasks[pair] = dataframe
+
+        if len(tasks) < 2:
+            return  # nothing to gain
+
+        cls = strategy.__class__
+        module_name = cls.__module__
+        module_path = inspect.getfile(cls)
+        params = self.get_params(strategy)
+        runmode = strategy.dp.runmode
+
+        max_workers = self.max_workers if self.max_workers > 0 else multiprocessing.cpu_count()
+        max_workers = min(max_workers, len(tasks))
+
+        print("")
+        print(f"    Pre-computing indicators for {len(tasks)} pairs ({max_workers} processes)...")
+        start = time.perf_counter()
+
+        # 'spawn' because tensorflow/pytorch do not work reliably in forked processes
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx) as executor:
+            futures = {}
+            for pair, dataframe in tasks.items():
+                future = executor.submit(populate_pair, module_name, module_path, cls.__name__, strategy.config,
+                                         params, runmode, pair, dataframe)
+                futures[future] = (pair, self.get_key(dataframe))
+
+            for future in as_completed(futures):
+                pair, key = futures[future]
+                try:
+                    self.cache[pair] = (key, future.result())
+                except Exception as e:
+                    print(f"    ERR: pre-computation failed for {pair}: {e}")
+
+        print(f"    Pre-computed {len(self.cache)}/{len(tasks)} pairs in {time.perf_counter() - start:.1f} secs")
+
+    # ---------------------------
+
+    # returns the pre-computed dataframe for the pair (and removes it from the cache), or None if there is no
+    # matching entry
+    def get(self, pair, dataframe: DataFrame):
+        entry = self.cache.pop(pair, None)
+        if (entry is None) or (entry[0] != self.get_key(dataframe)):
+            self.cache_misses += 1
+            return None
+
+        self.cache_hits += 1
+        return entry[1]
+
+    def print_cache_stats(self):
+        print(f"    Pre-compute cache - hits:{self.cache_hits} misses:{self.cache_misses}")
@@ -1,69 +1,205 @@
-import tensorflow as tf
+# Restricted Boltzmann Machine (Bernoulli visible and hidden units)
+#
+# The RBM is trained with mini-batch contrastive divergence (CD-k) in numpy: each step is a handful of matrix
+# products over a whole batch, and the weights persist between calls to fit() (so training can be continued, e.g.
+# with the data for another pair). transform() is a single matrix product (hidden unit probabilities).
+# Inputs are scaled into [0, 1] (using the range seen by the first fit), since the visible units are binary.
+#
+# RBMLayer applies a (pre-trained) RBM inside a keras model. The RBM weights are stored as layer weights, so they are
+# saved and loaded with the rest of the model (see ModelCache), and are fine-tuned when the model is trained.
+#
+# Usage:
+#    rbm = RBM.RBM(num_hidden=64).fit(data)
+#    features = rbm.transform(data)
+#    rbm.save(path)
+#    rbm = RBM.load(path)
+#
+#    layer = RBM.RBMLayer(64)
+#    ... (build model) ...
+#    layer.set_rbm(rbm)
+
+import os
+
 import numpy as np
 
-# Restricted Boltzmann Machine
+import tensorflow as tf
+import keras
+from keras import layers
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
 
 class RBM():
-    def __init__(self, nv=28 * 28, nh=512, cd_steps=3):
-        tf.random.set_seed(42)
-        self.graph = tf.Graph()
-        with self.graph.as_default():
-            tf.random.set_seed(42)
-            self.W = tf.Variable(tf.compat.v1.truncated_normal((nv, nh)) * 0.01)
-            self.bv = tf.Variable(tf.zeros((nv, 1)))
-            self.bh = tf.Variable(tf.zeros((nh, 1)))
-
-            self.cd_steps = cd_steps
-            self.modelW = None
-
-    def bernoulli(self, p):
-        return tf.nn.relu(tf.sign(p - tf.compat.v1.random_uniform(p.shape)))
-
-    def energy(self, v):
-        b_term = tf.matmul(v, self.bv)
-        linear_tranform = tf.matmul(v, self.W) + tf.squeeze(self.bh)
-        h_term = tf.reduce_sum(tf.compat.v1.log(tf.exp(linear_tranform) + 1), axis=1)
-        return tf.reduce_mean(-h_term - b_term)
-
-    def sample_h(self, v):
-        ph_given_v = tf.sigmoid(tf.matmul(v, self.W) + tf.squeeze(self.bh))
-        return self.bernoulli(ph_given_v)
-
-    def sample_v(self, h):
-        pv_given_h = tf.sigmoid(tf.matmul(h, tf.transpose(self.W)) + tf.squeeze(self.bv))
-        return self.bernoulli(pv_given_h)
-
-    def gibbs_step(self, i, k, vk):
-        hk = self.sample_h(vk)
-        vk = self.sample_v(hk)
-        return i + 1, k, vk
-
-    def train(self, X, lr=0.01, batch_size=64, epochs=5):
-        with self.graph.as_default():
-            tf_v = tf.compat.v1.placeholder(tf.float32, [batch_size, self.bv.shape[0]])
-            v = tf.round(tf_v)
-            vk = tf.identity(v)
-
-            i = tf.constant(0)
-            _, _, vk = tf.while_loop(cond=lambda i, k, *args: i <= k,
-                                     body=self.gibbs_step,
-                                     loop_vars=[i, tf.constant(self.cd_steps), vk],
-                                     parallel_iterations=1,
-                                     back_prop=False)
-
-            vk = tf.stop_gradient(vk)
-            loss = self.energy(v) - self.energy(vk)
-            optimizer = tf.compat.v1.train.AdamOptimizer(lr).minimize(loss)
-            init = tf.compat.v1.global_variables_initializer()
-
-        with tf.compat.v1.Session(graph=self.graph) as sess:
-            init.run()
-            for epoch in range(epochs):
-                losses = []
-                for i in range(0, len(X) - batch_size, batch_size):
-                    x_batch = X[i:i + batch_size]
-                    l, _ = sess.run([loss, optimizer], feed_dict={tf_v: x_batch})
-                    losses.append(l)
-                print('Epoch Cost %d: ' % epoch, np.mean(losses), end='\r')
-            self.modelW = self.W.eval()
+    num_visible = 0
+    num_hidden = 64
+    cd_steps = 1  # number of Gibbs steps per update
+    learning_rate = 0.05
+    batch_size = 64
+    num_epochs = 10
+    seed = 42
+    verbose = False
+
+    W = None  # weights, shape (num_visible, num_hidden)
+    bv = None  # visible biases
+    bh = None  # hidden biases
+    v_min = None  # input scaling: v = (x - v_min) * v_scale
+    v_scale = None
+    is_trained = False
+    rng = None
+
+    # ---------------------------
+
+    def __init__(self, num_hidden=64, cd_steps=1, learning_rate=0.05, batch_size=64, num_epochs=10, seed=42,
+                 verbose=False):
+        super().__init__()
+        self.num_hidden = num_hidden
+        self.cd_steps = cd_steps
+        self.learning_rate = learning_rate
+        self.batch_size = batch_size
+        self.num_epochs = num_epochs
+        self.seed = seed
+        self.verbose = verbose
+        self.rng = np.random.default_rng(seed)
+
+    # initialise the weights and input scaling from the (first) training data
+    def init_weights(self, X):
+        self.num_visible = np.shape(X)[1]
+        self.W = (0.01 * self.rng.standard_normal((self.num_visible, self.num_hidden))).astype(np.float32)
+        self.bv = np.zeros(self.num_visible, dtype=np.float32)
+        self.bh = np.zeros(self.num_hidden, dtype=np.float32)
+
+        self.v_min = np.min(X, axis=0).astype(np.float32)
+        v_range = np.max(X, axis=0) - self.v_min
+        self.v_scale = np.where(v_range > 0.0, 1.0 / np.where(v_range > 0.0, v_range, 1.0), 0.0).astype(np.float32)
+
+    # scale inputs into [0, 1]
+    def scale(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        return np.clip((X - self.v_min) * self.v_scale, 0.0, 1.0)
+
+    # ---------------------------
+
+    def hidden_probs(self, v):
+        return sigmoid(v @ self.W + self.bh)
+
+    def visible_probs(self, h):
+        return sigmoid(h @ self.W.T + self.bv)
+
+    # train (or continue training) the RBM on the rows of X
+    def fit(self, X, num_epochs=None):
+        X = np.asarray(X, dtype=np.float32)
+        if self.W is None:
+            self.init_weights(X)
+
+        V = self.scale(X)
+        nrows = np.shape(V)[0]
+        num_epochs = self.num_epochs if num_epochs is None else num_epochs
+
+        for epoch in range(num_epochs):
+            order = self.rng.permutation(nrows)
+            for start in range(0, nrows, self.batch_size):
+                self.cd_update(V[order[start:start + self.batch_size]])
+
+            if self.verbose:
+                print(f"    RBM epoch {epoch + 1}/{num_epochs} reconstruction error: "
+                      f"{self.reconstruction_error(X):.5f}", end='\r')
+
+        if self.verbose:
+            print("")
+
+        self.is_trained = True
+        return self
+
+    # a single contrastive divergence (CD-k) update for a batch of (scaled) rows
+    def cd_update(self, v0):
+        n = np.shape(v0)[0]
+        ph0 = self.hidden_probs(v0)
+
+        phk = ph0
+        for k in range(self.cd_steps):
+            hk = (self.rng.random(np.shape(phk), dtype=np.float32) < phk).astype(np.float32)
+            vk = self.visible_probs(hk)
+            phk = self.hidden_probs(vk)
+
+        lr = self.learning_rate / n
+        self.W += lr * (v0.T @ ph0 - vk.T @ phk)
+        self.bv += lr * np.sum(v0 - vk, axis=0)
+        self.bh += lr * np.sum(ph0 - phk, axis=0)
+
+    # returns the hidden unit probabilities for the rows of X
+    def transform(self, X):
+        return self.hidden_probs(self.scale(X))
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    # mean squared error between the (scaled) inputs and their mean-field reconstruction
+    def reconstruction_error(self, X) -> float:
+        V = self.scale(X)
+        return float(np.mean((V - self.visible_probs(self.hidden_probs(V))) ** 2))
+
+    # ---------------------------
+
+    def save(self, path):
+        save_dir = os.path.dirname(path)
+        if save_dir and not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+        np.savez(path, W=self.W, bv=self.bv, bh=self.bh, v_min=self.v_min, v_scale=self.v_scale,
+                 params=np.array([self.num_hidden, self.cd_steps, self.learning_rate, self.batch_size,
+                                  self.num_epochs, self.seed]))
+
+
+# loads an RBM saved with RBM.save(). Returns None if the file does not exist
+def load(path):
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        num_hidden, cd_steps, learning_rate, batch_size, num_epochs, seed = data['params']
+        rbm = RBM(int(num_hidden), int(cd_steps), float(learning_rate), int(batch_size), int(num_epochs), int(seed))
+        rbm.W = data['W']
+        rbm.bv = data['bv']
+        rbm.bh = data['bh']
+        rbm.v_min = data['v_min']
+        rbm.v_scale = data['v_scale']
+
+    rbm.num_visible = np.shape(rbm.W)[0]
+    rbm.is_trained = True
+    return rbm
+
+
+# ---------------------------
+
+# keras layer that outputs the hidden unit probabilities of an RBM, for each step of the input sequence
+@keras.utils.register_keras_serializable(package='RBM')
+class RBMLayer(layers.Layer):
+
+    def __init__(self, num_hidden=64, **kwargs):
+        super(RBMLayer, self).__init__(**kwargs)
+        self.num_hidden = num_hidden
+
+    def build(self, input_shape):
+        num_visible = int(input_shape[-1])
+        self.W = self.add_weight(name='W', shape=(num_visible, self.num_hidden),
+                                 initializer=keras.initializers.RandomNormal(stddev=0.01), trainable=True)
+        self.bh = self.add_weight(name='bh', shape=(self.num_hidden,), initializer='zeros', trainable=True)
+        self.v_min = self.add_weight(name='v_min', shape=(num_visible,), initializer='zeros', trainable=False)
+        self.v_scale = self.add_weight(name='v_scale', shape=(num_visible,), initializer='ones', trainable=False)
+
+    def call(self, x):
+        v = tf.clip_by_value((x - self.v_min) * self.v_scale, 0.0, 1.0)
+        return tf.sigmoid(tf.tensordot(v, self.W, axes=[[-1], [0]]) + self.bh)
+
+    # copy the weights from a (trained) RBM. The layer must have been built
+    def set_rbm(self, rbm: RBM):
+        self.W.assign(rbm.W)
+        self.bh.assign(rbm.bh)
+        self.v_min.assign(rbm.v_min)
+        self.v_scale.assign(rbm.v_scale)
 
+    def get_config(self):  # Needed for saving and loading model with custom layer
+        config = super().get_config().copy()
+        config.update({'num_hidden': self.num_hidden})
+        return config
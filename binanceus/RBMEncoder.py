@@ -1,28 +1,20 @@
-
 import numpy as np
 from pandas import DataFrame, Series
 import pandas as pd
-from sklearn.neural_network import BernoulliRBM
 
 import random
 import os
 
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '1'
-os.environ['TF_DETERMINISTIC_OPS'] = '1'
-
-import tensorflow as tf
+import RBM
 
 seed = 42
 os.environ['PYTHONHASHSEED'] = str(seed)
 random.seed(seed)
-tf.random.set_seed(seed)
 np.random.seed(seed)
 
-tf.compat.v1.logging.set_verbosity(tf.compat.v1.logging.WARN)
-
-import keras
-
 
+# Encodes (normalised) data as the hidden unit probabilities of a Restricted Boltzmann Machine
+# The RBM is trained once, by fit(), and transform() then just applies it (it used to re-train on every call)
 
 class RBMEncoder():
 
@@ -30,11 +22,24 @@ class RBMEncoder():
 
     def __init__(self):
         super().__init__()
-        self.rbm = BernoulliRBM(random_state=0, verbose=True)
+        self.rbm = None
+
+    def fit(self, dataframe: DataFrame):
+        if self.rbm is None:
+            self.rbm = RBM.RBM(num_hidden=dataframe.shape[1], learning_rate=0.06, batch_size=32, num_epochs=20,
+                               verbose=True)
+        self.rbm.fit(dataframe)
+        return self
 
     def transform(self, dataframe: DataFrame) -> DataFrame:
-        self.rbm.learning_rate = 0.06
-        self.rbm.n_iter = 20
-        self.rbm.n_components = dataframe.shape[1]
-        self.rbm = self.rbm.fit(dataframe)
-        return self.rbm.transform(dataframe)
\ No newline at end of file
+        if (self.rbm is None) or (not self.rbm.is_trained):
+            self.fit(dataframe)
+        return self.rbm.transform(dataframe)
+
+    def save(self, path):
+        if self.rbm is not None:
+            self.rbm.save(path)
+
+    def load(self, path) -> bool:
+        self.rbm = RBM.load(path)
+        return self.rbm is not None
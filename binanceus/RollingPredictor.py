@@ -0,0 +1,126 @@
+# Rolling prediction engine for classifiers that only return a single prediction per call
+# (i.e. classifier.returns_single_prediction() is True)
+#
+# The original approach looped through the dataframe one row at a time, passed a chunk of data to the classifier and
+# grew the output with np.concatenate, which is quadratic in the length of the dataframe.
+# This engine instead:
+#   - builds all of the input windows up front, as views of the source data (no copies)
+#   - feeds the windows to the classifier in batches (if the classifier supports predict_batch()), or one at a time
+#   - writes results directly into a preallocated output array
+#   - reports progress/throughput via a callback rather than updating a progress bar on every row
+#
+# Usage:
+#    engine = RollingPredictor(window=64, batch_size=256)
+#    preds = engine.predict(classifier, data, fill_values=dataframe['close'].to_numpy())
+#
+# Classifiers can support batching by implementing:
+#    predict_batch(windows) -> np.array (one prediction per window)
+# where windows is either a list of DataFrames or a 3D+ array with shape (nwindows, window, ...)
+
+import time
+
+import numpy as np
+
+# Strategy specific imports, files must reside in same folder as strategy
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import logging
+
+log = logging.getLogger(__name__)
+
+from DataframeUtils import DataframeUtils
+
+
+# default progress callback. Prints throughput roughly every report_interval seconds
+def print_progress(done: int, total: int, elapsed: float):
+    rate = done / elapsed if elapsed > 0.0 else 0.0
+    pct = 100.0 * done / total if total > 0 else 100.0
+    print(f"    Predicting… {done}/{total} ({pct:.0f}%) {rate:.1f} rows/sec")
+
+
+class RollingPredictor():
+
+    window = 64  # number of rows passed to the classifier for each prediction
+    batch_size = 256  # number of windows passed to the classifier per call (if batching is supported)
+    report_interval = 10.0  # minimum time (secs) between progress reports
+    progress_callback = None  # callable(done, total, elapsed). None to disable reporting
+
+    dataframeUtils = None
+
+    # ---------------------------
+
+    def __init__(self, window=64, batch_size=256, progress_callback=print_progress):
+        super().__init__()
+
+        self.window = window
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+
+        if self.dataframeUtils is None:
+            self.dataframeUtils = DataframeUtils()
+
+    # ---------------------------
+
+    # returns True if the classifier can process multiple windows in one call
+    def supports_batching(self, classifier) -> bool:
+        return callable(getattr(classifier, "predict_batch", None))
+
+    # ---------------------------
+
+    # run rolling predictions over the supplied data (dataframe or array).
+    # Entry i of the result is the prediction made using rows [i-window+1, i] of the data.
+    # The first 'window' entries cannot be predicted, so are filled from fill_values (or 0.0 if not supplied)
+    def predict(self, classifier, data, fill_values=None) -> np.array:
+
+        nrows = np.shape(data)[0]
+        predictions = np.zeros(nrows, dtype=float)
+
+        start = min(self.window, nrows)
+        if fill_values is not None:
+            predictions[:start] = np.asarray(fill_values)[:start]
+
+        nwindows = nrows - start
+        if nwindows <= 0:
+            return predictions
+
+        use_dataframes = self.dataframeUtils.is_dataframe(data)
+        if not use_dataframes:
+            # strided view, shape: (nrows-window+1, window, ...). Skip the first window, which ends at row window-1
+            windows = self.dataframeUtils.df_to_windows(data, self.window)[1:]
+
+        batching = self.supports_batching(classifier)
+        batch_size = self.batch_size if batching else 1
+
+        start_time = time.perf_counter()
+        last_report = start_time
+
+        for b_start in range(0, nwindows, batch_size):
+            b_end = min(b_start + batch_size, nwindows)
+
+            # row indices (in the original data) of the last row of each window
+            first_row = start + b_start
+            last_row = start + b_end
+
+            if use_dataframes:
+                # iloc slices are views of the underlying data (for single-dtype frames), so these are cheap
+                chunks = [data.iloc[row - self.window + 1:row + 1] for row in range(first_row, last_row)]
+            else:
+                chunks = windows[b_start:b_end]
+
+            if batching:
+                preds = classifier.predict_batch(chunks)
+            else:
+                preds = [classifier.predict(chunks[0])[-1]]
+
+            predictions[first_row:last_row] = np.asarray(preds, dtype=float).reshape(-1)
+
+            if self.progress_callback is not None:
+                now = time.perf_counter()
+                if ((now - last_report) >= self.report_interval) or (b_end == nwindows):
+                    self.progress_callback(b_end, nwindows, now - start_time)
+                    last_report = now
+
+        return predictions
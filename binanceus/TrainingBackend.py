@@ -0,0 +1,267 @@
+# Training execution backends for the Classifier* family
+#
+# Training per-pair models one at a time (in the strategy process) only uses a fraction of the available cores, since
+# each model is fairly small. A backend trains models in other processes, so that the models for several pairs can be
+# trained at the same time:
+#   'local'  - a pool of worker processes on this machine (no cluster needed). Large numpy arrays (training tensors)
+#              are passed through shared memory (read-only in the workers), rather than being pickled for each job
+#   'ray'    - Ray tasks. Ray is initialised once per process (connects to a cluster if an address is supplied)
+#   'serial' - runs jobs in the calling process (useful for debugging)
+#
+# A job describes how to re-create the classifier in the worker (class, constructor arguments and settings). The
+# worker trains the classifier, saves the model and returns the model path; the caller then re-loads the model from
+# that file (see load_result()). Jobs for the same model must not run at the same time, so this is only suitable for
+# models that are trained independently (e.g. per-pair models).
+#
+# Usage:
+#    backend = TrainingBackend.get_backend('local')
+#    job = TrainingBackend.make_job(classifier, pair, seq_len, num_features, force_train)
+#    future = backend.submit(job, train_data, test_data, train_results, test_results)
+#    ...
+#    TrainingBackend.load_result(classifier, future.result())
+
+import concurrent.futures
+import importlib
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing import shared_memory
+from pathlib import Path
+
+import numpy as np
+
+min_shared_bytes = 1024 * 1024  # smaller arrays are just pickled
+
+# attributes that are not copied to the classifier in the worker (state, rather than settings)
+excluded_attributes = {'model', 'is_trained', 'loaded_from_file', 'new_model'}
+
+backends = {}  # mode -> backend. One backend per mode per process
+
+
+# ---------------------------
+
+# returns the (shared) backend for the mode. num_workers=0 uses one worker per core
+def get_backend(mode='local', num_workers=0):
+    backend = backends.get(mode, None)
+    if backend is None:
+        if mode == 'local':
+            backend = LocalBackend(num_workers)
+        elif mode == 'ray':
+            if not init_ray():
+                return None
+            backend = RayBackend()
+        elif mode == 'serial':
+            backend = SerialBackend()
+        else:
+            print(f"    ERR: unknown training backend: {mode}")
+            return None
+        backends[mode] = backend
+    return backend
+
+
+# initialise Ray (once per process). Returns False if Ray is not installed
+def init_ray(address=None) -> bool:
+    try:
+        import ray
+    except ModuleNotFoundError:
+        print("    ERR: ray is not installed")
+        return False
+
+    if not ray.is_initialized():
+        ray.init(address=address, ignore_reinit_error=True)
+    return True
+
+
+# ---------------------------
+
+# returns a description of the classifier, used to re-create it in a worker process
+def make_job(classifier, pair, seq_len, num_features, force_train=False) -> dict:
+    settings = {}
+    for key, value in vars(classifier).items():
+        if (key not in excluded_attributes) and isinstance(value, (bool, int, float, str)):
+            settings[key] = value
+
+    return {
+        'module': type(classifier).__module__,
+        'class': type(classifier).__name__,
+        'args': (pair, seq_len, num_features),
+        'category': classifier.category,
+        'model_name': classifier.name if hasattr(classifier, 'name') else classifier.model_name,
+        'precision': np.dtype(classifier.precision).name,
+        'settings': settings,
+        'force_train': force_train,
+        'pair': pair
+    }
+
+
+# re-load the model trained by a job into the (local) classifier. Returns False if training failed
+def load_result(classifier, result) -> bool:
+    if result['error']:
+        print(f"    ERR: training failed for {result['pair']}: {result['error']}")
+        return False
+
+    print(f"    {result['pair']}: trained in {result['time']:.1f} secs ({result['model_path']})")
+    classifier.model = None
+    classifier.model = classifier.load(result['model_path'])
+    return True
+
+
+# train a classifier described by job. Runs in the worker process
+def train_classifier(job, train_data, test_data, train_results, test_results) -> dict:
+    start = time.perf_counter()
+    result = {'pair': job['pair'], 'model_path': '', 'time': 0.0, 'error': ''}
+    blocks = []
+    try:
+        train_data, test_data, train_results, test_results = [attach(d, blocks) for d in
+                                                               (train_data, test_data, train_results, test_results)]
+
+        module = importlib.import_module(job['module'])
+        classifier = getattr(module, job['class'])(*job['args'])
+        classifier.set_model_name(job['category'], job['model_name'])
+        for key, value in job['settings'].items():
+            setattr(classifier, key, value)
+        classifier.set_precision(np.dtype(job['precision']).type)
+
+        classifier.train(train_data, test_data, train_results, test_results, job['force_train'])
+        classifier.save()
+        result['model_path'] = classifier.model_path
+
+    except Exception as e:
+        result['error'] = repr(e)
+
+    finally:
+        for block in blocks:
+            block.close()
+
+    result['time'] = time.perf_counter() - start
+    return result
+
+
+# ---------------------------
+# shared memory
+
+# descriptor for a numpy array held in shared memory
+class SharedArray():
+    name = ""
+    shape = ()
+    dtype = ""
+
+    def __init__(self, name, shape, dtype):
+        super().__init__()
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
+
+
+# copies an array into shared memory. Returns the descriptor, and the block (which the owner must unlink)
+def share(data):
+    if (not isinstance(data, np.ndarray)) or (data.nbytes < min_shared_bytes):
+        return data, None
+
+    block = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    array = np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)
+    array[...] = data
+    return SharedArray(block.name, data.shape, data.dtype.str), block
+
+
+# returns the (read-only) array for a descriptor. The block is added to 'blocks' (close when finished)
+def attach(data, blocks):
+    if not isinstance(data, SharedArray):
+        return data
+
+    block = shared_memory.SharedMemory(name=data.name)
+    blocks.append(block)
+    array = np.ndarray(data.shape, dtype=np.dtype(data.dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return array
+
+
+# ---------------------------
+# backends
+
+# worker process setup: find the strategy modules, and limit the threads used by each worker (otherwise each worker
+# would try to use all cores)
+def init_worker(path, num_threads):
+    if path not in sys.path:
+        sys.path.append(path)
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ[var] = str(num_threads)
+
+
+class LocalBackend():
+    num_workers = 1
+    executor = None
+
+    def __init__(self, num_workers=0):
+        super().__init__()
+        num_cpus = multiprocessing.cpu_count()
+        self.num_workers = num_workers if num_workers > 0 else num_cpus
+        num_threads = max(1, num_cpus // self.num_workers)
+
+        # spawn, rather than fork: forking a process that has already initialised tensorflow/torch is not safe
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers,
+                                                               mp_context=multiprocessing.get_context('spawn'),
+                                                               initializer=init_worker,
+                                                               initargs=(str(Path(__file__).parent), num_threads))
+        print(f"    Training backend: local ({self.num_workers} workers, {num_threads} threads/worker)")
+
+    def submit(self, job, train_data, test_data, train_results, test_results):
+        args = []
+        blocks = []
+        for data in (train_data, test_data, train_results, test_results):
+            data, block = share(data)
+            args.append(data)
+            if block is not None:
+                blocks.append(block)
+
+        future = self.executor.submit(train_classifier, job, *args)
+        future.add_done_callback(lambda f: release(blocks))
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+# free the shared memory used by a job
+def release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+class RayBackend():
+    remote_train = None
+
+    def __init__(self):
+        super().__init__()
+        import ray
+        self.remote_train = ray.remote(train_classifier)
+        print(f"    Training backend: ray ({ray.cluster_resources().get('CPU', 0):.0f} CPUs)")
+
+    def submit(self, job, train_data, test_data, train_results, test_results):
+        import ray
+
+        # ray.put() stores the arrays in the object store, which workers read without copying
+        args = [ray.put(d) if isinstance(d, np.ndarray) else d
+                for d in (train_data, test_data, train_results, test_results)]
+        return self.remote_train.remote(job, *args).future()
+
+    def shutdown(self):
+        return
+
+
+class SerialBackend():
+
+    def __init__(self):
+        super().__init__()
+        print("    Training backend: serial")
+
+    def submit(self, job, train_data, test_data, train_results, test_results):
+        future = concurrent.futures.Future()
+        future.set_result(train_classifier(job, train_data, test_data, train_results, test_results))
+        return future
+
+    def shutdown(self):
+        return
@@ -5,13 +5,32 @@ import tensorflow as tf
 from keras.models import *
 from keras.layers import *
 
+
+# returns separate (query, key, value) inputs. Layers accept either a single sequence (self-attention) or a
+# (query, key, value) tuple
+def split_qkv(inputs):
+    if isinstance(inputs, (list, tuple)):
+        return inputs[0], inputs[1], inputs[2]
+    return inputs, inputs, inputs
+
+
+# returns the shape of the query input, for both forms of input
+def get_query_shape(input_shape):
+    if isinstance(input_shape, (list, tuple)) and (len(input_shape) > 0) and \
+            isinstance(input_shape[0], (list, tuple, tf.TensorShape)):
+        return input_shape[0]
+    return input_shape
+
+
 class SingleAttention(Layer):
-    def __init__(self, d_k, d_v):
-        super(SingleAttention, self).__init__()
+    def __init__(self, d_k, d_v, **kwargs):
+        super(SingleAttention, self).__init__(**kwargs)
         self.d_k = d_k
         self.d_v = d_v
+        self.scale = 1.0 / np.sqrt(d_k)
 
     def build(self, input_shape):
+        input_shape = get_query_shape(input_shape)
         self.query = Dense(self.d_k,
                            input_shape=input_shape,
                            kernel_initializer='glorot_uniform',
@@ -28,58 +47,105 @@ class SingleAttention(Layer):
                            bias_initializer='glorot_uniform')
 
     def call(self, inputs):  # inputs = (in_seq, in_seq, in_seq)
-        q = self.query(inputs[0])
-        k = self.key(inputs[1])
+        q_in, k_in, v_in = split_qkv(inputs)
+        q = self.query(q_in)
+        k = self.key(k_in)
 
-        attn_weights = tf.matmul(q, k, transpose_b=True)
-        attn_weights = tf.map_fn(lambda x: x / np.sqrt(self.d_k), attn_weights)
+        # scale is a constant multiply (tf.map_fn ran a per-sample loop inside the graph)
+        attn_weights = tf.matmul(q, k, transpose_b=True) * self.scale
         attn_weights = tf.nn.softmax(attn_weights, axis=-1)
 
-        v = self.value(inputs[2])
+        v = self.value(v_in)
         attn_out = tf.matmul(attn_weights, v)
         return attn_out
 
+    def get_config(self):  # Needed for saving and loading model with custom layer
+        config = super().get_config().copy()
+        config.update({'d_k': self.d_k,
+                       'd_v': self.d_v})
+        return config
+
     #############################################################################
 
 
+# Multi-head attention with the heads fused together: the Q/K/V projections for all heads are done with a single
+# Dense layer each, and the heads are processed as an extra (batch) dimension, so there is one matmul per step
+# rather than one per head.
+# Shapes: (batch, seq, n_heads*d_k) -> (batch, n_heads, seq, d_k)
 class MultiAttention(Layer):
-    def __init__(self, d_k, d_v, n_heads):
-        super(MultiAttention, self).__init__()
+    def __init__(self, d_k, d_v, n_heads, **kwargs):
+        super(MultiAttention, self).__init__(**kwargs)
         self.d_k = d_k
         self.d_v = d_v
         self.n_heads = n_heads
-        self.attn_heads = list()
+        self.scale = 1.0 / np.sqrt(d_k)
 
     def build(self, input_shape):
-        for n in range(self.n_heads):
-            self.attn_heads.append(SingleAttention(self.d_k, self.d_v))
+        # input_shape=(batch, seq_len, 7), input_shape[-1]=7
+        input_shape = get_query_shape(input_shape)
+
+        self.query = Dense(self.n_heads * self.d_k,
+                           kernel_initializer='glorot_uniform',
+                           bias_initializer='glorot_uniform')
+
+        self.key = Dense(self.n_heads * self.d_k,
+                         kernel_initializer='glorot_uniform',
+                         bias_initializer='glorot_uniform')
+
+        self.value = Dense(self.n_heads * self.d_v,
+                           kernel_initializer='glorot_uniform',
+                           bias_initializer='glorot_uniform')
 
-            # input_shape[0]=(batch, seq_len, 7), input_shape[0][-1]=7
         self.linear = Dense(input_shape[-1],
-                            input_shape=input_shape,
                             kernel_initializer='glorot_uniform',
                             bias_initializer='glorot_uniform')
 
+    # (batch, seq, n_heads*depth) -> (batch, n_heads, seq, depth)
+    def split_heads(self, x, depth):
+        shape = tf.shape(x)
+        x = tf.reshape(x, [shape[0], shape[1], self.n_heads, depth])
+        return tf.transpose(x, perm=[0, 2, 1, 3])
+
     def call(self, inputs):
-        attn = [self.attn_heads[i](inputs) for i in range(self.n_heads)]
-        concat_attn = tf.concat(attn, axis=-1)
+        q_in, k_in, v_in = split_qkv(inputs)
+
+        q = self.split_heads(self.query(q_in), self.d_k)
+        k = self.split_heads(self.key(k_in), self.d_k)
+        v = self.split_heads(self.value(v_in), self.d_v)
+
+        attn_weights = tf.matmul(q, k, transpose_b=True) * self.scale
+        attn_weights = tf.nn.softmax(attn_weights, axis=-1)
+        attn = tf.matmul(attn_weights, v)  # (batch, n_heads, seq, d_v)
+
+        # back to (batch, seq, n_heads*d_v), i.e. the same layout as concatenating the heads
+        attn = tf.transpose(attn, perm=[0, 2, 1, 3])
+        shape = tf.shape(attn)
+        concat_attn = tf.reshape(attn, [shape[0], shape[1], self.n_heads * self.d_v])
+
         multi_linear = self.linear(concat_attn)
         return multi_linear
 
+    def get_config(self):  # Needed for saving and loading model with custom layer
+        config = super().get_config().copy()
+        config.update({'d_k': self.d_k,
+                       'd_v': self.d_v,
+                       'n_heads': self.n_heads})
+        return config
+
     #############################################################################
 
 
 class TransformerEncoder(Layer):
     def __init__(self, d_k, d_v, n_heads, ff_dim, dropout=0.1, **kwargs):
-        super(TransformerEncoder, self).__init__()
+        super(TransformerEncoder, self).__init__(**kwargs)
         self.d_k = d_k
         self.d_v = d_v
         self.n_heads = n_heads
         self.ff_dim = ff_dim
-        self.attn_heads = list()
         self.dropout_rate = dropout
 
     def build(self, input_shape):
+        input_shape = get_query_shape(input_shape)
         self.attn_multi = MultiAttention(self.d_k, self.d_v, self.n_heads)
         self.attn_dropout = Dropout(self.dropout_rate)
         self.attn_normalize = LayerNormalization(input_shape=input_shape, epsilon=1e-6)
@@ -93,15 +159,15 @@ class TransformerEncoder(Layer):
         self.ff_normalize = LayerNormalization(input_shape=input_shape, epsilon=1e-6)
 
     def call(self, inputs):  # inputs = (in_seq, in_seq, in_seq)
+        q_in, _, _ = split_qkv(inputs)
         attn_layer = self.attn_multi(inputs)
         attn_layer = self.attn_dropout(attn_layer)
-        print("attn_layer:", attn_layer)
-        attn_layer = self.attn_normalize(inputs[0] + attn_layer)
+        attn_layer = self.attn_normalize(q_in + attn_layer)
 
         ff_layer = self.ff_conv1D_1(attn_layer)
         ff_layer = self.ff_conv1D_2(ff_layer)
         ff_layer = self.ff_dropout(ff_layer)
-        ff_layer = self.ff_normalize(inputs[0] + ff_layer)
+        ff_layer = self.ff_normalize(q_in + ff_layer)
         return ff_layer
 
     def get_config(self):  # Needed for saving and loading model with custom layer
@@ -110,6 +176,7 @@ class TransformerEncoder(Layer):
                        'd_v': self.d_v,
                        'n_heads': self.n_heads,
                        'ff_dim': self.ff_dim,
-                       'attn_heads': self.attn_heads,
-                       'dropout_rate': self.dropout_rate})
-        return config
\ No newline at end of file
+                       'dropout': self.dropout_rate})
+        return config
+
+    #############################################################################
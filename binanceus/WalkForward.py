@@ -0,0 +1,214 @@
+# Retraining trigger, with on-disk caching of the datasets used for each training run
+#
+# Strategies such as PCA, NNBC and Anomaly used to rebuild the normalised dataframe, the 'viable'/'standard' dataset and
+# the train/test split every time they retrained, and (in the case of PCA) decided when to retrain using a random
+# countdown. This module replaces that with:
+#
+#   - a deterministic retraining trigger. Time is divided into folds of retrain_interval candles, aligned to absolute
+#     time, and should_retrain() returns True when the last row of the dataframe has moved into a new fold. This only
+#     decides *when* a strategy retrains, it is not a walk-forward scheduler: the strategy still trains on (and
+#     predicts) the dataframe it was given. In rolling/live modes, that means retraining at most once per fold. In
+#     backtest mode, populate_indicators() sees the whole range at once, so the models are trained once per pair and
+#     used for the whole range
+#   - a cache of the train/test arrays for each training run. These are saved as .npy files and re-loaded
+#     memory-mapped, so repeated runs over the same data (and concurrent processes) share them without re-computation
+#     or copying. Entries can only be re-used when the same data is processed again, so the cache should only be
+#     enabled for backtest/hyperopt runs. The oldest entries are removed once there are more than max_entries
+#
+# Independent pairs are processed in parallel by PairPrecompute (which runs the whole pipeline, including training,
+# for each pair in a worker process), so there is no separate parallel training step here.
+#
+# Usage (in a strategy):
+#    walkForward = WalkForward(self.__class__.__name__, retrain_interval=32)
+#
+#    if walkForward.should_retrain(pair, dataframe):
+#        fold_id = walkForward.get_fold_id(dataframe)
+#        key = walkForward.get_cache_key(pair, fold_id, dataframe, buys, sells)
+#        dataset = walkForward.load_dataset(pair, key)
+#        if dataset is None:
+#            ... build train/test data ...
+#            walkForward.save_dataset(pair, key, {'train': df_train, 'test': df_test, ...})
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# Strategy specific imports, files must reside in same folder as strategy
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class WalkForward():
+
+    category = ""  # used to separate cache entries (typically the strategy name)
+    train_size = 975  # number of candles in each training window (matches what is available in run modes)
+    retrain_interval = 32  # number of candles between retraining
+    timeframe_mins = 5
+    use_cache = True  # set to False to disable the on-disk dataset cache
+    max_entries = 256  # maximum number of cached datasets (per category). Oldest entries are removed first
+
+    cache_hits = 0
+    cache_misses = 0
+
+    # ---------------------------
+
+    def __init__(self, category, train_size=975, retrain_interval=32, timeframe_mins=5, use_cache=True):
+        super().__init__()
+
+        self.category = category
+        self.train_size = train_size
+        self.retrain_interval = retrain_interval
+        self.timeframe_mins = timeframe_mins
+        self.use_cache = use_cache
+
+        self.curr_fold = {}  # fold id that each pair was last trained on
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    # ---------------------------
+    # Scheduling
+
+    # returns the fold id for each timestamp in the supplied date column
+    def get_fold_ids(self, dates) -> np.array:
+        period = self.retrain_interval * self.timeframe_mins * 60
+        secs = (pd.to_datetime(dates, utc=True) - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+        return np.asarray(secs // period, dtype=np.int64)
+
+    # returns the id of the fold that the last row of the dataframe belongs to
+    def get_fold_id(self, dataframe: DataFrame) -> int:
+        return int(self.get_fold_ids(dataframe['date'].iloc[-1:])[0])
+
+    # returns True if the pair has moved into a new fold since it was last trained (or has never been trained)
+    def should_retrain(self, pair, dataframe: DataFrame) -> bool:
+        fold_id = self.get_fold_id(dataframe)
+        if self.curr_fold.get(pair, None) == fold_id:
+            return False
+        self.curr_fold[pair] = fold_id
+        return True
+
+    # forces retraining on the next call to should_retrain() (e.g. if training failed)
+    def request_retrain(self, pair):
+        self.curr_fold.pop(pair, None)
+
+    # ---------------------------
+    # Dataset cache
+
+    # returns the root directory used for the cache
+    def get_cache_dir(self):
+        file_dir = os.path.dirname(str(Path(__file__)))
+        cache_dir = file_dir + "/cache/folds/" + self.category + "/"
+        return cache_dir
+
+    # returns a key that identifies the data used to build a fold. Includes the date range, columns, prices and the
+    # contents of any label arrays, so different strategies (or labelling schemes) do not share entries.
+    # config should describe any settings that affect the dataset (scaler type, sequence length etc.)
+    def get_cache_key(self, pair, fold_id, dataframe: DataFrame, *labels, config="") -> str:
+        h = hashlib.sha1()
+        h.update(f"{pair}:{fold_id}:{self.train_size}:{dataframe.shape}:{config}".encode())
+        h.update(str(dataframe['date'].iloc[0]).encode())
+        h.update(str(dataframe['date'].iloc[-1]).encode())
+        h.update(",".join(map(str, dataframe.columns)).encode())
+        h.update(np.ascontiguousarray(dataframe['close'], dtype=np.float64).tobytes())
+        for label in labels:
+            h.update(np.ascontiguousarray(label, dtype=np.float64).tobytes())
+        return h.hexdigest()
+
+    def get_entry_dir(self, pair, key):
+        return self.get_cache_dir() + pair.replace("/", "_") + "/" + key + "/"
+
+    # returns the cached arrays (memory-mapped, read-only) for the supplied key, or None if not present
+    # entries that were saved as DataFrames are returned as DataFrames (wrapping the memory-mapped data)
+    def load_dataset(self, pair, key):
+        if not self.use_cache:
+            return None
+
+        entry_dir = self.get_entry_dir(pair, key)
+        meta_path = entry_dir + "meta.json"
+        if not os.path.exists(meta_path):
+            self.cache_misses += 1
+            return None
+
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+
+            dataset = {}
+            for name in meta['arrays']:
+                data = np.load(entry_dir + name + ".npy", mmap_mode='r')
+                if name in meta['columns']:
+                    data = DataFrame(data, columns=meta['columns'][name], copy=False)
+                dataset[name] = data
+        except Exception as e:
+            print(f"    WARN: could not load cached dataset ({entry_dir}): {e}")
+            self.cache_misses += 1
+            return None
+
+        self.cache_hits += 1
+        return dataset
+
+    # saves the supplied arrays/dataframes to the cache. Writes to a temporary directory and renames, so that
+    # concurrent processes never see a partially written entry
+    def save_dataset(self, pair, key, dataset: dict):
+        if not self.use_cache:
+            return
+
+        entry_dir = self.get_entry_dir(pair, key)
+        if os.path.exists(entry_dir + "meta.json"):
+            return
+
+        tmp_dir = entry_dir.rstrip("/") + f".tmp{os.getpid()}/"
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        meta = {'arrays': [], 'columns': {}}
+        for name, data in dataset.items():
+            if isinstance(data, DataFrame):
+                meta['columns'][name] = [str(c) for c in data.columns]
+            np.save(tmp_dir + name + ".npy", np.asarray(data))
+            meta['arrays'].append(name)
+
+        with open(tmp_dir + "meta.json", "w") as f:
+            json.dump(meta, f)
+
+        try:
+            os.replace(tmp_dir, entry_dir.rstrip("/"))
+        except OSError:
+            # another process got there first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.prune_cache()
+
+    # removes the oldest entries (by modification time), if the cache holds more than max_entries
+    def prune_cache(self):
+        cache_dir = self.get_cache_dir()
+        if (self.max_entries <= 0) or (not os.path.exists(cache_dir)):
+            return
+
+        entries = []
+        for pair_dir in os.scandir(cache_dir):
+            if pair_dir.is_dir():
+                entries.extend(e for e in os.scandir(pair_dir.path) if e.is_dir() and (".tmp" not in e.name))
+
+        if len(entries) <= self.max_entries:
+            return
+
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.max_entries]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    # removes all cached datasets for this category
+    def clear_cache(self):
+        shutil.rmtree(self.get_cache_dir(), ignore_errors=True)
+
+    def print_cache_stats(self):
+        print(f"    Fold cache - hits:{self.cache_hits} misses:{self.cache_misses}")
@@ -365,16 +365,21 @@ class TFTDataCache(object):
   def update(cls, data, key):
     """Updates cached data.
 
+    Arrays are made read-only, so they can be shared without copying.
+
     Args:
       data: Source to update
       key: Key to dictionary location
     """
+    for v in data.values():
+      if isinstance(v, np.ndarray):
+        v.flags.writeable = False
     cls._data_cache[key] = data
 
   @classmethod
   def get(cls, key):
-    """Returns data stored at key location."""
-    return cls._data_cache[key].copy()
+    """Returns data stored at key location (arrays are shared, not copied)."""
+    return dict(cls._data_cache[key])
 
   @classmethod
   def contains(cls, key):
@@ -625,55 +630,24 @@ class TemporalFusionTransformer(object):
 
     print('Cached data "{}" updated'.format(cache_key))
 
-  def _batch_sampled_data(self, data, max_samples):
-    """Samples segments into a compatible format.
+  def _get_group_arrays(self, data, sort_by_time=False):
+    """Converts data to contiguous arrays, with the rows of each entity together.
+
+    The dataframe is converted once, and time/identifiers are stored as integer
+    codes (the original values are returned separately).
 
     Args:
-      data: Sources data to sample and batch
-      max_samples: Maximum number of samples in batch
+      data: Source dataframe
+      sort_by_time: Whether to sort rows by time within each entity (otherwise
+        the original row order is kept)
 
     Returns:
-      Dictionary of batched data with the maximum samples specified.
+      Dictionary of arrays for 'inputs', 'outputs' (float), 'identifier',
+      'time' (integer codes), 'identifier_values', 'time_values' (code ->
+      original value) and 'group_start', 'group_end' (row range of each
+      entity).
     """
 
-    if max_samples < 1:
-      raise ValueError(
-          'Illegal number of samples specified! samples={}'.format(max_samples))
-
-    id_col = self._get_single_col_by_type(InputTypes.ID)
-    time_col = self._get_single_col_by_type(InputTypes.TIME)
-
-    data.sort_values(by=[id_col, time_col], inplace=True)
-
-    print('Getting valid sampling locations.')
-    valid_sampling_locations = []
-    split_data_map = {}
-    for identifier, df in data.groupby(id_col):
-      print('Getting locations for {}'.format(identifier))
-      num_entries = len(df)
-      if num_entries >= self.time_steps:
-        valid_sampling_locations += [
-            (identifier, self.time_steps + i)
-            for i in range(num_entries - self.time_steps + 1)
-        ]
-      split_data_map[identifier] = df
-
-    inputs = np.zeros((max_samples, self.time_steps, self.input_size))
-    outputs = np.zeros((max_samples, self.time_steps, self.output_size))
-    time = np.empty((max_samples, self.time_steps, 1), dtype=object)
-    identifiers = np.empty((max_samples, self.time_steps, 1), dtype=object)
-
-    if max_samples > 0 and len(valid_sampling_locations) > max_samples:
-      print('Extracting {} samples...'.format(max_samples))
-      ranges = [
-          valid_sampling_locations[i] for i in np.random.choice(
-              len(valid_sampling_locations), max_samples, replace=False)
-      ]
-    else:
-      print('Max samples={} exceeds # available segments={}'.format(
-          max_samples, len(valid_sampling_locations)))
-      ranges = valid_sampling_locations
-
     id_col = self._get_single_col_by_type(InputTypes.ID)
     time_col = self._get_single_col_by_type(InputTypes.TIME)
     target_col = self._get_single_col_by_type(InputTypes.TARGET)
@@ -683,94 +657,112 @@ class TemporalFusionTransformer(object):
         if tup[2] not in {InputTypes.ID, InputTypes.TIME}
     ]
 
-    for i, tup in enumerate(ranges):
-      if (i + 1 % 1000) == 0:
-        print(i + 1, 'of', max_samples, 'samples done...')
-      identifier, start_idx = tup
-      sliced = split_data_map[identifier].iloc[start_idx -
-                                               self.time_steps:start_idx]
-      inputs[i, :, :] = sliced[input_cols]
-      outputs[i, :, :] = sliced[[target_col]]
-      time[i, :, 0] = sliced[time_col]
-      identifiers[i, :, 0] = sliced[id_col]
-
-    sampled_data = {
-        'inputs': inputs,
-        'outputs': outputs[:, self.num_encoder_steps:, :],
-        'active_entries': np.ones_like(outputs[:, self.num_encoder_steps:, :]),
-        'time': time,
-        'identifier': identifiers
+    # codes are in sorted order, so entities are in the same order as groupby()
+    id_codes, id_values = pd.factorize(data[id_col], sort=True)
+    time_codes, time_values = pd.factorize(data[time_col], sort=True)
+
+    if sort_by_time:
+      order = np.lexsort((time_codes, id_codes))
+    else:
+      order = np.argsort(id_codes, kind='stable')
+    order = order[id_codes[order] >= 0]  # groupby() drops missing identifiers
+
+    id_codes = id_codes[order]
+    group_start = np.flatnonzero(np.r_[True, id_codes[1:] != id_codes[:-1]])
+    group_end = np.r_[group_start[1:], len(id_codes)].astype(group_start.dtype)
+
+    return {
+        'inputs': data[input_cols].to_numpy(dtype=np.float64)[order],
+        'outputs': data[[target_col]].to_numpy(dtype=np.float64)[order],
+        'identifier': id_codes,
+        'time': time_codes[order],
+        'identifier_values': np.asarray(id_values),
+        'time_values': np.asarray(time_values),
+        'group_start': group_start,
+        'group_end': group_end
     }
 
-    return sampled_data
+  def _get_window_starts(self, group_start, group_end):
+    """Returns the first row of every complete window within each entity."""
 
-  def _batch_data(self, data):
-    """Batches data for training.
+    counts = np.maximum(group_end - group_start - self.time_steps + 1, 0)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    return np.repeat(group_start, counts) + offsets
 
-    Converts raw dataframe from a 2-D tabular format to a batched 3-D array
-    to feed into Keras model.
+  def _get_windows(self, arrays, starts):
+    """Extracts the windows starting at the supplied rows.
 
     Args:
-      data: DataFrame to batch
+      arrays: Group arrays (see _get_group_arrays)
+      starts: First row of each window
 
     Returns:
-      Batched Numpy array with shape=(?, self.time_steps, self.input_size)
+      Dictionary of batched data.
     """
 
-    # Functions.
-    def _batch_single_entity(input_data):
-      time_steps = len(input_data)
-      lags = self.time_steps
-      x = input_data.values
-      if time_steps >= lags:
-        return np.stack(
-            [x[i:time_steps - (lags - 1) + i, :] for i in range(lags)], axis=1)
+    # one gather per array: (samples, time_steps, columns)
+    rows = starts[:, np.newaxis] + np.arange(self.time_steps)
+    outputs = arrays['outputs'][rows[:, self.num_encoder_steps:]]
 
-      else:
-        return None
+    return {
+        'inputs': arrays['inputs'][rows],
+        'outputs': outputs,
+        'active_entries': np.ones_like(outputs),
+        'time': arrays['time'][rows][Ellipsis, np.newaxis],
+        'identifier': arrays['identifier'][rows][Ellipsis, np.newaxis],
+        'time_values': arrays['time_values'],
+        'identifier_values': arrays['identifier_values']
+    }
 
-    id_col = self._get_single_col_by_type(InputTypes.ID)
-    time_col = self._get_single_col_by_type(InputTypes.TIME)
-    target_col = self._get_single_col_by_type(InputTypes.TARGET)
-    input_cols = [
-        tup[0]
-        for tup in self.column_definition
-        if tup[2] not in {InputTypes.ID, InputTypes.TIME}
-    ]
+  def _batch_sampled_data(self, data, max_samples):
+    """Samples segments into a compatible format.
 
-    data_map = {}
-    for _, sliced in data.groupby(id_col):
+    Args:
+      data: Sources data to sample and batch
+      max_samples: Maximum number of samples in batch
 
-      col_mappings = {
-          'identifier': [id_col],
-          'time': [time_col],
-          'outputs': [target_col],
-          'inputs': input_cols
-      }
+    Returns:
+      Dictionary of batched data with the maximum samples specified.
+    """
 
-      for k in col_mappings:
-        cols = col_mappings[k]
-        arr = _batch_single_entity(sliced[cols].copy())
+    if max_samples < 1:
+      raise ValueError(
+          'Illegal number of samples specified! samples={}'.format(max_samples))
 
-        if k not in data_map:
-          data_map[k] = [arr]
-        else:
-          data_map[k].append(arr)
+    print('Getting valid sampling locations.')
+    arrays = self._get_group_arrays(data, sort_by_time=True)
+    valid_starts = self._get_window_starts(arrays['group_start'],
+                                           arrays['group_end'])
 
-    # Combine all data
-    for k in data_map:
-      data_map[k] = np.concatenate(data_map[k], axis=0)
+    if max_samples > 0 and len(valid_starts) > max_samples:
+      print('Extracting {} samples...'.format(max_samples))
+      starts = valid_starts[np.random.choice(
+          len(valid_starts), max_samples, replace=False)]
+    else:
+      print('Max samples={} exceeds # available segments={}'.format(
+          max_samples, len(valid_starts)))
+      starts = valid_starts
 
-    # Shorten target so we only get decoder steps
-    data_map['outputs'] = data_map['outputs'][:, self.num_encoder_steps:, :]
+    return self._get_windows(arrays, starts)
 
-    active_entries = np.ones_like(data_map['outputs'])
-    if 'active_entries' not in data_map:
-      data_map['active_entries'] = active_entries
-    else:
-      data_map['active_entries'].append(active_entries)
+  def _batch_data(self, data):
+    """Batches data for training.
+
+    Converts raw dataframe from a 2-D tabular format to a batched 3-D array
+    to feed into Keras model.
+
+    Args:
+      data: DataFrame to batch
+
+    Returns:
+      Batched Numpy array with shape=(?, self.time_steps, self.input_size)
+    """
 
-    return data_map
+    arrays = self._get_group_arrays(data)
+    starts = self._get_window_starts(arrays['group_start'],
+                                     arrays['group_end'])
+    return self._get_windows(arrays, starts)
 
   def _get_active_locations(self, x):
     """Formats sample weights for Keras training."""
@@ -1219,6 +1211,8 @@ class TemporalFusionTransformer(object):
     time = data['time']
     identifier = data['identifier']
     outputs = data['outputs']
+    time_values = data['time_values']
+    identifier_values = data['identifier_values']
 
     combined = self.model.predict(
         inputs,
@@ -1240,8 +1234,9 @@ class TemporalFusionTransformer(object):
               for i in range(self.time_steps - self.num_encoder_steps)
           ])
       cols = list(flat_prediction.columns)
-      flat_prediction['forecast_time'] = time[:, self.num_encoder_steps - 1, 0]
-      flat_prediction['identifier'] = identifier[:, 0, 0]
+      flat_prediction['forecast_time'] = time_values[
+          time[:, self.num_encoder_steps - 1, 0]]
+      flat_prediction['identifier'] = identifier_values[identifier[:, 0, 0]]
 
       # Arrange in order
       return flat_prediction[['forecast_time', 'identifier'] + cols]
@@ -1318,8 +1313,9 @@ class TemporalFusionTransformer(object):
       gc.collect()
       attention_weights[k] = tmp
 
-    attention_weights['identifiers'] = identifiers[:, 0, 0]
-    attention_weights['time'] = time[:, :, 0]
+    attention_weights['identifiers'] = data['identifier_values'][
+        identifiers[:, 0, 0]]
+    attention_weights['time'] = data['time_values'][time[:, :, 0]]
 
     return attention_weights
 
@@ -0,0 +1,351 @@
+# Vectorized rolling signal models, used by the signal-model strategies (DWT, FFT, Kalman, SARIMAX etc.)
+#
+# The strategies used pandas rolling().apply() to fit a model to every window of the informative close prices and
+# keep the last value, i.e. one Python call (and one model fit) per candle. Here, all windows are processed at once:
+#   - the windows are built as a (strided) 2D view of the data and standardised together
+#   - each model processes a whole batch of windows with array operations (along axis 1)
+#   - windows are processed in chunks, so that memory use stays bounded for long backtests
+#
+# Models:
+#   'dwt'     - Discrete Wavelet Transform with hard thresholding of the detail coefficients (pywt, batched)
+#   'fft'     - Fast Fourier Transform, removing frequencies with low power spectrum density
+#   'fft_lowpass' - Fast Fourier Transform of the (linearly) de-trended data, removing the higher frequencies
+#   'kalman'  - 1D (local level) Kalman filter. With fixed parameters, the filtered value at the end of the window is
+#               a fixed linear combination of the window, so the weights are computed once and applied as a dot product.
+#               If em_iterations > 0, the parameters are first estimated from the first window (pykalman EM)
+#   'sarimax' - AR(p) model (no trend), fitted per window by (batched) least squares and forecast 'steps' ahead.
+#               method='mle' uses statsmodels SARIMAX instead (one fit per window, very slow)
+#
+# Extrapolation (predicting the next value(s) of a series) uses a local polynomial (Savitzky-Golay style) least squares
+# fit over each window. The fit and evaluation are linear in the data, so the pseudo-inverse of the (fixed) Vandermonde
+# matrix gives a single set of coefficients per (window, degree, lookahead), and each window is one dot product. This
+# replaces the per-window scipy UnivariateSpline fits, which were too slow to use.
+#
+# Usage:
+#    import SignalModel
+#
+#    model = SignalModel.create_model('dwt')
+#    dataframe['dwt_model'] = model.rolling(dataframe['close'].to_numpy(), window=128)
+#    dataframe['dwt_predict'] = SignalModel.extrapolate(dataframe['dwt_model'].to_numpy(), window=128)
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import scipy.fft
+
+
+class SignalModel():
+
+    chunk_size = 4096  # number of windows processed at a time
+    fitted = True  # False if the model parameters need to be estimated from the data (see fit())
+
+    # ---------------------------
+
+    def __init__(self):
+        super().__init__()
+
+    # estimate model parameters from the supplied (standardised) windows. Only called if fitted is False, with the
+    # valid windows of the first chunk
+    def fit(self, windows: np.ndarray):
+        self.fitted = True
+
+    # returns the modelled value for the last element of each (standardised) window. Override in subclasses
+    # windows: array of shape (num_windows, window_size)
+    def fit_windows(self, windows: np.ndarray) -> np.ndarray:
+        return windows[:, -1]
+
+    # ---------------------------
+
+    # returns an array (same length as values) with the model value for each rolling window, NaN for the first
+    # (window-1) entries and for windows that contain NaN values (same as pandas rolling().apply())
+    def rolling(self, values, window: int) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        nrows = len(values)
+        result = np.full(nrows, np.nan)
+        if nrows < window:
+            return result
+
+        windows = sliding_window_view(values, window)
+        nwin = len(windows)
+
+        for start in range(0, nwin, self.chunk_size):
+            end = min(start + self.chunk_size, nwin)
+            chunk = windows[start:end]
+
+            # standardise each window
+            w_mean = chunk.mean(axis=1)
+            w_std = chunk.std(axis=1)
+            safe_std = np.where(w_std > 0.0, w_std, 1.0)
+            scaled = (chunk - w_mean[:, None]) / safe_std[:, None]
+
+            valid = np.isfinite(scaled).all(axis=1)
+            scaled = np.where(valid[:, None], scaled, 0.0)
+
+            if (not self.fitted) and valid.any():
+                self.fit(scaled[valid])
+
+            model = self.fit_windows(scaled)
+
+            # restore the data. Constant windows just return the mean
+            model = np.where(w_std > 0.0, (model * w_std) + w_mean, w_mean)
+            result[window - 1 + start:window - 1 + end] = np.where(valid, model, np.nan)
+
+        return result
+
+
+# ---------------------------
+
+class DWTModel(SignalModel):
+
+    wavelet = 'haar'  # deals well with harsh transitions
+    mode = 'smooth'
+    level = 1  # the detail coefficients at this level are used to estimate the noise
+
+    def __init__(self, wavelet='haar', mode='smooth', level=1):
+        super().__init__()
+        self.wavelet = wavelet
+        self.mode = mode
+        self.level = level
+
+    def fit_windows(self, windows: np.ndarray) -> np.ndarray:
+        import pywt
+
+        length = windows.shape[1]
+        coeff = pywt.wavedec(windows, self.wavelet, mode=self.mode, axis=1)
+
+        # remove higher harmonics. Threshold is based on the mean absolute deviation of the detail coefficients
+        detail = coeff[-self.level]
+        madev = np.mean(np.absolute(detail - detail.mean(axis=1, keepdims=True)), axis=1)
+        sigma = (1 / 0.6745) * madev
+        uthresh = (sigma * np.sqrt(2 * np.log(length)))[:, None]
+        coeff[1:] = [np.where(np.absolute(c) < uthresh, 0.0, c) for c in coeff[1:]]
+
+        # inverse transform
+        model = pywt.waverec(coeff, self.wavelet, mode=self.mode, axis=1)
+        return model[:, length - 1]
+
+
+class FFTModel(SignalModel):
+
+    threshold = 20  # frequencies with a power spectrum density below this are removed
+
+    def __init__(self, threshold=20):
+        super().__init__()
+        self.threshold = threshold
+
+    def fit_windows(self, windows: np.ndarray) -> np.ndarray:
+        n = windows.shape[1]
+        fft = scipy.fft.fft(windows, n, axis=1)
+
+        # squared magnitude of each fft coefficient
+        psd = (fft * np.conj(fft)).real / n
+        fft = np.where(psd < self.threshold, 0, fft)
+
+        # only the last element of the inverse transform is needed
+        ifft = scipy.fft.ifft(fft, axis=1)
+        return ifft.real[:, n - 1]
+
+
+class FFTLowPassModel(SignalModel):
+
+    cutoff = 0.2  # fraction of the frequencies that are kept
+
+    def __init__(self, cutoff=0.2):
+        super().__init__()
+        self.cutoff = cutoff
+
+    def fit_windows(self, windows: np.ndarray) -> np.ndarray:
+        n = windows.shape[1]
+
+        # remove the linear trend (least squares slope of each window)
+        t = np.arange(n) - (n - 1) / 2.0
+        slope = (windows @ t) / (t @ t)
+        x_notrend = windows - slope[:, None] * np.arange(n)
+        yf = scipy.fft.rfft(x_notrend, axis=1)
+
+        # zero out frequencies beyond 'cutoff'
+        cutoff = int(yf.shape[1] * self.cutoff)
+        yf[:, (cutoff - 1):] = 0
+
+        # inverse transform, and restore the trend
+        restored_sig = scipy.fft.irfft(yf, n, axis=1)
+        return restored_sig[:, n - 1] + slope * (n - 1)
+
+
+class KalmanModel(SignalModel):
+
+    transition = 1.0
+    observation = 1.0
+    initial_mean = 0.0
+    initial_covariance = 1.0
+    observation_covariance = 0.1
+    transition_covariance = 0.1
+    em_iterations = 0  # number of EM iterations used to estimate the parameters. 0 means use the supplied values
+
+    def __init__(self, transition=1.0, observation=1.0, initial_mean=0.0, initial_covariance=1.0,
+                 observation_covariance=0.1, transition_covariance=0.1, em_iterations=0):
+        super().__init__()
+        self.transition = transition
+        self.observation = observation
+        self.initial_mean = initial_mean
+        self.initial_covariance = initial_covariance
+        self.observation_covariance = observation_covariance
+        self.transition_covariance = transition_covariance
+        self.em_iterations = em_iterations
+        self.fitted = (em_iterations <= 0)
+        self.weights = {}  # window size -> (weights, bias)
+
+    # estimate the covariances and initial state from the first window (same as pykalman's em() defaults)
+    def fit(self, windows: np.ndarray):
+        from pykalman import KalmanFilter
+
+        kfilter = KalmanFilter(
+            transition_matrices=self.transition,
+            observation_matrices=self.observation,
+            initial_state_mean=self.initial_mean,
+            initial_state_covariance=self.initial_covariance,
+            observation_covariance=self.observation_covariance,
+            transition_covariance=self.transition_covariance
+        )
+        kfilter = kfilter.em(windows[0], n_iter=self.em_iterations)
+
+        self.initial_mean = float(np.ravel(kfilter.initial_state_mean)[0])
+        self.initial_covariance = float(np.ravel(kfilter.initial_state_covariance)[0])
+        self.observation_covariance = float(np.ravel(kfilter.observation_covariance)[0])
+        self.transition_covariance = float(np.ravel(kfilter.transition_covariance)[0])
+        self.weights = {}
+        self.fitted = True
+
+    # the covariance (and so the gain) does not depend on the data, so the filtered state at the end of the window is
+    # sum(weights * window) + bias. Note: the smoothed and filtered values are the same for the last element
+    def get_weights(self, length):
+        if length in self.weights:
+            return self.weights[length]
+
+        a = self.transition
+        c = self.observation
+        gains = np.zeros(length)
+        p = self.initial_covariance
+        for t in range(length):
+            if t > 0:
+                p = a * p * a + self.transition_covariance
+            k = p * c / (c * p * c + self.observation_covariance)
+            p = (1.0 - k * c) * p
+            gains[t] = k
+
+        # contribution of each observation to the final state
+        weights = np.zeros(length)
+        carry = 1.0
+        for t in range(length - 1, -1, -1):
+            weights[t] = gains[t] * carry
+            carry = carry * (1.0 - gains[t] * c) * (a if t > 0 else 1.0)
+        bias = carry * self.initial_mean
+
+        self.weights[length] = (weights, bias)
+        return self.weights[length]
+
+    def fit_windows(self, windows: np.ndarray) -> np.ndarray:
+        weights, bias = self.get_weights(windows.shape[1])
+        return windows @ weights + bias
+
+
+class SARIMAXModel(SignalModel):
+
+    order = 2  # number of AR terms
+    steps = 2  # number of steps to forecast (the last forecast is returned)
+    method = 'ols'  # 'ols' (vectorized least squares) or 'mle' (statsmodels, one fit per window)
+
+    def __init__(self, order=2, steps=2, method='ols'):
+        super().__init__()
+        self.order = order
+        self.steps = steps
+        self.method = method
+
+    def fit_windows(self, windows: np.ndarray) -> np.ndarray:
+        if self.method == 'mle':
+            return self.fit_windows_mle(windows)
+
+        p = self.order
+        n = windows.shape[1]
+
+        # lagged values: x[:, t, j] = y[t-j-1], for t = p..n-1
+        y = windows[:, p:]
+        x = np.stack([windows[:, p - j - 1:n - j - 1] for j in range(p)], axis=2)
+
+        # batched least squares (normal equations), with a small ridge term for (near) singular windows
+        xtx = np.einsum('btj,btk->bjk', x, x) + 1e-8 * np.eye(p)
+        xty = np.einsum('btj,bt->bj', x, y)
+        coeffs = np.linalg.solve(xtx, xty[:, :, None])[:, :, 0]
+
+        # iterate the forecast
+        history = windows[:, n - p:][:, ::-1]  # most recent first
+        forecast = windows[:, -1]
+        for _ in range(self.steps):
+            forecast = np.sum(coeffs * history, axis=1)
+            history = np.concatenate([forecast[:, None], history[:, :-1]], axis=1)
+        return forecast
+
+    def fit_windows_mle(self, windows: np.ndarray) -> np.ndarray:
+        import statsmodels.api as sm
+
+        forecasts = np.zeros(len(windows))
+        for i, window in enumerate(windows):
+            s_model = sm.tsa.SARIMAX(window, order=(self.order, 0, 0), enforce_invertibility=False,
+                                     enforce_stationarity=False)
+            result = s_model.fit(disp=False)
+            forecasts[i] = result.forecast(self.steps)[-1]
+        return forecasts
+
+
+# ---------------------------
+
+models = {
+    'dwt': DWTModel,
+    'fft': FFTModel,
+    'fft_lowpass': FFTLowPassModel,
+    'kalman': KalmanModel,
+    'sarimax': SARIMAXModel
+}
+
+
+# create a model by name. kwargs are passed to the model constructor
+def create_model(name, **kwargs) -> SignalModel:
+    if name not in models:
+        print(f"    ERR: unknown signal model: {name}. Options are: {list(models.keys())}")
+        return None
+    return models[name](**kwargs)
+
+
+# ---------------------------
+
+# (window, degree, lookahead) -> coefficients
+extrapolation_coeffs = {}
+
+
+# returns the coefficients that, applied to a window of data (dot product), give the value of a least squares
+# polynomial fit of the window, evaluated lookahead steps past the last element
+def get_extrapolation_coeffs(window: int, degree=3, lookahead=1) -> np.ndarray:
+    key = (window, degree, lookahead)
+    if key not in extrapolation_coeffs:
+        degree = min(degree, window - 1)
+
+        # scale x to [-1, 0] (last element at 0) to keep the Vandermonde matrix well conditioned
+        scale = max(window - 1, 1)
+        x = (np.arange(window) - (window - 1)) / scale
+        vander = np.vander(x, degree + 1, increasing=True)
+        x_eval = np.vander(np.array([lookahead / scale]), degree + 1, increasing=True)
+
+        extrapolation_coeffs[key] = (x_eval @ np.linalg.pinv(vander))[0]
+    return extrapolation_coeffs[key]
+
+
+# returns an array (same length as values) with the extrapolated value for each rolling window. NaN for the first
+# (window-1) entries and for windows containing NaN values
+def extrapolate(values, window: int, degree=3, lookahead=1) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if len(values) < window:
+        return result
+
+    coeffs = get_extrapolation_coeffs(window, degree, lookahead)
+    result[window - 1:] = np.correlate(values, coeffs, mode='valid')
+    return result
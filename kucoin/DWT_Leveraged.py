@@ -29,8 +29,9 @@ import re
 
 
 import custom_indicators as cta
+import SignalModel
+import TradeState
 
-import pywt
 
 
 """
@@ -139,7 +140,12 @@ class DWT_Leveraged(IStrategy):
 
     # Strategy Specific Variable Storage
     dwt_window = startup_candle_count
-    custom_trade_info = {}
+    signal_engine = SignalModel.create_model('dwt', wavelet='haar', mode='smooth')  # vectorized rolling model
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'rmi-up-trend', 'ssl-dir', 'candle-up-trend']
+    trade_state = None
+    pair_map = {}  # pair -> (type, underlying pair). See get_pair_info()
+    underlying_cache = {}  # underlying pair -> (key, inf_slow, inf_fast). See populate_underlying()
     custom_fiat = "USDT"  # Only relevant if stake is BTC or ETH
 
     ############################################################################
@@ -150,6 +156,11 @@ class DWT_Leveraged(IStrategy):
 
     def informative_pairs(self):
         pairs = self.dp.current_whitelist()
+
+        # map each pair to its type/underlying once, rather than on every call
+        for pair in pairs:
+            self.map_pair(pair)
+
         informative_pairs = []
         infs = {}
         for pair in pairs:
@@ -172,6 +183,9 @@ class DWT_Leveraged(IStrategy):
 
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
+
         # Base pair informative timeframe indicators
         curr_pair = metadata['pair']
 
@@ -180,22 +194,7 @@ class DWT_Leveraged(IStrategy):
             inf_pair = self.getInformative(curr_pair)
             # print("pair: ", curr_pair, " inf_pair: ", inf_pair)
 
-            inf_slow = self.dp.get_pair_dataframe(pair=inf_pair, timeframe=self.inf_timeframe)
-            inf_fast = self.dp.get_pair_dataframe(pair=inf_pair, timeframe=self.timeframe)
-
-            # DWT
-
-            inf_slow['dwt_model'] = inf_slow['close'].rolling(window=self.dwt_window).apply(self.model)
-
-            # trend (in informative)
-            inf_fast['candle-up'] = np.where(inf_fast['close'] >= inf_fast['open'], 1, 0)
-            inf_fast['candle-up-trend'] = np.where(inf_fast['candle-up'].rolling(5).sum() >= 3, 1, 0)
-            inf_fast['candle-dn-trend'] = np.where(inf_fast['candle-up'].rolling(5).sum() <= 2, 1, 0)
-
-            inf_fast['sroc'] = cta.SROC(inf_fast, roclen=21, emalen=13, smooth=21)
-            inf_fast['sroc-up'] = np.where(inf_fast['sroc'] > 0.0, 1, 0)
-            inf_fast['sroc-up-trend'] = np.where(inf_fast['sroc-up'].rolling(5).sum() >= 3, 1, 0)
-            inf_fast['sroc-dn-trend'] = np.where(inf_fast['sroc-up'].rolling(5).sum() <= 2, 1, 0)
+            inf_slow, inf_fast = self.populate_underlying(inf_pair)
 
             # merge into normal timeframe
             dataframe = merge_informative_pair(dataframe, inf_slow, self.timeframe, self.inf_timeframe, ffill=True)
@@ -224,11 +223,6 @@ class DWT_Leveraged(IStrategy):
 
             # Custom Stoploss
 
-            if not metadata['pair'] in self.custom_trade_info:
-                self.custom_trade_info[metadata['pair']] = {}
-                if not 'had-trend' in self.custom_trade_info[metadata["pair"]]:
-                    self.custom_trade_info[metadata['pair']]['had-trend'] = False
-
             # MA Streak: https://www.tradingview.com/script/Yq1z7cIv-MA-Streak-Can-Show-When-a-Run-Is-Getting-Long-in-the-Tooth/
             # dataframe['mastreak'] = cta.mastreak(dataframe, period=4)
 
@@ -270,54 +264,41 @@ class DWT_Leveraged(IStrategy):
             dataframe['sroc'] = cta.SROC(dataframe, roclen=21, emalen=13, smooth=21)
             dataframe['ssl-dir'] = np.where(sslup > ssldown, 'up', 'down')
 
+        self.trade_state.update(metadata['pair'], dataframe)
+
         return dataframe
 
     ###################################
 
-    def madev(self, d, axis=None):
-        """ Mean absolute deviation of a signal """
-        return np.mean(np.absolute(d - np.mean(d, axis)), axis)
+    # calculates the indicators for the underlying (non-leveraged) pair. Several leveraged pairs (e.g. BTC3L and
+    # BTC3S) share the same underlying, so the results are cached and only re-calculated when new candles arrive
+    def populate_underlying(self, inf_pair):
+        inf_slow = self.dp.get_pair_dataframe(pair=inf_pair, timeframe=self.inf_timeframe)
+        inf_fast = self.dp.get_pair_dataframe(pair=inf_pair, timeframe=self.timeframe)
 
-    def dwtModel(self, data):
-
-        # the choice of wavelet makes a big difference
-        # for an overview, check out: https://www.kaggle.com/theoviel/denoising-with-direct-wavelet-transform
-        # wavelet = 'db1'
-        # wavelet = 'bior1.1'
-        wavelet = 'haar' # deals well with harsh transitions
-        level = 1
-        wmode = "smooth"
-        length = len(data)
-
-        coeff = pywt.wavedec(data, wavelet, mode=wmode)
-
-        # remove higher harmonics
-        sigma = (1 / 0.6745) * self.madev(coeff[-level])
-        uthresh = sigma * np.sqrt(2 * np.log(length))
-        coeff[1:] = (pywt.threshold(i, value=uthresh, mode='hard') for i in coeff[1:])
-
-        # inverse transform
-        model = pywt.waverec(coeff, wavelet, mode=wmode)
+        key = (len(inf_slow), inf_slow['date'].iloc[-1], len(inf_fast), inf_fast['date'].iloc[-1])
+        entry = self.underlying_cache.get(inf_pair, None)
+        if (entry is None) or (entry[0] != key):
+            # DWT
+            inf_slow['dwt_model'] = self.signal_engine.rolling(inf_slow['close'].to_numpy(), self.dwt_window)
 
-        return model
+            # trend (in informative)
+            inf_fast['candle-up'] = np.where(inf_fast['close'] >= inf_fast['open'], 1, 0)
+            inf_fast['candle-up-trend'] = np.where(inf_fast['candle-up'].rolling(5).sum() >= 3, 1, 0)
+            inf_fast['candle-dn-trend'] = np.where(inf_fast['candle-up'].rolling(5).sum() <= 2, 1, 0)
 
-    def model(self, a: np.ndarray) -> np.float:
-        #must return scalar, so just calculate prediction and take last value
-        # model = self.dwtModel(np.array(a))
+            inf_fast['sroc'] = cta.SROC(inf_fast, roclen=21, emalen=13, smooth=21)
+            inf_fast['sroc-up'] = np.where(inf_fast['sroc'] > 0.0, 1, 0)
+            inf_fast['sroc-up-trend'] = np.where(inf_fast['sroc-up'].rolling(5).sum() >= 3, 1, 0)
+            inf_fast['sroc-dn-trend'] = np.where(inf_fast['sroc-up'].rolling(5).sum() <= 2, 1, 0)
 
-        # de-trend the data
-        w_mean = a.mean()
-        w_std = a.std()
-        x_notrend = (a - w_mean) / w_std
+            entry = (key, inf_slow, inf_fast)
+            self.underlying_cache[inf_pair] = entry
 
-        # get DWT model of data
-        restored_sig = self.dwtModel(x_notrend)
+        return entry[1], entry[2]
 
-        # re-trend
-        model = (restored_sig * w_std) + w_mean
+    ###################################
 
-        length = len(model)
-        return model[length-1]
 
     ############################################################################
 
@@ -465,20 +446,33 @@ class DWT_Leveraged(IStrategy):
     ############################################################################
 
     def isBull(self, pair):
-        return re.search(".*(BULL|UP|[235]L)", pair)
+        return self.get_pair_info(pair)[0] == 'bull'
 
     def isBear(self, pair):
-        return re.search(".*(BEAR|DOWN|[235]S)", pair)
+        return self.get_pair_info(pair)[0] == 'bear'
 
     def getInformative(self, pair) -> str:
-        inf_pair = ""
-        if self.isBull(pair):
-            inf_pair = re.sub('(BULL|UP|[235]L)', '', pair)
-        elif self.isBear(pair):
-            inf_pair = re.sub('(BEAR|DOWN|[235]S)', '', pair)
+        return self.get_pair_info(pair)[1]
+
+    # returns (type, underlying pair) for the supplied pair, where type is 'bull', 'bear' or '' (not leveraged)
+    # The mapping is built once per pair (normally in informative_pairs()), so the regexes do not run on every call
+    def get_pair_info(self, pair):
+        info = self.pair_map.get(pair, None)
+        if info is None:
+            info = self.map_pair(pair)
+        return info
+
+    def map_pair(self, pair):
+        if re.search(".*(BULL|UP|[235]L)", pair):
+            info = ('bull', re.sub('(BULL|UP|[235]L)', '', pair))
+        elif re.search(".*(BEAR|DOWN|[235]S)", pair):
+            info = ('bear', re.sub('(BEAR|DOWN|[235]S)', '', pair))
+        else:
+            info = ('', '')
 
-        # print(pair, " -> ", inf_pair)
-        return inf_pair
+        # print(pair, " -> ", info)
+        self.pair_map[pair] = info
+        return info
 
     ############################################################################
 
@@ -491,10 +485,11 @@ class DWT_Leveraged(IStrategy):
     def custom_stoploss(self, pair: str, trade: 'Trade', current_time: datetime, current_rate: float,
                         current_profit: float, **kwargs) -> float:
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had-trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit <  self.cstop_max_stoploss.value:
@@ -524,8 +519,9 @@ class DWT_Leveraged(IStrategy):
     def custom_exit_long(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                              current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0.0, trade.calc_profit_ratio(trade.max_rate))
@@ -558,7 +554,7 @@ class DWT_Leveraged(IStrategy):
         # Don't exit if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful exit message later
-            self.custom_trade_info[trade.pair]['had-trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a exit, maybe
             if self.cexit_long_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_long_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -572,12 +568,12 @@ class DWT_Leveraged(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had-trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'long_trend_roi'
                 elif self.cexit_long_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'long_trend_noroi'
             elif current_profit > min_roi:
                 return 'long_notrend_roi'
@@ -587,8 +583,9 @@ class DWT_Leveraged(IStrategy):
     def custom_exit_short(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0.0, trade.calc_profit_ratio(trade.max_rate))
@@ -621,7 +618,7 @@ class DWT_Leveraged(IStrategy):
         # Don't exit if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful exit message later
-            self.custom_trade_info[trade.pair]['had-trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a exit, maybe
             if self.cexit_short_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_short_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -635,12 +632,12 @@ class DWT_Leveraged(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had-trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'short_trend_roi'
                 elif self.cexit_short_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'short_trend_noroi'
             elif current_profit > min_roi:
                 return 'short_notrend_roi'
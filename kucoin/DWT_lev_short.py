@@ -33,10 +33,11 @@ log = logging.getLogger(__name__)
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 
 import custom_indicators as cta
+import SignalModel
+import TradeState
 
 import re
 
-import pywt
 import scipy
 
 """
@@ -80,7 +81,10 @@ class DWT_lev_short(IStrategy):
 
     process_only_new_candles = True
 
-    custom_trade_info = {}
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'rmi-up-trend', 'ssl-dir', 'candle-up-trend']
+    trade_state = None
+    pair_map = {}  # pair -> (type, underlying pair). See get_pair_info()
 
     ###################################
 
@@ -89,6 +93,7 @@ class DWT_lev_short(IStrategy):
     ## Hyperopt Variables
 
     dwt_window = startup_candle_count
+    signal_engine = SignalModel.create_model('dwt', wavelet='haar', mode='smooth')  # vectorized rolling model
 
     # DWT  hyperparams
     entry_dwt_diff = DecimalParameter(0.0, 5.0, decimals=1, default=1.0, space='buy', load=True, optimize=True)
@@ -122,10 +127,30 @@ class DWT_lev_short(IStrategy):
     ############################################################################
 
     def isBull(self, pair):
-        return re.search(".*(BULL|UP|[235]L)", pair)
+        return self.get_pair_info(pair)[0] == 'bull'
 
     def isBear(self, pair):
-        return re.search(".*(BEAR|DOWN|[235]S)", pair)
+        return self.get_pair_info(pair)[0] == 'bear'
+
+    # returns (type, underlying pair) for the supplied pair, where type is 'bull', 'bear' or '' (not leveraged)
+    # The mapping is built once per pair (normally in informative_pairs()), so the regexes do not run on every call
+    def get_pair_info(self, pair):
+        info = self.pair_map.get(pair, None)
+        if info is None:
+            info = self.map_pair(pair)
+        return info
+
+    def map_pair(self, pair):
+        if re.search(".*(BULL|UP|[235]L)", pair):
+            info = ('bull', re.sub('(BULL|UP|[235]L)', '', pair))
+        elif re.search(".*(BEAR|DOWN|[235]S)", pair):
+            info = ('bear', re.sub('(BEAR|DOWN|[235]S)', '', pair))
+        else:
+            info = ('', '')
+
+        # print(pair, " -> ", info)
+        self.pair_map[pair] = info
+        return info
 
     ###################################
 
@@ -135,6 +160,11 @@ class DWT_lev_short(IStrategy):
 
     def informative_pairs(self):
         pairs = self.dp.current_whitelist()
+
+        # map each pair to its type/underlying once, rather than on every call
+        for pair in pairs:
+            self.map_pair(pair)
+
         informative_pairs = [(pair, self.inf_timeframe) for pair in pairs]
         return informative_pairs
 
@@ -146,6 +176,9 @@ class DWT_lev_short(IStrategy):
 
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
 
+        if self.trade_state is None:
+            self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
+
         # Base pair informative timeframe indicators
         curr_pair = metadata['pair']
 
@@ -155,7 +188,7 @@ class DWT_lev_short(IStrategy):
 
             # DWT
 
-            informative['dwt_model'] = informative['close'].rolling(window=self.dwt_window).apply(self.model)
+            informative['dwt_model'] = self.signal_engine.rolling(informative['close'].to_numpy(), self.dwt_window)
             # informative['dwt_predict'] = informative['dwt_model'].rolling(window=self.dwt_window).apply(self.predict)
             # informative['stddev'] = informative['close'].rolling(window=self.dwt_window).std()
 
@@ -173,11 +206,6 @@ class DWT_lev_short(IStrategy):
 
             # Custom Stoploss
 
-            if not metadata['pair'] in self.custom_trade_info:
-                self.custom_trade_info[metadata['pair']] = {}
-                if not 'had-trend' in self.custom_trade_info[metadata["pair"]]:
-                    self.custom_trade_info[metadata['pair']]['had-trend'] = False
-
             # RMI: https://www.tradingview.com/script/kwIt9OgQ-Relative-Momentum-Index/
             dataframe['rmi'] = cta.RMI(dataframe, length=24, mom=5)
 
@@ -199,97 +227,9 @@ class DWT_lev_short(IStrategy):
             dataframe['sroc'] = cta.SROC(dataframe, roclen=21, emalen=13, smooth=21)
             dataframe['ssl-dir'] = np.where(sslup > ssldown, 'up', 'down')
 
-        return dataframe
-
-    ###################################
-
-    def madev(self, d, axis=None):
-        """ Mean absolute deviation of a signal """
-        return np.mean(np.absolute(d - np.mean(d, axis)), axis)
-
-    def dwtModel(self, data):
-
-        # the choice of wavelet makes a big difference
-        # for an overview, check out: https://www.kaggle.com/theoviel/denoising-with-direct-wavelet-transform
-        # wavelet = 'db1'
-        # wavelet = 'bior1.1'
-        wavelet = 'haar'  # deals well with harsh transitions
-        level = 1
-        wmode = "smooth"
-        length = len(data)
-
-        coeff = pywt.wavedec(data, wavelet, mode=wmode)
-
-        # remove higher harmonics
-        sigma = (1 / 0.6745) * self.madev(coeff[-level])
-        uthresh = sigma * np.sqrt(2 * np.log(length))
-        coeff[1:] = (pywt.threshold(i, value=uthresh, mode='hard') for i in coeff[1:])
-
-        # inverse transform
-        model = pywt.waverec(coeff, wavelet, mode=wmode)
-
-        return model
-
-    def model(self, a: np.ndarray) -> np.float:
-        # must return scalar, so just calculate prediction and take last value
-        # model = self.dwtModel(np.array(a))
-
-        # de-trend the data
-        w_mean = a.mean()
-        w_std = a.std()
-        x_notrend = (a - w_mean) / w_std
+        self.trade_state.update(metadata['pair'], dataframe)
 
-        # get DWT model of data
-        restored_sig = self.dwtModel(x_notrend)
-
-        # re-trend
-        model = (restored_sig * w_std) + w_mean
-
-        length = len(model)
-        return model[length - 1]
-
-    def scaledModel(self, a: np.ndarray) -> np.float:
-        # must return scalar, so just calculate prediction and take last value
-        # model = self.dwtModel(np.array(a))
-
-        # de-trend the data
-        w_mean = a.mean()
-        w_std = a.std()
-        x_notrend = (a - w_mean) / w_std
-
-        # get DWT model of data
-        model = self.dwtModel(x_notrend)
-
-        length = len(model)
-        return model[length - 1]
-
-    def scaledData(self, a: np.ndarray) -> np.float:
-
-        # scale the data
-        standardized = a.copy()
-        w_mean = np.mean(standardized)
-        w_std = np.std(standardized)
-        scaled = (standardized - w_mean) / w_std
-        # scaled.fillna(0, inplace=True)
-
-        length = len(scaled)
-        return scaled.ravel()[length - 1]
-
-    def predict(self, a: np.ndarray) -> np.float:
-
-        # predicts the next value using polynomial extrapolation
-
-        # a.fillna(0)
-
-        # fit the supplied data
-        # Note: extrapolation is notoriously fickle. Be careful
-        length = len(a)
-        x = np.arange(length)
-        f = scipy.interpolate.UnivariateSpline(x, a, k=5)
-
-        predict = f(length)
-
-        return predict
+        return dataframe
 
     ###################################
 
@@ -372,10 +312,11 @@ class DWT_lev_short(IStrategy):
     def custom_stoploss(self, pair: str, trade: 'Trade', current_time: datetime, current_rate: float,
                         current_profit: float, **kwargs) -> float:
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
-        in_trend = self.custom_trade_info[trade.pair]['had-trend']
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
 
         # limit stoploss
         if current_profit < self.cstop_max_stoploss.value:
@@ -405,8 +346,9 @@ class DWT_lev_short(IStrategy):
     def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
 
-        dataframe, _ = self.dp.get_analyzed_dataframe(pair=pair, timeframe=self.timeframe)
-        last_candle = dataframe.iloc[-1].squeeze()
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
 
         trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
         max_profit = max(0, trade.calc_profit_ratio(trade.max_rate))
@@ -439,7 +381,7 @@ class DWT_lev_short(IStrategy):
         # Don't exit if we are in a trend unless the pullback threshold is met
         if in_trend == True and current_profit > 0:
             # Record that we were in a trend for this trade/pair for a more useful exit message later
-            self.custom_trade_info[trade.pair]['had-trend'] = True
+            self.trade_state.get_state(trade.pair).had_trend = True
             # If pullback is enabled and profit has pulled back allow a exit, maybe
             if self.cexit_pullback.value == True and (current_profit <= pullback_value):
                 if self.cexit_pullback_respect_roi.value == True and current_profit > min_roi:
@@ -453,12 +395,12 @@ class DWT_lev_short(IStrategy):
             return None
         # If we are not in a trend, just use the roi value
         elif in_trend == False:
-            if self.custom_trade_info[trade.pair]['had-trend']:
+            if self.trade_state.get_state(trade.pair).had_trend:
                 if current_profit > min_roi:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_roi'
                 elif self.cexit_endtrend_respect_roi.value == False:
-                    self.custom_trade_info[trade.pair]['had-trend'] = False
+                    self.trade_state.get_state(trade.pair).had_trend = False
                     return 'trend_noroi'
             elif current_profit > min_roi:
                 return 'notrend_roi'
@@ -20,6 +20,13 @@ from technical.indicators import RMI, zema, VIDYA, ichimoku
 import time
 import warnings
 import re
+import sys
+from pathlib import Path
+
+# Strategy specific imports, files must reside in same folder as strategy
+sys.path.append(str(Path(__file__).parent))
+
+import StageProfiler
 
 log = logging.getLogger(__name__)
 leverage_pattern = ".*(_PREMIUM|BEAR|BULL|DOWN|HALF|HEDGE|UP|[1235][SL]|-PERP|BVOL|IBVOL)/.*"
@@ -8973,6 +8980,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return False, None
 
+    @StageProfiler.profile('custom_exit')
     def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
                     current_profit: float, **kwargs):
         dataframe, _ = self.dp.get_analyzed_dataframe(pair, self.timeframe)
@@ -9124,6 +9132,7 @@ class NostalgiaForInfinityX(IStrategy):
         informative_pairs.append((btc_info_pair, self.info_timeframe_15m))
         return informative_pairs
 
+    @StageProfiler.profile('informative')
     def informative_1d_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         tik = time.perf_counter()
         assert self.dp, "DataProvider is required for multiple timeframes."
@@ -9161,6 +9170,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return informative_1d
 
+    @StageProfiler.profile('informative')
     def informative_1h_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         tik = time.perf_counter()
         assert self.dp, "DataProvider is required for multiple timeframes."
@@ -9236,6 +9246,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return informative_1h
 
+    @StageProfiler.profile('informative')
     def informative_15m_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         tik = time.perf_counter()
         assert self.dp, "DataProvider is required for multiple timeframes."
@@ -9493,6 +9504,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return dataframe
 
+    @StageProfiler.profile('informative')
     def base_tf_btc_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         tik = time.perf_counter()
         # Indicators
@@ -9509,6 +9521,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return dataframe
 
+    @StageProfiler.profile('informative')
     def info_tf_btc_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         tik = time.perf_counter()
         # Indicators
@@ -9526,6 +9539,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return dataframe
 
+    @StageProfiler.profile('informative')
     def daily_tf_btc_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         tik = time.perf_counter()
         # Indicators
@@ -9542,6 +9556,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return dataframe
 
+    @StageProfiler.profile('indicators')
     def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         tik = time.perf_counter()
         '''
@@ -9621,6 +9636,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return dataframe
 
+    @StageProfiler.profile('entry')
     def populate_entry_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         conditions = []
         dataframe.loc[:, 'buy_tag'] = ''
@@ -10558,6 +10574,7 @@ class NostalgiaForInfinityX(IStrategy):
 
         return dataframe
 
+    @StageProfiler.profile('exit')
     def populate_exit_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
         dataframe.loc[:, 'sell'] = 0
 
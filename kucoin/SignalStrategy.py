@@ -0,0 +1,466 @@
+import numpy as np
+import freqtrade.vendor.qtpylib.indicators as qtpylib
+
+from freqtrade.strategy import (IStrategy, merge_informative_pair,
+                                IntParameter, DecimalParameter, CategoricalParameter)
+
+from pandas import DataFrame, Series
+from functools import reduce
+from datetime import datetime
+from freqtrade.persistence import Trade
+
+# Get rid of pandas warnings during backtesting
+import pandas as pd
+
+pd.options.mode.chained_assignment = None  # default='warn'
+
+# Strategy specific imports, files must reside in same folder as strategy
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+
+import logging
+import warnings
+
+log = logging.getLogger(__name__)
+# log.setLevel(logging.DEBUG)
+warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
+
+import custom_indicators as cta
+import StageProfiler
+import TradeState
+import SignalModel
+
+
+"""
+####################################################################################
+SignalStrategy - base class for strategies that model the (informative) close price with a signal model
+                 (DWT, FFT, Kalman, SARIMAX etc.) and trade when the price moves away from the model
+
+    The model is calculated over a rolling window of the informative timeframe, merged into the main timeframe,
+    and entry/exit signals are generated when the % difference between model and price crosses the entry/exit
+    thresholds.
+    Subclasses can add indicators and entry/exit conditions through add_strategy_indicators(),
+    add_entry_conditions() and add_exit_conditions() (see FBBStrategy for an example)
+    Subclasses just define the model type/settings, timeframes, ROI and the entry/exit hyperopt parameters, e.g.:
+
+    class DWT(SignalStrategy):
+        signal_name = 'dwt'
+        signal_column = 'dwt_model'
+        signal_model = 'dwt'
+        entry_dwt_diff = DecimalParameter(...)
+        exit_dwt_diff = DecimalParameter(...)
+
+    The models process all windows at once (see SignalModel.py), rather than calling a Python function per candle
+####################################################################################
+"""
+
+
+class SignalStrategy(IStrategy):
+    # Do *not* hyperopt for the roi and stoploss spaces
+
+    # ROI table:
+    minimal_roi = {
+        "0": 0.1
+    }
+
+    # Stoploss:
+    stoploss = -0.10
+
+    # Trailing stop:
+    trailing_stop = False
+    trailing_stop_positive = None
+    trailing_stop_positive_offset = 0.0
+    trailing_only_offset_is_reached = False
+
+    timeframe = '5m'
+    inf_timeframe = '15m'
+
+    use_custom_stoploss = True
+
+    # Recommended
+    use_exit_signal = True
+    exit_profit_only = False
+    ignore_roi_if_entry_signal = True
+
+    # Required
+    startup_candle_count: int = 128
+
+    process_only_new_candles = True
+
+    # columns used by custom_stoploss()/custom_exit(), see TradeState
+    trade_state_columns = ['sroc', 'rmi-up-trend', 'ssl-dir', 'candle-up-trend']
+    trade_state = None
+
+    ###################################
+
+    # Strategy Specific Variable Storage
+
+    signal_name = ""  # prefix used for hyperopt parameters and tags, e.g. 'dwt' -> entry_dwt_diff, exit_dwt_diff
+    signal_column = ""  # name of the model column, e.g. 'dwt_model'. The difference is in <signal_column>_diff
+    signal_model = ""  # type of model, see SignalModel.models
+    signal_model_params = {}  # arguments passed to the model constructor
+    signal_window = 0  # rolling window size. 0 means use startup_candle_count
+    signal_model_per_pair = False  # True if the model is fitted to each pair (otherwise one model is shared)
+
+    # extrapolation of the model (local polynomial fit, see SignalModel.extrapolate()). Disabled if predict_column is ""
+    predict_column = ""  # name of the prediction column, e.g. 'dwt_predict'. The difference from the model is in <>_diff
+    predict_degree = 3  # degree of the fitted polynomial
+    predict_lookahead = 1  # number of candles (informative timeframe) to predict ahead
+
+    entry_param = ""  # name of the entry parameter, if not entry_<signal_name>_diff
+    exit_param = ""  # name of the exit parameter, if not exit_<signal_name>_diff
+    entry_tag = ""  # tag for model entries, if not <signal_name>_entry
+    exit_tag = ""  # tag for model exits, if not <signal_name>_exit
+
+    signal_diff_scale = 100.0  # scale of the difference columns. 100 gives %, 1 gives the fraction
+    signal_spike_filter = True  # ignore triggers where the difference is more than twice the threshold
+
+    model_engines = {}
+
+    ## Hyperopt Variables
+
+    # Custom exit Profit (formerly Dynamic ROI)
+    cexit_roi_type = CategoricalParameter(['static', 'decay', 'step'], default='step', space='sell', load=True,
+                                          optimize=True)
+    cexit_roi_time = IntParameter(720, 1440, default=720, space='sell', load=True, optimize=True)
+    cexit_roi_start = DecimalParameter(0.01, 0.05, default=0.01, space='sell', load=True, optimize=True)
+    cexit_roi_end = DecimalParameter(0.0, 0.01, default=0, space='sell', load=True, optimize=True)
+    cexit_trend_type = CategoricalParameter(['rmi', 'ssl', 'candle', 'any', 'none'], default='any', space='sell',
+                                            load=True, optimize=True)
+    cexit_pullback = CategoricalParameter([True, False], default=True, space='sell', load=True, optimize=True)
+    cexit_pullback_amount = DecimalParameter(0.005, 0.03, default=0.01, space='sell', load=True, optimize=True)
+    cexit_pullback_respect_roi = CategoricalParameter([True, False], default=False, space='sell', load=True,
+                                                      optimize=True)
+    cexit_endtrend_respect_roi = CategoricalParameter([True, False], default=False, space='sell', load=True,
+                                                      optimize=True)
+
+    # Custom Stoploss
+    cstop_loss_threshold = DecimalParameter(-0.05, -0.01, default=-0.03, space='sell', load=True, optimize=True)
+    cstop_bail_how = CategoricalParameter(['roc', 'time', 'any', 'none'], default='none', space='sell', load=True,
+                                          optimize=True)
+    cstop_bail_roc = DecimalParameter(-5.0, -1.0, default=-3.0, space='sell', load=True, optimize=True)
+    cstop_bail_time = IntParameter(60, 1440, default=720, space='sell', load=True, optimize=True)
+    cstop_bail_time_trend = CategoricalParameter([True, False], default=True, space='sell', load=True, optimize=True)
+    cstop_max_stoploss = DecimalParameter(-0.30, -0.01, default=-0.10, space='sell', load=True, optimize=True)
+
+    ###################################
+
+    def __init__(self, config: dict) -> None:
+        super().__init__(config)
+
+        # per-instance, so that strategies loaded in the same process do not share state
+        self.trade_state = TradeState.TradeStateStore(self.trade_state_columns)
+        self.model_engines = {}
+
+    ###################################
+
+    """
+    Informative Pair Definitions
+    """
+
+    def informative_pairs(self):
+        pairs = self.dp.current_whitelist()
+        informative_pairs = [(pair, self.inf_timeframe) for pair in pairs]
+        return informative_pairs
+
+    ###################################
+
+    """
+    Model Definitions
+    """
+
+    def get_model_engine(self, pair) -> SignalModel.SignalModel:
+        key = pair if self.signal_model_per_pair else ''
+        if key not in self.model_engines:
+            self.model_engines[key] = SignalModel.create_model(self.signal_model, **self.signal_model_params)
+        return self.model_engines[key]
+
+    def get_window(self) -> int:
+        return self.signal_window if self.signal_window > 0 else self.startup_candle_count
+
+    # returns the model value for each row (rolling window over the supplied prices)
+    def get_model(self, pair, prices: Series) -> np.ndarray:
+        return self.get_model_engine(pair).rolling(prices.to_numpy(), self.get_window())
+
+    # returns the extrapolated model value for each row
+    def get_prediction(self, model) -> np.ndarray:
+        return SignalModel.extrapolate(model, self.get_window(), self.predict_degree, self.predict_lookahead)
+
+    def get_entry_diff(self) -> float:
+        name = self.entry_param if len(self.entry_param) > 0 else f"entry_{self.signal_name}_diff"
+        return getattr(self, name).value
+
+    def get_exit_diff(self) -> float:
+        name = self.exit_param if len(self.exit_param) > 0 else f"exit_{self.signal_name}_diff"
+        return getattr(self, name).value
+
+    def get_entry_tag(self) -> str:
+        return self.entry_tag if len(self.entry_tag) > 0 else f"{self.signal_name}_entry"
+
+    def get_exit_tag(self) -> str:
+        return self.exit_tag if len(self.exit_tag) > 0 else f"{self.signal_name}_exit"
+
+    ###################################
+
+    """
+    Indicator Definitions
+    """
+
+    @StageProfiler.profile('indicators')
+    def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
+
+        # Base pair informative timeframe indicators
+        curr_pair = metadata['pair']
+        informative = self.dp.get_pair_dataframe(pair=curr_pair, timeframe=self.inf_timeframe)
+
+        # Model
+        informative[self.signal_column] = self.get_model(curr_pair, informative['close'])
+        if len(self.predict_column) > 0:
+            informative[self.predict_column] = self.get_prediction(informative[self.signal_column].to_numpy())
+
+        # merge into normal timeframe
+        dataframe = merge_informative_pair(dataframe, informative, self.timeframe, self.inf_timeframe, ffill=True)
+
+        # calculate predictive indicators in shorter timeframe (not informative)
+        col = self.signal_column
+        dataframe[col] = dataframe[f"{col}_{self.inf_timeframe}"]
+        dataframe[f"{col}_diff"] = self.signal_diff_scale * (dataframe[col] - dataframe['close']) / dataframe['close']
+
+        if len(self.predict_column) > 0:
+            pcol = self.predict_column
+            dataframe[pcol] = dataframe[f"{pcol}_{self.inf_timeframe}"]
+            dataframe[f"{pcol}_diff"] = self.signal_diff_scale * (dataframe[pcol] - dataframe[col]) / dataframe[col]
+
+        # indicators used by subclass entry/exit conditions
+        dataframe = self.add_strategy_indicators(dataframe)
+
+        # Custom Stoploss
+        dataframe = self.add_trend_indicators(dataframe)
+        self.trade_state.update(curr_pair, dataframe)
+
+        return dataframe
+
+    # indicators used by the entry/exit conditions of subclasses (see add_entry_conditions/add_exit_conditions)
+    def add_strategy_indicators(self, dataframe: DataFrame) -> DataFrame:
+        return dataframe
+
+    # indicators used by custom_exit() and custom_stoploss()
+    def add_trend_indicators(self, dataframe: DataFrame) -> DataFrame:
+
+        # RMI: https://www.tradingview.com/script/kwIt9OgQ-Relative-Momentum-Index/
+        dataframe['rmi'] = cta.RMI(dataframe, length=24, mom=5)
+
+        # MA Streak: https://www.tradingview.com/script/Yq1z7cIv-MA-Streak-Can-Show-When-a-Run-Is-Getting-Long-in-the-Tooth/
+        dataframe['mastreak'] = cta.mastreak(dataframe, period=4)
+
+        # Trends, Peaks and Crosses
+        dataframe['candle-up'] = np.where(dataframe['close'] >= dataframe['open'], 1, 0)
+        dataframe['candle-up-trend'] = np.where(dataframe['candle-up'].rolling(5).sum() >= 3, 1, 0)
+
+        dataframe['rmi-up'] = np.where(dataframe['rmi'] >= dataframe['rmi'].shift(), 1, 0)
+        dataframe['rmi-up-trend'] = np.where(dataframe['rmi-up'].rolling(5).sum() >= 3, 1, 0)
+
+        dataframe['rmi-dn'] = np.where(dataframe['rmi'] <= dataframe['rmi'].shift(), 1, 0)
+        dataframe['rmi-dn-count'] = dataframe['rmi-dn'].rolling(8).sum()
+
+        # Indicators used only for ROI and Custom Stoploss
+        ssldown, sslup = cta.SSLChannels_ATR(dataframe, length=21)
+        dataframe['sroc'] = cta.SROC(dataframe, roclen=21, emalen=13, smooth=21)
+        dataframe['ssl-dir'] = np.where(sslup > ssldown, 'up', 'down')
+
+        return dataframe
+
+    ###################################
+
+    """
+    entry Signal
+    """
+
+    @StageProfiler.profile('entry')
+    def populate_entry_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
+        conditions = []
+        dataframe.loc[:, 'enter_tag'] = ''
+
+        diff_col = f"{self.signal_column}_diff"
+        entry_diff = self.get_entry_diff()
+
+        # model triggers
+        model_cond = (
+            qtpylib.crossed_above(dataframe[diff_col], entry_diff)
+        )
+
+        conditions.append(model_cond)
+
+        # Models will spike on big gains, so try to constrain
+        if self.signal_spike_filter:
+            spike_cond = (
+                    dataframe[diff_col] < 2.0 * entry_diff
+            )
+            conditions.append(spike_cond)
+
+        # set entry tags
+        dataframe.loc[model_cond, 'enter_tag'] += f"{self.get_entry_tag()} "
+
+        # subclass conditions
+        self.add_entry_conditions(dataframe, conditions)
+
+        if conditions:
+            dataframe.loc[reduce(lambda x, y: x & y, conditions), 'enter_long'] = 1
+
+        return dataframe
+
+    ###################################
+
+    """
+    exit Signal
+    """
+
+    @StageProfiler.profile('exit')
+    def populate_exit_trend(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
+        conditions = []
+        dataframe.loc[:, 'exit_tag'] = ''
+
+        diff_col = f"{self.signal_column}_diff"
+        exit_diff = self.get_exit_diff()
+
+        # model triggers
+        model_cond = (
+            qtpylib.crossed_below(dataframe[diff_col], exit_diff)
+        )
+
+        conditions.append(model_cond)
+
+        # Models will spike on big gains, so try to constrain
+        if self.signal_spike_filter:
+            spike_cond = (
+                    dataframe[diff_col] > 2.0 * exit_diff
+            )
+            conditions.append(spike_cond)
+
+        # subclass conditions
+        self.add_exit_conditions(dataframe, conditions)
+
+        # set exit tags
+        dataframe.loc[model_cond, 'exit_tag'] += f"{self.get_exit_tag()} "
+
+        if conditions:
+            dataframe.loc[reduce(lambda x, y: x & y, conditions), 'exit_long'] = 1
+
+        return dataframe
+
+    ###################################
+
+    # additional entry/exit conditions. Subclasses append their conditions (which are and-ed with the model trigger)
+    # and set their tags
+    def add_entry_conditions(self, dataframe: DataFrame, conditions: list):
+        return
+
+    def add_exit_conditions(self, dataframe: DataFrame, conditions: list):
+        return
+
+    ###################################
+
+    """
+    Custom Stoploss
+    """
+
+    def custom_stoploss(self, pair: str, trade: 'Trade', current_time: datetime, current_rate: float,
+                        current_profit: float, **kwargs) -> float:
+
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return 1
+        trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
+        in_trend = self.trade_state.get_state(trade.pair).had_trend
+
+        # limit stoploss
+        if current_profit < self.cstop_max_stoploss.value:
+            return 0.01
+
+        # Determine how we exit when we are in a loss
+        if current_profit < self.cstop_loss_threshold.value:
+            if self.cstop_bail_how.value == 'roc' or self.cstop_bail_how.value == 'any':
+                # Dynamic bailout based on rate of change
+                if last_candle['sroc'] <= self.cstop_bail_roc.value:
+                    return 0.01
+            if self.cstop_bail_how.value == 'time' or self.cstop_bail_how.value == 'any':
+                # Dynamic bailout based on time, unless time_trend is true and there is a potential reversal
+                if trade_dur > self.cstop_bail_time.value:
+                    if self.cstop_bail_time_trend.value == True and in_trend == True:
+                        return 1
+                    else:
+                        return 0.01
+        return 1
+
+    ###################################
+
+    """
+    Custom exit
+    """
+
+    @StageProfiler.profile('custom_exit')
+    def custom_exit(self, pair: str, trade: 'Trade', current_time: 'datetime', current_rate: float,
+                    current_profit: float, **kwargs):
+
+        last_candle = self.trade_state.get_candle(pair, current_time)
+        if last_candle is None:
+            return None
+
+        trade_dur = int((current_time.timestamp() - trade.open_date_utc.timestamp()) // 60)
+        max_profit = max(0, trade.calc_profit_ratio(trade.max_rate))
+        pullback_value = max(0, (max_profit - self.cexit_pullback_amount.value))
+        in_trend = False
+
+        # Determine our current ROI point based on the defined type
+        if self.cexit_roi_type.value == 'static':
+            min_roi = self.cexit_roi_start.value
+        elif self.cexit_roi_type.value == 'decay':
+            min_roi = cta.linear_decay(self.cexit_roi_start.value, self.cexit_roi_end.value, 0,
+                                       self.cexit_roi_time.value, trade_dur)
+        elif self.cexit_roi_type.value == 'step':
+            if trade_dur < self.cexit_roi_time.value:
+                min_roi = self.cexit_roi_start.value
+            else:
+                min_roi = self.cexit_roi_end.value
+
+        # Determine if there is a trend
+        if self.cexit_trend_type.value == 'rmi' or self.cexit_trend_type.value == 'any':
+            if last_candle['rmi-up-trend'] == 1:
+                in_trend = True
+        if self.cexit_trend_type.value == 'ssl' or self.cexit_trend_type.value == 'any':
+            if last_candle['ssl-dir'] == 'up':
+                in_trend = True
+        if self.cexit_trend_type.value == 'candle' or self.cexit_trend_type.value == 'any':
+            if last_candle['candle-up-trend'] == 1:
+                in_trend = True
+
+        # Don't exit if we are in a trend unless the pullback threshold is met
+        if in_trend == True and current_profit > 0:
+            # Record that we were in a trend for this trade/pair for a more useful exit message later
+            self.trade_state.get_state(trade.pair).had_trend = True
+            # If pullback is enabled and profit has pulled back allow a exit, maybe
+            if self.cexit_pullback.value == True and (current_profit <= pullback_value):
+                if self.cexit_pullback_respect_roi.value == True and current_profit > min_roi:
+                    return 'intrend_pullback_roi'
+                elif self.cexit_pullback_respect_roi.value == False:
+                    if current_profit > min_roi:
+                        return 'intrend_pullback_roi'
+                    else:
+                        return 'intrend_pullback_noroi'
+            # We are in a trend and pullback is disabled or has not happened or various criteria were not met, hold
+            return None
+        # If we are not in a trend, just use the roi value
+        elif in_trend == False:
+            if self.trade_state.get_state(trade.pair).had_trend:
+                if current_profit > min_roi:
+                    self.trade_state.get_state(trade.pair).had_trend = False
+                    return 'trend_roi'
+                elif self.cexit_endtrend_respect_roi.value == False:
+                    self.trade_state.get_state(trade.pair).had_trend = False
+                    return 'trend_noroi'
+            elif current_profit > min_roi:
+                return 'notrend_roi'
+        else:
+            return None
@@ -0,0 +1,254 @@
+# Low overhead, per-stage profiling for strategies
+#
+# Records the wall time, CPU time and (optionally) memory allocated by each stage of a strategy (indicators,
+# informative merge, training, prediction, entry/exit, custom_exit...), aggregated per pair and per stage.
+# The results are written as JSON and CSV reports when the process exits (i.e. at the end of a backtest), and can also
+# be printed/saved at any time.
+#
+# Profiling is controlled by the STRATEGY_PROFILE environment variable, which is read when this module is imported:
+#    STRATEGY_PROFILE=1        time profiling (wall and CPU time)
+#    STRATEGY_PROFILE=memory   time and memory profiling (uses tracemalloc, so is much slower)
+# and the reports go to the directory in STRATEGY_PROFILE_DIR (default: the 'profiles' folder next to this file).
+#
+# If profiling is not enabled when a method is decorated, the decorator returns the original method, so there is no
+# overhead at all. stage() returns a shared, empty context manager when disabled.
+#
+# Usage:
+#    import StageProfiler
+#
+#    @StageProfiler.profile('indicators')
+#    def populate_indicators(self, dataframe: DataFrame, metadata: dict) -> DataFrame:
+#        ...
+#        with StageProfiler.stage('informative', metadata['pair']):
+#            ...
+#
+#    STRATEGY_PROFILE=1 freqtrade backtesting --strategy PCA_dwt ...
+#
+# The pair is taken from the 'metadata' dict, or the 'pair' argument of the decorated method (see get_pair()).
+# Times for nested stages are included in the enclosing stage.
+
+import atexit
+import contextlib
+import csv
+import functools
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+enabled = False
+track_memory = False
+report_dir = ""
+
+# (pair, stage) -> {'count', 'wall', 'cpu', 'alloc', 'peak'}
+stats = {}
+
+depth = 0  # current nesting level of stages (the peak memory is only tracked for the outermost stage)
+report_registered = False
+
+null_context = contextlib.nullcontext()
+
+
+# turn on profiling. Only affects methods decorated after this call (and all stage() calls)
+def enable(memory=False, directory=""):
+    global enabled, track_memory, report_dir, report_registered
+
+    enabled = True
+    track_memory = memory
+    report_dir = directory if len(directory) > 0 else str(Path(__file__).parent / "profiles")
+
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    if not report_registered:
+        atexit.register(save_report)
+        report_registered = True
+
+
+def disable():
+    global enabled
+
+    enabled = False
+    if track_memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def reset():
+    stats.clear()
+
+
+# ---------------------------
+
+# returns the pair for a call of a decorated method: the 'pair' in the metadata dict, a 'pair' argument, or the first
+# string argument that looks like a pair (e.g. 'BTC/USD')
+def get_pair(args, kwargs) -> str:
+    if 'metadata' in kwargs:
+        return kwargs['metadata'].get('pair', '')
+    for key in ('pair', 'curr_pair'):
+        if key in kwargs:
+            return kwargs[key]
+
+    for arg in args:
+        if isinstance(arg, dict) and ('pair' in arg):
+            return arg['pair']
+        if isinstance(arg, str) and ('/' in arg):
+            return arg
+    return ''
+
+
+def record(pair, stage_name, wall, cpu, alloc, peak):
+    key = (pair, stage_name)
+    entry = stats.get(key, None)
+    if entry is None:
+        entry = {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'alloc': 0, 'peak': 0}
+        stats[key] = entry
+
+    entry['count'] += 1
+    entry['wall'] += wall
+    entry['cpu'] += cpu
+    entry['alloc'] += alloc
+    entry['peak'] = max(entry['peak'], peak)
+
+
+@contextlib.contextmanager
+def measure(stage_name, pair):
+    global depth
+
+    mem_start = 0
+    if track_memory:
+        if depth == 0:
+            tracemalloc.reset_peak()
+        mem_start = tracemalloc.get_traced_memory()[0]
+
+    depth += 1
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        depth -= 1
+
+        alloc = 0
+        peak = 0
+        if track_memory:
+            current, peak_mem = tracemalloc.get_traced_memory()
+            alloc = current - mem_start
+            if depth == 0:
+                peak = peak_mem - mem_start
+
+        record(pair, stage_name, wall, cpu, alloc, peak)
+
+
+# context manager for profiling a block of code
+def stage(stage_name, pair=''):
+    if not enabled:
+        return null_context
+    return measure(stage_name, pair)
+
+
+# decorator for profiling a (strategy) method
+def profile(stage_name):
+    def decorator(func):
+        if not enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(stage_name, get_pair(args, kwargs)):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# ---------------------------
+
+# returns the stats as a list of dicts, sorted by pair and stage
+def get_rows() -> list:
+    rows = []
+    for (pair, stage_name), entry in sorted(stats.items()):
+        rows.append({
+            'pair': pair,
+            'stage': stage_name,
+            'count': entry['count'],
+            'wall_secs': round(entry['wall'], 6),
+            'cpu_secs': round(entry['cpu'], 6),
+            'avg_wall_ms': round(1000.0 * entry['wall'] / max(entry['count'], 1), 3),
+            'alloc_bytes': entry['alloc'],
+            'peak_bytes': entry['peak']
+        })
+    return rows
+
+
+# returns the totals for each stage (all pairs combined)
+def get_stage_totals() -> dict:
+    totals = {}
+    for (pair, stage_name), entry in stats.items():
+        total = totals.setdefault(stage_name, {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'alloc': 0, 'peak': 0})
+        total['count'] += entry['count']
+        total['wall'] += entry['wall']
+        total['cpu'] += entry['cpu']
+        total['alloc'] += entry['alloc']
+        total['peak'] = max(total['peak'], entry['peak'])
+    return totals
+
+
+def print_stats():
+    totals = get_stage_totals()
+    if len(totals) == 0:
+        return
+
+    print("")
+    print(f"    {'stage':<16s} {'calls':>8s} {'wall(s)':>10s} {'cpu(s)':>10s} {'alloc(KB)':>12s} {'peak(KB)':>12s}")
+    for stage_name, total in sorted(totals.items(), key=lambda item: -item[1]['wall']):
+        print(f"    {stage_name:<16s} {total['count']:>8d} {total['wall']:>10.3f} {total['cpu']:>10.3f} "
+              f"{total['alloc'] / 1024:>12.0f} {total['peak'] / 1024:>12.0f}")
+
+
+# write the stats to <report_dir>/profile_<timestamp>.json and .csv
+def save_report(name=""):
+    if len(stats) == 0:
+        return
+
+    if len(name) == 0:
+        name = "profile_" + datetime.now().strftime("%Y%m%d_%H%M%S") + f"_{os.getpid()}"
+
+    directory = report_dir if len(report_dir) > 0 else str(Path(__file__).parent / "profiles")
+    os.makedirs(directory, exist_ok=True)
+
+    rows = get_rows()
+    report = {
+        'created': datetime.now().isoformat(),
+        'memory_tracked': track_memory,
+        'stages': {stage_name: {'count': total['count'], 'wall_secs': round(total['wall'], 6),
+                                'cpu_secs': round(total['cpu'], 6), 'alloc_bytes': total['alloc'],
+                                'peak_bytes': total['peak']}
+                   for stage_name, total in get_stage_totals().items()},
+        'pairs': rows
+    }
+
+    json_path = os.path.join(directory, name + ".json")
+    with open(json_path, "w") as f:
+        json.dump(report, f, indent=2)
+
+    csv_path = os.path.join(directory, name + ".csv")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+    print_stats()
+    print(f"    Profile saved to: {json_path}")
+
+
+# ---------------------------
+
+# enable from the environment, so that decorators are active when strategies are loaded
+mode = os.environ.get('STRATEGY_PROFILE', '').strip().lower()
+if mode not in ('', '0', 'false', 'off'):
+    enable(memory=(mode in ('memory', 'mem')), directory=os.environ.get('STRATEGY_PROFILE_DIR', ''))
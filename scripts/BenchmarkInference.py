@@ -0,0 +1,124 @@
+# Compares the per-call prediction latency of the Darts path with the exported (TorchScript/ONNX) CPU inference path
+#
+# A Darts model is trained briefly on synthetic data, exported with InferenceRunner, and then ClassifierDarts.predict()
+# is timed with and without the exported model (use_exported_model). The outputs of the exported and the Darts network
+# are compared on the training sample (as in ClassifierDarts.export_model()), and the predictions of both paths are
+# compared, to check that the exported model gives the same results.
+#
+# Usage (from the repository root, with darts/torch installed):
+#    python scripts/BenchmarkInference.py
+#    python scripts/BenchmarkInference.py --model NHiTS --calls 50 --threads 1 2 4 --format onnx
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from darts import TimeSeries
+from darts.dataprocessing.transformers import Scaler
+from darts.models import BlockRNNModel, NBEATSModel, NHiTSModel, NLinearModel
+from sklearn.preprocessing import MinMaxScaler
+
+repo_dir = Path(__file__).parent.parent
+sys.path.append(str(repo_dir / 'binanceus'))
+
+import InferenceRunner
+from ClassifierDarts import ClassifierDarts
+
+model_types = {
+    'NBEATS': NBEATSModel,
+    'NHiTS': NHiTSModel,
+    'NLinear': NLinearModel,
+    'BlockRNN': BlockRNNModel
+}
+
+
+# ---------------------------
+
+# returns a synthetic dataframe: close price (random walk) plus random 'indicator' columns
+def generate_data(nrows, nfeatures, seed=0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.standard_normal((nrows, nfeatures - 1)), columns=[f'f{i}' for i in range(nfeatures - 1)])
+    df['close'] = 100.0 * np.exp(np.cumsum(0.002 * rng.standard_normal(nrows)))
+    df['date'] = pd.date_range('2022-01-01', periods=nrows, freq='5min')
+    return df
+
+
+# train a model on the data (few epochs, this is only for timing)
+def train_model(model_type, df, lookback, lookahead, epochs):
+    df_scaler = Scaler(MinMaxScaler())
+    price_scaler = Scaler(MinMaxScaler())
+    covariates = df_scaler.fit_transform(TimeSeries.from_dataframe(df, time_col='date').astype(np.float32))
+    target = price_scaler.fit_transform(
+        TimeSeries.from_dataframe(df, time_col='date', value_cols='close').astype(np.float32))
+
+    model = model_types[model_type](input_chunk_length=lookback, output_chunk_length=lookahead, n_epochs=epochs,
+                                    pl_trainer_kwargs={'accelerator': 'cpu', 'enable_progress_bar': False})
+    model.fit(target, past_covariates=covariates, verbose=False)
+    return model
+
+
+# returns the average time (secs) per call, and the last prediction
+def time_predict(classifier, df, num_calls):
+    preds = classifier.predict(df)  # warm up
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        preds = classifier.predict(df)
+    return (time.perf_counter() - start) / num_calls, preds
+
+
+# ---------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Darts vs exported CPU inference')
+    parser.add_argument('--model', default='NBEATS', choices=list(model_types.keys()))
+    parser.add_argument('--rows', type=int, default=2000, help='rows in the training data')
+    parser.add_argument('--window', type=int, default=512, help='rows in each prediction dataframe')
+    parser.add_argument('--features', type=int, default=32)
+    parser.add_argument('--lookback', type=int, default=32)
+    parser.add_argument('--lookahead', type=int, default=6)
+    parser.add_argument('--epochs', type=int, default=2)
+    parser.add_argument('--calls', type=int, default=20, help='number of timed calls per path')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1], help='intra-op threads for the exported model')
+    parser.add_argument('--format', default='torchscript', choices=['torchscript', 'onnx'])
+    args = parser.parse_args()
+
+    df = generate_data(args.rows, args.features)
+    print(f"Training {args.model} ({args.rows} rows, {args.features} features)...")
+    model = train_model(args.model, df, args.lookback, args.lookahead, args.epochs)
+
+    classifier = ClassifierDarts('BTC/USD', args.lookback, args.features, use_gpu=False)
+    classifier.set_lookahead(args.lookahead)
+    classifier.model = model
+    classifier.train_cols = df.columns.values
+
+    df_predict = df.iloc[-args.window:]
+
+    classifier.use_exported_model = False
+    darts_time, darts_preds = time_predict(classifier, df_predict, args.calls)
+    print(f"    Darts:            {1000.0 * darts_time:8.2f} ms/call")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = tmp_dir + '/model' + InferenceRunner.get_extension(args.format)
+        if not InferenceRunner.export_darts_model(model, path, args.format, num_features=args.features):
+            print("    ERR: model could not be exported")
+            return
+
+        runner = InferenceRunner.load(path)
+        diff = InferenceRunner.compare_darts_model(model, runner, num_features=args.features)
+        print(f"    network max diff (train sample): {diff:.2e}  tolerance:{classifier.export_tolerance:.0e}")
+
+        classifier.use_exported_model = True
+        for threads in args.threads:
+            classifier.runner = InferenceRunner.load(path, num_threads=threads)
+            runner_time, runner_preds = time_predict(classifier, df_predict, args.calls)
+            diff = np.max(np.abs(np.asarray(runner_preds, dtype=float) - np.asarray(darts_preds, dtype=float)))
+            print(f"    Exported ({threads} thr): {1000.0 * runner_time:8.2f} ms/call  "
+                  f"speedup:{darts_time / runner_time:6.1f}x  max diff:{diff:.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+# Benchmarks the dataframe hot paths of strategies, using synthetic candle data
+#
+# Each strategy is loaded from its exchange folder and run (without freqtrade's exchange/backtesting machinery) over
+# deterministic synthetic OHLCV data for N pairs x M candles:
+#   - candles are a random walk with regime changes (trend up/down, ranging, high volatility), seeded from the pair
+#     name, so every run (and every machine) sees exactly the same data
+#   - a stub DataProvider supplies the run mode, the whitelist and candles for any (informative) pair/timeframe
+#   - populate_indicators(), populate_entry_trend() and populate_exit_trend() are called for each pair, and the
+#     throughput (candles/sec) of each stage and the peak memory (tracemalloc) are recorded per strategy
+#
+# Results are saved as JSON (scripts/benchmarks/<name>.json). A run can be saved as a baseline, and later runs
+# compared against it; regressions larger than the tolerance are flagged and give a non-zero exit code.
+#
+# Usage (from the repository root, with freqtrade installed):
+#    python scripts/BenchmarkStrategies.py --exchange binance --strategies DWT FFT Kalman --save-baseline main
+#    python scripts/BenchmarkStrategies.py --exchange binance --strategies DWT FFT Kalman --compare main
+#
+# If no strategies are specified, a default set is used for the exchange (see default_strategies)
+
+import argparse
+import importlib.util
+import json
+import sys
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from freqtrade.enums import RunMode
+
+repo_dir = Path(__file__).parent.parent
+benchmark_dir = Path(__file__).parent / 'benchmarks'
+
+default_strategies = {
+    'binance': ['DWT', 'FFT', 'Kalman', 'NostalgiaForInfinityX'],
+    'binanceus': ['PCA_dwt', 'NNBC_nseq', 'Anomaly_dwt'],
+    'ftx': ['DWT', 'FFT', 'Kalman'],
+    'kucoin': ['DWT', 'FFT', 'Kalman', 'DWT_Leveraged']
+}
+
+default_pairs = ['BTC/USD', 'ETH/USD', 'SOL/USD', 'ADA/USD', 'XRP/USD', 'DOT/USD', 'LINK/USD', 'AVAX/USD']
+
+# regimes used for the synthetic data: (drift, volatility) of the per-candle log returns
+regimes = [
+    (0.0002, 0.004),  # uptrend
+    (-0.0002, 0.004),  # downtrend
+    (0.0, 0.002),  # ranging
+    (0.0, 0.010)  # high volatility
+]
+
+
+def timeframe_to_minutes(timeframe) -> int:
+    units = {'m': 1, 'h': 60, 'd': 1440, 'w': 10080}
+    return int(timeframe[:-1]) * units[timeframe[-1]]
+
+
+# ---------------------------
+
+# returns deterministic, synthetic OHLCV data for the pair. The end date is fixed so that informative timeframes line
+# up with the main timeframe
+def generate_ohlcv(pair, timeframe, ncandles, seed=0) -> pd.DataFrame:
+    rng = np.random.default_rng(zlib.crc32(f"{pair}:{seed}".encode()))
+
+    # regime changes at random intervals
+    drift = np.zeros(ncandles)
+    vol = np.zeros(ncandles)
+    start = 0
+    while start < ncandles:
+        length = int(rng.integers(200, 2000))
+        d, v = regimes[int(rng.integers(0, len(regimes)))]
+        drift[start:start + length] = d
+        vol[start:start + length] = v
+        start += length
+
+    returns = drift + vol * rng.standard_normal(ncandles)
+    base_price = 10.0 ** rng.uniform(-1, 4)
+    close = base_price * np.exp(np.cumsum(returns))
+    open_price = np.concatenate(([base_price], close[:-1]))
+
+    spread = np.abs(vol * rng.standard_normal(ncandles)) * close
+    high = np.maximum(open_price, close) + spread
+    low = np.maximum(np.minimum(open_price, close) - spread, 1e-8)
+    volume = rng.lognormal(mean=10.0, sigma=1.0, size=ncandles) * (1.0 + 50.0 * vol)
+
+    end = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    dates = pd.date_range(end=end, periods=ncandles, freq=f"{timeframe_to_minutes(timeframe)}min")
+
+    return pd.DataFrame({'date': dates, 'open': open_price, 'high': high, 'low': low, 'close': close, 'volume': volume})
+
+
+# minimal DataProvider, with no exchange behind it
+class StubDataProvider():
+    runmode = RunMode.BACKTEST
+
+    def __init__(self, pairs, timeframe, ncandles, seed=0):
+        self.pairs = pairs
+        self.timeframe = timeframe
+        self.ncandles = ncandles
+        self.seed = seed
+        self.cache = {}
+
+    def current_whitelist(self):
+        return list(self.pairs)
+
+    # candles for any pair/timeframe, covering the same date range as the main timeframe. Longer timeframes are
+    # resampled from the main timeframe, so that prices are consistent across timeframes
+    def get_pair_dataframe(self, pair, timeframe=None, candle_type=''):
+        timeframe = timeframe or self.timeframe
+        key = (pair, timeframe)
+        if key not in self.cache:
+            tf_mins = timeframe_to_minutes(timeframe)
+            base_mins = timeframe_to_minutes(self.timeframe)
+            if tf_mins == base_mins:
+                self.cache[key] = generate_ohlcv(pair, timeframe, self.ncandles, self.seed)
+            elif tf_mins > base_mins:
+                self.cache[key] = self.resample(self.get_pair_dataframe(pair, self.timeframe), tf_mins)
+            else:
+                ncandles = int(self.ncandles * base_mins / tf_mins)
+                self.cache[key] = generate_ohlcv(pair, timeframe, ncandles, self.seed)
+        return self.cache[key].copy()
+
+    def resample(self, dataframe: pd.DataFrame, minutes) -> pd.DataFrame:
+        resampled = dataframe.resample(f"{minutes}min", on='date', label='left', closed='left').agg(
+            {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum'})
+        return resampled.dropna().reset_index()
+
+    def historic_ohlcv(self, pair, timeframe=None, candle_type=''):
+        return self.get_pair_dataframe(pair, timeframe)
+
+    def get_analyzed_dataframe(self, pair, timeframe):
+        return self.get_pair_dataframe(pair, timeframe), datetime.now(timezone.utc)
+
+
+# ---------------------------
+
+def load_strategy(exchange, name, timeframe, pairs):
+    strat_dir = repo_dir / exchange
+    if str(strat_dir) not in sys.path:
+        sys.path.insert(0, str(strat_dir))
+
+    spec = importlib.util.spec_from_file_location(name, strat_dir / f"{name}.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+
+    config = {
+        'strategy': name,
+        'timeframe': timeframe,
+        'stake_currency': pairs[0].split('/')[1],
+        'dry_run': True,
+        'runmode': RunMode.BACKTEST,
+        'exchange': {'name': exchange, 'pair_whitelist': pairs},
+        'user_data_dir': repo_dir / 'user_data'  # a Path, as in the freqtrade config
+    }
+    strategy = getattr(module, name)(config)
+    if hasattr(strategy, 'timeframe') and strategy.timeframe:
+        timeframe = strategy.timeframe
+    return strategy, timeframe
+
+
+def run_stage(func, dataframe, pair):
+    start = time.perf_counter()
+    result = func(dataframe, {'pair': pair})
+    return result, time.perf_counter() - start
+
+
+# run a single strategy over all pairs. Returns a dict of results
+def benchmark_strategy(exchange, name, pairs, ncandles, timeframe, seed, track_memory):
+    strategy, timeframe = load_strategy(exchange, name, timeframe, pairs)
+    strategy.dp = StubDataProvider(pairs, timeframe, ncandles, seed)
+
+    # measure the per-pair path (no parallel pre-computation)
+    if hasattr(strategy, 'parallel_precompute'):
+        strategy.parallel_precompute = False
+    if hasattr(strategy, 'bot_start'):
+        strategy.bot_start()
+
+    times = {'indicators': 0.0, 'entry': 0.0, 'exit': 0.0}
+
+    if track_memory:
+        tracemalloc.start()
+
+    for pair in pairs:
+        dataframe = strategy.dp.get_pair_dataframe(pair, timeframe)
+        dataframe, t = run_stage(strategy.populate_indicators, dataframe, pair)
+        times['indicators'] += t
+        dataframe, t = run_stage(strategy.populate_entry_trend, dataframe, pair)
+        times['entry'] += t
+        dataframe, t = run_stage(strategy.populate_exit_trend, dataframe, pair)
+        times['exit'] += t
+
+    peak = 0
+    if track_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    total_candles = ncandles * len(pairs)
+    total_time = sum(times.values())
+    result = {
+        'candles': total_candles,
+        'total_secs': round(total_time, 4),
+        'candles_per_sec': round(total_candles / max(total_time, 1e-9), 1),
+        'peak_mb': round(peak / (1024 * 1024), 2)
+    }
+    for stage, t in times.items():
+        result[f"{stage}_secs"] = round(t, 4)
+        result[f"{stage}_candles_per_sec"] = round(total_candles / max(t, 1e-9), 1)
+    return result
+
+
+# ---------------------------
+
+def save_results(results, name):
+    benchmark_dir.mkdir(parents=True, exist_ok=True)
+    path = benchmark_dir / f"{name}.json"
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to: {path}")
+
+
+def load_results(name):
+    path = benchmark_dir / f"{name}.json"
+    if not path.exists():
+        print(f"    ERR: baseline not found: {path}")
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_results(results):
+    print("")
+    print(f"{'strategy':<32s} {'candles/s':>12s} {'indicators':>12s} {'entry':>12s} {'exit':>12s} {'peak MB':>10s}")
+    for key, r in results['strategies'].items():
+        if 'error' in r:
+            print(f"{key:<32s} ERROR: {r['error']}")
+            continue
+        print(f"{key:<32s} {r['candles_per_sec']:>12.0f} {r['indicators_candles_per_sec']:>12.0f} "
+              f"{r['entry_candles_per_sec']:>12.0f} {r['exit_candles_per_sec']:>12.0f} {r['peak_mb']:>10.1f}")
+
+
+# compare throughput and memory against a baseline. Returns the number of regressions
+def compare_results(results, baseline, tolerance) -> int:
+    if baseline['settings'] != results['settings']:
+        print("    WARN: baseline was generated with different settings, comparison may not be meaningful")
+
+    print("")
+    print(f"{'strategy':<32s} {'baseline c/s':>14s} {'current c/s':>14s} {'change':>10s} {'peak MB':>16s}")
+
+    num_regressions = 0
+    for key, r in results['strategies'].items():
+        b = baseline['strategies'].get(key, None)
+        if (b is None) or ('error' in b) or ('error' in r):
+            continue
+
+        change = (r['candles_per_sec'] - b['candles_per_sec']) / max(b['candles_per_sec'], 1e-9)
+        mem_change = (r['peak_mb'] - b['peak_mb']) / max(b['peak_mb'], 1e-9) if b['peak_mb'] > 0 else 0.0
+
+        flag = ""
+        if (change < -tolerance) or (mem_change > tolerance):
+            flag = "  <-- REGRESSION"
+            num_regressions += 1
+
+        print(f"{key:<32s} {b['candles_per_sec']:>14.0f} {r['candles_per_sec']:>14.0f} {change:>+10.1%} "
+              f"{b['peak_mb']:>7.1f}->{r['peak_mb']:<7.1f}{flag}")
+
+    return num_regressions
+
+
+# ---------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark strategy dataframe processing with synthetic data")
+    parser.add_argument('--exchange', default='binance', help="exchange folder containing the strategies")
+    parser.add_argument('--strategies', nargs='*', default=None, help="strategy names (default: exchange defaults)")
+    parser.add_argument('--pairs', type=int, default=4, help="number of pairs")
+    parser.add_argument('--candles', type=int, default=10000, help="number of candles per pair")
+    parser.add_argument('--timeframe', default='5m', help="timeframe (overridden by the strategy's timeframe)")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the synthetic data")
+    parser.add_argument('--no-memory', action='store_true', help="do not track peak memory (faster)")
+    parser.add_argument('--name', default='latest', help="name of the results file")
+    parser.add_argument('--save-baseline', default='', help="also save the results as the named baseline")
+    parser.add_argument('--compare', default='', help="compare against the named baseline")
+    parser.add_argument('--tolerance', type=float, default=0.10, help="allowed fractional slowdown/memory growth")
+    args = parser.parse_args()
+
+    strategies = args.strategies if args.strategies else default_strategies.get(args.exchange, [])
+    if len(strategies) == 0:
+        print(f"    ERR: no strategies specified for exchange: {args.exchange}")
+        sys.exit(1)
+
+    if args.pairs > len(default_pairs):
+        pairs = default_pairs + [f"SYN{i}/USD" for i in range(args.pairs - len(default_pairs))]
+    else:
+        pairs = default_pairs[:args.pairs]
+
+    results = {
+        'created': datetime.now().isoformat(),
+        'settings': {'exchange': args.exchange, 'pairs': len(pairs), 'candles': args.candles, 'seed': args.seed},
+        'strategies': {}
+    }
+
+    for name in strategies:
+        key = f"{args.exchange}/{name}"
+        print(f"Benchmarking {key} ({len(pairs)} pairs x {args.candles} candles)...")
+        try:
+            results['strategies'][key] = benchmark_strategy(args.exchange, name, pairs, args.candles, args.timeframe,
+                                                            args.seed, not args.no_memory)
+        except Exception as e:
+            print(f"    ERR: {key} failed: {e}")
+            results['strategies'][key] = {'error': str(e)}
+
+    print_results(results)
+    save_results(results, args.name)
+    if len(args.save_baseline) > 0:
+        save_results(results, args.save_baseline)
+
+    if len(args.compare) > 0:
+        baseline = load_results(args.compare)
+        if baseline is not None:
+            num_regressions = compare_results(results, baseline, args.tolerance)
+            if num_regressions > 0:
+                print(f"{num_regressions} regression(s) found")
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,484 @@
+# Local caching proxy for exchange market data (OHLCV candles and market metadata)
+#
+# Some of the exchange config files point ccxt at http://127.0.0.1:8200/<exchange> for backtesting/hyperopt.
+# This script implements that service:
+#   - OHLCV (candle) requests are answered from an on-disk columnar cache (Feather files, one per
+#     exchange/symbol/timeframe). Only the part of the requested range that is not already cached is fetched from the
+#     exchange, and only closed candles are stored
+#   - other public (market metadata) requests are cached as raw responses, and refreshed after metadata_ttl seconds
+#   - signed (private) requests are passed straight through and never cached
+#   - everything is asynchronous (aiohttp), so parallel hyperopt workers and dry-run bots on the same host can share
+#     a single warm cache. Cache files are written atomically, so several proxy processes can share a cache directory
+#   - in offline mode (--offline) the exchange is never contacted, and requests are answered purely from the cache.
+#     Requests for data that is not cached (including candle ranges outside the cached coverage) fail with a 503
+#
+# Usage:
+#    python DataProxy.py [--port 8200] [--cache-dir <dir>] [--offline]
+#
+# Then, in the exchange section of the freqtrade config file:
+#    "ccxt_config": {
+#      "urls": {
+#        "api": {
+#          "public": "http://127.0.0.1:8200/kucoin",
+#          "private": "http://127.0.0.1:8200/kucoin"
+#        }
+#      }
+#    }
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import pandas as pd
+from aiohttp import web, ClientSession, ClientTimeout, ClientError
+
+# base URLs of the supported exchanges (prefix of the request path selects the exchange)
+upstream_urls = {
+    'kucoin': 'https://api.kucoin.com',
+    'binance': 'https://api.binance.com',
+    'binanceus': 'https://api.binance.us',
+}
+
+# headers that identify a signed (private) request
+private_headers = ('kc-api-key', 'kc-api-sign', 'x-mbx-apikey')
+
+# headers that must not be copied between requests/responses
+hop_headers = ('host', 'content-length', 'content-encoding', 'transfer-encoding', 'connection', 'keep-alive')
+
+
+# merge overlapping/adjacent intervals ([start, end], inclusive)
+def merge_intervals(intervals, step) -> list:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and (start <= merged[-1][1] + step):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+# returns the first uncovered point (multiple of step) in [start, end], or None if the range is fully covered
+def first_missing(intervals, start, end, step):
+    point = -(-start // step) * step
+    for i_start, i_end in intervals:
+        if i_start > point:
+            break
+        if i_end >= point:
+            point = (i_end // step + 1) * step
+    return point if point <= end else None
+
+
+# Describes the candle endpoint of an exchange: the request parameters and the layout of each row in the response
+class OHLCVAdapter():
+    path = ""  # path of the candle endpoint (after the exchange prefix)
+    columns = []  # (name, type) of each field in a row
+    time_unit = 1  # number of row time units per second
+    newest_first = False  # order of rows in the response
+    max_rows = 1000  # maximum number of rows returned per request
+    timeframes = {}  # exchange timeframe string -> seconds
+
+    # returns (symbol, timeframe, tf_secs, start, end, limit) for a request. start/end may be None
+    def parse_request(self, query):
+        return None
+
+    # returns the query to send to the exchange to fetch [start, end]
+    def upstream_query(self, query, start, end) -> dict:
+        return dict(query)
+
+    def extract_rows(self, payload) -> list:
+        return []
+
+    def wrap_rows(self, rows):
+        return rows
+
+    def to_int(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+
+class KucoinAdapter(OHLCVAdapter):
+    path = "api/v1/market/candles"
+    columns = [('time', int), ('open', str), ('close', str), ('high', str), ('low', str), ('volume', str),
+               ('turnover', str)]
+    time_unit = 1
+    newest_first = True
+    max_rows = 1500
+    timeframes = {'1min': 60, '3min': 180, '5min': 300, '15min': 900, '30min': 1800, '1hour': 3600,
+                  '2hour': 7200, '4hour': 14400, '6hour': 21600, '8hour': 28800, '12hour': 43200,
+                  '1day': 86400, '1week': 604800}
+
+    def parse_request(self, query):
+        timeframe = query.get('type', '')
+        if ('symbol' not in query) or (timeframe not in self.timeframes):
+            return None
+        start = self.to_int(query.get('startAt', None))
+        end = self.to_int(query.get('endAt', None))
+        # kucoin treats 0 as 'not specified'
+        start = start if start else None
+        end = end if end else None
+        return query['symbol'], timeframe, self.timeframes[timeframe], start, end, self.max_rows
+
+    def upstream_query(self, query, start, end) -> dict:
+        q = dict(query)
+        q['startAt'] = str(start)
+        q['endAt'] = str(end)
+        return q
+
+    def extract_rows(self, payload) -> list:
+        if isinstance(payload, dict) and (str(payload.get('code', '')) == '200000'):
+            return payload.get('data', [])
+        return None
+
+    def wrap_rows(self, rows):
+        return {'code': '200000', 'data': rows}
+
+
+class BinanceAdapter(OHLCVAdapter):
+    path = "api/v3/klines"
+    columns = [('time', int), ('open', str), ('high', str), ('low', str), ('close', str), ('volume', str),
+               ('close_time', int), ('quote_volume', str), ('trades', int), ('taker_base', str),
+               ('taker_quote', str), ('ignore', str)]
+    time_unit = 1000
+    newest_first = False
+    max_rows = 1000
+    timeframes = {'1m': 60, '3m': 180, '5m': 300, '15m': 900, '30m': 1800, '1h': 3600, '2h': 7200,
+                  '4h': 14400, '6h': 21600, '8h': 28800, '12h': 43200, '1d': 86400, '3d': 259200, '1w': 604800}
+
+    def parse_request(self, query):
+        timeframe = query.get('interval', '')
+        if ('symbol' not in query) or (timeframe not in self.timeframes):
+            return None
+        limit = self.to_int(query.get('limit', None)) or 500
+        return (query['symbol'], timeframe, self.timeframes[timeframe],
+                self.to_int(query.get('startTime', None)), self.to_int(query.get('endTime', None)),
+                min(limit, self.max_rows))
+
+    def upstream_query(self, query, start, end) -> dict:
+        q = dict(query)
+        q['startTime'] = str(start)
+        q['endTime'] = str(end)
+        q['limit'] = str(self.max_rows)
+        return q
+
+    def extract_rows(self, payload) -> list:
+        return payload if isinstance(payload, list) else None
+
+
+adapters = {
+    'kucoin': KucoinAdapter(),
+    'binance': BinanceAdapter(),
+    'binanceus': BinanceAdapter(),
+}
+
+
+# On-disk cache of candles for one exchange/symbol/timeframe.
+# Candles are stored in a Feather file (columnar), the ranges that have been fetched from the exchange are stored
+# in a JSON sidecar file, so that genuine gaps in the exchange data do not cause repeated fetches
+class CandleSeries():
+
+    def __init__(self, base_path, adapter: OHLCVAdapter, step):
+        self.base_path = base_path
+        self.adapter = adapter
+        self.step = step  # candle period, in row time units
+        self.data = None
+        self.coverage = []
+        self.mtime = 0.0
+        self.lock = asyncio.Lock()
+
+    def data_path(self):
+        return self.base_path + ".feather"
+
+    def coverage_path(self):
+        return self.base_path + ".json"
+
+    # (re-)load from disk if the files have been changed (e.g. by another proxy process)
+    def load(self):
+        path = self.coverage_path()
+        mtime = os.path.getmtime(path) if os.path.exists(path) else 0.0
+        if (self.data is not None) and (mtime == self.mtime):
+            return
+
+        names = [name for name, _ in self.adapter.columns]
+        self.data = pd.DataFrame({name: pd.Series(dtype=('int64' if t is int else 'object'))
+                                  for name, t in self.adapter.columns})[names]
+        self.coverage = []
+        self.mtime = mtime
+        if mtime == 0.0:
+            return
+
+        try:
+            with open(path, "r") as f:
+                self.coverage = json.load(f)
+            self.data = pd.read_feather(self.data_path())
+        except Exception as e:
+            print(f"    WARN: could not read cache ({self.base_path}): {e}")
+            self.coverage = []
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.base_path), exist_ok=True)
+        tmp_suffix = f".tmp{os.getpid()}"
+
+        self.data.reset_index(drop=True).to_feather(self.data_path() + tmp_suffix)
+        os.replace(self.data_path() + tmp_suffix, self.data_path())
+
+        # coverage is written last, so readers never see coverage for data that is not there
+        with open(self.coverage_path() + tmp_suffix, "w") as f:
+            json.dump(self.coverage, f)
+        os.replace(self.coverage_path() + tmp_suffix, self.coverage_path())
+        self.mtime = os.path.getmtime(self.coverage_path())
+
+    # add rows (in exchange format) covering [start, end]. Only closed candles should be supplied
+    def add(self, rows, start, end):
+        if len(rows) > 0:
+            new = pd.DataFrame([[t(v) for (_, t), v in zip(self.adapter.columns, row)] for row in rows],
+                               columns=[name for name, _ in self.adapter.columns])
+            data = pd.concat([self.data, new], ignore_index=True)
+            data = data.drop_duplicates(subset='time', keep='last').sort_values('time')
+            self.data = data.reset_index(drop=True)
+
+        if end >= start:
+            self.coverage = merge_intervals(self.coverage + [[start, end]], self.step)
+
+    def missing(self, start, end):
+        return first_missing(self.coverage, start, end, self.step)
+
+    # returns rows (in exchange format) in [start, end]
+    def select(self, start, end) -> list:
+        times = self.data['time']
+        df = self.data[(times >= start) & (times <= end)]
+        return self.to_rows(df)
+
+    def latest(self, limit) -> list:
+        return self.to_rows(self.data.iloc[-limit:])
+
+    def to_rows(self, df) -> list:
+        rows = []
+        for row in df.itertuples(index=False):
+            rows.append([t(v) for (_, t), v in zip(self.adapter.columns, row)])
+        return rows
+
+
+class DataProxy():
+
+    cache_dir = ""
+    offline = False
+    metadata_ttl = 3600  # seconds before cached metadata is refreshed (when online)
+    request_timeout = 30
+
+    def __init__(self, cache_dir, offline=False, metadata_ttl=3600):
+        self.cache_dir = cache_dir.rstrip("/") + "/"
+        self.offline = offline
+        self.metadata_ttl = metadata_ttl
+
+        self.series = {}  # (exchange, symbol, timeframe) -> CandleSeries
+        self.session = None
+        self.stats = {'ohlcv_hits': 0, 'ohlcv_fetches': 0, 'meta_hits': 0, 'meta_fetches': 0, 'passthrough': 0}
+
+    # ---------------------------
+
+    async def start(self, app):
+        if not self.offline:
+            self.session = ClientSession(timeout=ClientTimeout(total=self.request_timeout), auto_decompress=True)
+
+    async def stop(self, app):
+        if self.session is not None:
+            await self.session.close()
+        print(f"    cache stats: {self.stats}")
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_route('*', '/{exchange}/{path:.*}', self.handle)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        return app
+
+    # ---------------------------
+
+    async def fetch(self, exchange, path, query, method='GET', headers=None, body=None):
+        url = upstream_urls[exchange] + "/" + path
+        async with self.session.request(method, url, params=query, headers=headers, data=body) as resp:
+            data = await resp.read()
+            out_headers = {k: v for k, v in resp.headers.items() if k.lower() not in hop_headers}
+            return resp.status, out_headers, data
+
+    def json_response(self, payload, status=200):
+        return web.Response(body=json.dumps(payload).encode(), status=status, content_type='application/json')
+
+    def error_response(self, msg, status=503):
+        return web.Response(text=json.dumps({'code': str(status), 'msg': msg}), status=status,
+                            content_type='application/json')
+
+    # ---------------------------
+
+    async def handle(self, request: web.Request):
+        exchange = request.match_info['exchange']
+        path = request.match_info['path']
+
+        if exchange not in upstream_urls:
+            return self.error_response(f"unknown exchange: {exchange}", status=404)
+
+        query = dict(request.query)
+        is_private = any(h in request.headers for h in private_headers) or (request.method != 'GET')
+
+        try:
+            if is_private:
+                return await self.handle_passthrough(request, exchange, path, query)
+
+            adapter = adapters.get(exchange, None)
+            if (adapter is not None) and (path.strip("/") == adapter.path):
+                return await self.handle_ohlcv(exchange, path, query, adapter)
+
+            return await self.handle_metadata(exchange, path, query)
+
+        except (ClientError, asyncio.TimeoutError) as e:
+            return self.error_response(f"upstream error: {e}", status=502)
+
+    async def handle_passthrough(self, request, exchange, path, query):
+        if self.offline:
+            return self.error_response("private requests are not available offline")
+
+        self.stats['passthrough'] += 1
+        headers = {k: v for k, v in request.headers.items() if k.lower() not in hop_headers}
+        body = await request.read()
+        status, headers, data = await self.fetch(exchange, path, query, method=request.method,
+                                                 headers=headers, body=body)
+        return web.Response(body=data, status=status, headers=headers)
+
+    # ---------------------------
+    # market metadata (exchange info, symbols, currencies etc.)
+
+    def metadata_path(self, exchange, path, query):
+        key = hashlib.sha1((path + "?" + json.dumps(query, sort_keys=True)).encode()).hexdigest()
+        return self.cache_dir + exchange + "/meta/" + key + ".json"
+
+    async def handle_metadata(self, exchange, path, query):
+        file_path = self.metadata_path(exchange, path, query)
+        loop = asyncio.get_running_loop()
+
+        fresh = os.path.exists(file_path) and ((time.time() - os.path.getmtime(file_path)) < self.metadata_ttl)
+        if os.path.exists(file_path) and (fresh or self.offline):
+            self.stats['meta_hits'] += 1
+            data = await loop.run_in_executor(None, Path(file_path).read_bytes)
+            return web.Response(body=data, status=200, content_type='application/json')
+
+        if self.offline:
+            return self.error_response(f"not cached: {path}")
+
+        self.stats['meta_fetches'] += 1
+        status, headers, data = await self.fetch(exchange, path, query)
+        if status == 200:
+            await loop.run_in_executor(None, self.write_file, file_path, data)
+        return web.Response(body=data, status=status, headers=headers)
+
+    def write_file(self, file_path, data):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        tmp_path = file_path + f".tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+
+    # ---------------------------
+    # OHLCV
+
+    def get_series(self, exchange, adapter, symbol, timeframe, tf_secs) -> CandleSeries:
+        key = (exchange, symbol, timeframe)
+        if key not in self.series:
+            base_path = self.cache_dir + exchange + "/ohlcv/" + symbol.replace("/", "_") + "-" + timeframe
+            self.series[key] = CandleSeries(base_path, adapter, tf_secs * adapter.time_unit)
+        return self.series[key]
+
+    async def handle_ohlcv(self, exchange, path, query, adapter: OHLCVAdapter):
+        params = adapter.parse_request(query)
+        if params is None:
+            return await self.handle_metadata(exchange, path, query)
+
+        symbol, timeframe, tf_secs, start, end, limit = params
+        series = self.get_series(exchange, adapter, symbol, timeframe, tf_secs)
+        step = series.step
+        loop = asyncio.get_running_loop()
+
+        # last candle that has closed, in row time units
+        now = int(time.time()) * adapter.time_unit
+        last_closed = ((now // step) - 1) * step
+
+        if end is None:
+            end = now
+        if start is None:
+            start = end - (limit - 1) * step
+
+        # one fetch per series at a time, so concurrent clients do not duplicate requests
+        async with series.lock:
+            await loop.run_in_executor(None, series.load)
+
+            extra_rows = []
+            missing = series.missing(start, min(end, last_closed))
+            if (missing is not None) and self.offline:
+                return self.error_response(f"not cached: {symbol} {timeframe} from {missing}")
+
+            if missing is not None:
+                self.stats['ohlcv_fetches'] += 1
+                # fetch only the part of the range that is not cached
+                fetch_start = missing
+                status, headers, data = await self.fetch(exchange, path, adapter.upstream_query(query, fetch_start, end))
+                try:
+                    rows = adapter.extract_rows(json.loads(data))
+                except ValueError:
+                    rows = None
+                if (status != 200) or (rows is None):
+                    return web.Response(body=data, status=status, headers=headers)
+
+                closed = [row for row in rows if int(row[0]) <= last_closed]
+                extra_rows = [row for row in rows if int(row[0]) > last_closed]
+
+                # work out the range the response actually covers (the exchange may truncate it)
+                cov_start, cov_end = fetch_start, min(end, last_closed)
+                if len(rows) >= adapter.max_rows:
+                    times = [int(row[0]) for row in rows]
+                    if adapter.newest_first:
+                        cov_start = min(times)
+                    else:
+                        cov_end = min(cov_end, max(times))
+
+                series.add(closed, cov_start, cov_end)
+                await loop.run_in_executor(None, series.save)
+            else:
+                self.stats['ohlcv_hits'] += 1
+
+            rows = series.select(start, end)
+
+        # add any candles that have not closed yet (never cached)
+        rows = rows + [[t(v) for (_, t), v in zip(adapter.columns, row)] for row in extra_rows
+                       if start <= int(row[0]) <= end]
+
+        if adapter.newest_first:
+            rows = rows[::-1][:limit]
+        else:
+            rows = rows[:limit]
+
+        return self.json_response(adapter.wrap_rows(rows))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local caching proxy for exchange market data")
+    parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    parser.add_argument('--port', type=int, default=8200, help="port to listen on")
+    parser.add_argument('--cache-dir', default=str(Path(__file__).parent / 'data_cache'),
+                        help="directory used for cached data")
+    parser.add_argument('--offline', action='store_true', help="never contact the exchange, use cached data only")
+    parser.add_argument('--metadata-ttl', type=int, default=3600, help="seconds before cached metadata is refreshed")
+    args = parser.parse_args()
+
+    proxy = DataProxy(args.cache_dir, offline=args.offline, metadata_ttl=args.metadata_ttl)
+    mode = "offline" if args.offline else "online"
+    print(f"DataProxy ({mode}) listening on {args.host}:{args.port}, cache: {args.cache_dir}")
+    web.run_app(proxy.make_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
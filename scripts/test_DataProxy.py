@@ -0,0 +1,108 @@
+# Tests for the offline mode of DataProxy: requests are answered from a cache written to a temporary directory, and
+# the exchange is never contacted
+#
+# Usage (from the repository root):
+#    python -m pytest scripts/test_DataProxy.py
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from aiohttp.test_utils import TestClient, TestServer
+
+sys.path.append(str(Path(__file__).parent))
+
+import DataProxy
+
+symbol = 'BTC-USDT'
+timeframe = '5min'
+step = 300
+t0 = 1600000200  # first cached candle (multiple of step)
+num_candles = 10
+candles_path = 'api/v1/market/candles'
+symbols_path = 'api/v1/symbols'
+symbols_payload = {'code': '200000', 'data': [{'symbol': symbol, 'baseCurrency': 'BTC', 'quoteCurrency': 'USDT'}]}
+
+
+# writes a kucoin candle series (Feather file + coverage sidecar) and a cached metadata response
+def write_cache(cache_dir):
+    proxy = DataProxy.DataProxy(cache_dir)
+    adapter = DataProxy.adapters['kucoin']
+
+    series = DataProxy.CandleSeries(proxy.cache_dir + "kucoin/ohlcv/" + symbol + "-" + timeframe, adapter, step)
+    series.load()
+    rows = [[t0 + i * step, '1.0', '1.5', '2.0', '0.5', '10.0', '15.0'] for i in range(num_candles)]
+    series.add(rows, t0, t0 + (num_candles - 1) * step)
+    series.save()
+
+    proxy.write_file(proxy.metadata_path('kucoin', symbols_path, {}), json.dumps(symbols_payload).encode())
+
+
+# runs the requests against an offline proxy, and returns [(status, payload)] plus the upstream calls made
+def run_offline(cache_dir, monkeypatch, requests):
+    upstream_calls = []
+
+    async def fetch(self, exchange, path, query, method='GET', headers=None, body=None):
+        upstream_calls.append((exchange, path, query))
+        raise AssertionError("exchange contacted in offline mode")
+
+    monkeypatch.setattr(DataProxy.DataProxy, 'fetch', fetch)
+
+    async def run():
+        proxy = DataProxy.DataProxy(cache_dir, offline=True)
+        results = []
+        async with TestClient(TestServer(proxy.make_app())) as client:
+            for path, query in requests:
+                resp = await client.get(path, params=query)
+                results.append((resp.status, await resp.json()))
+        assert proxy.session is None
+        return results, proxy.stats
+
+    results, stats = asyncio.run(run())
+    return results, stats, upstream_calls
+
+
+def candle_query(start, end):
+    return {'symbol': symbol, 'type': timeframe, 'startAt': str(start), 'endAt': str(end)}
+
+
+def test_offline_served_from_cache(tmp_path, monkeypatch):
+    write_cache(str(tmp_path))
+
+    end = t0 + (num_candles - 1) * step
+    results, stats, upstream_calls = run_offline(str(tmp_path), monkeypatch, [
+        ('/kucoin/' + candles_path, candle_query(t0, end)),
+        ('/kucoin/' + symbols_path, {}),
+    ])
+
+    (candle_status, candles), (meta_status, meta) = results
+    assert candle_status == 200
+    assert candles['code'] == '200000'
+    assert [row[0] for row in candles['data']] == [end - i * step for i in range(num_candles)]  # newest first
+    assert candles['data'][0][1:] == ['1.0', '1.5', '2.0', '0.5', '10.0', '15.0']
+
+    assert meta_status == 200
+    assert meta == symbols_payload
+
+    assert stats['ohlcv_hits'] == 1 and stats['meta_hits'] == 1
+    assert stats['ohlcv_fetches'] == 0 and stats['meta_fetches'] == 0
+    assert upstream_calls == []
+
+
+def test_offline_outside_coverage(tmp_path, monkeypatch):
+    write_cache(str(tmp_path))
+
+    end = t0 + (num_candles - 1) * step
+    results, stats, upstream_calls = run_offline(str(tmp_path), monkeypatch, [
+        ('/kucoin/' + candles_path, candle_query(t0 - 5 * step, end)),  # starts before the cached range
+        ('/kucoin/' + candles_path, candle_query(end + step, end + 5 * step)),  # after the cached range
+        ('/kucoin/api/v1/currencies', {}),  # metadata that is not cached
+    ])
+
+    for status, payload in results:
+        assert status == 503
+        assert 'not cached' in payload['msg']
+
+    assert stats['ohlcv_fetches'] == 0 and stats['meta_fetches'] == 0
+    assert upstream_calls == []